@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Asset fingerprinting - content-hashed names for the static files templates use
+
+Templates link stylesheets, scripts and images by fixed root-relative paths
+such as /src/css/main_style.css, which cannot be given long-lived cache
+headers. With an assets directory (the site root those paths are relative
+to), every href="/...", src="/..." and url(/...) reference to a file in it
+is rewritten to a name that contains a hash of the file's content:
+
+    /src/css/main_style.css  ->  /src/css/main_style.3f2a9c1b7e.css
+
+and the file is copied under that name into the output directory. A
+changed asset gets a new name, so browsers never see a stale copy, and old
+names stay valid for pages that are still cached.
+
+References are rewritten in the template text, once per compiled template
+(see batch.TemplateStore), so rendering a page costs nothing extra. Asset
+hashes are kept in a small JSON file under .cache/ together with the mtime
+and size of each file, so unchanged assets are never hashed again.
+
+    python3 page_maker.py batch posts.jsonl --assets-dir ../blog
+"""
+
+import hashlib
+import json
+import os
+import re
+import shutil
+from urllib.parse import unquote
+
+from page_writer import atomic_write
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_HASH_CACHE_DIR = os.path.join(BASE_DIR, '.cache')
+
+# Hex digits of the SHA-256 in fingerprinted names
+DEFAULT_HASH_LENGTH = 10
+
+# Bump when the cache format changes; older cache files are then ignored
+HASH_CACHE_VERSION = 1
+
+# Root-relative URLs (not protocol-relative //host/...) in href and src
+# attributes and in CSS url(); the query string or fragment is kept as is
+_REFERENCE_RE = re.compile(r"""
+    \b(?:href|src)\s*=\s*(?P<quote>["'])(?P<url>/(?!/)[^"'?\#\s]+)(?:[?\#][^"']*)?(?P=quote)
+    |
+    \burl\(\s*(?P<css_quote>["']?)(?P<css_url>/(?!/)[^"'?\#\s)]+)(?:[?\#][^"')]*)?(?P=css_quote)\s*\)
+""", re.VERBOSE | re.IGNORECASE)
+
+# Links to pages are not assets
+PAGE_EXTENSIONS = ('.html', '.htm')
+
+# Missing asset URLs named in the summary
+MAX_MISSING_SHOWN = 5
+
+_HASH_CHUNK = 1024 * 1024
+
+
+def default_hash_cache_path(assets_dir, cache_dir=DEFAULT_HASH_CACHE_DIR):
+    """One hash cache per assets directory, under cache_dir (.cache/)"""
+    root = os.path.abspath(assets_dir)
+    digest = hashlib.sha1(root.encode('utf-8')).hexdigest()[:12]
+    return os.path.join(cache_dir, f"asset_hashes-{digest}.json")
+
+
+def fingerprinted_url(url, digest):
+    """'/src/css/a.min.css' with digest 'abc' -> '/src/css/a.min.abc.css'"""
+    directory, _, name = url.rpartition('/')
+    stem, dot, extension = name.rpartition('.')
+    if not stem:
+        return f"{directory}/{name}.{digest}"
+    return f"{directory}/{stem}.{digest}{dot}{extension}"
+
+
+class AssetHashCache:
+    """
+    Persistent SHA-256 of the files under an assets directory.
+
+    Entries map the '/'-separated relative path to (mtime_ns, size, hash);
+    a file is read again only when its mtime or size changed. With
+    persistent=False the hashes are kept for this process only.
+
+    Attributes:
+        hits: Hashes answered from the cache
+        misses: Files that had to be read and hashed
+    """
+
+    def __init__(self, assets_dir, cache_path=None, persistent=True):
+        self.assets_dir = assets_dir
+        self.cache_path = cache_path or default_hash_cache_path(assets_dir)
+        self.persistent = persistent
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self._dirty = False
+        if persistent:
+            self._load()
+
+    def _load(self):
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get('version') != HASH_CACHE_VERSION:
+            return
+        if data.get('root') != os.path.abspath(self.assets_dir):
+            return
+        self.entries = {name: tuple(entry) for name, entry in data.get('assets', {}).items()}
+
+    def save(self):
+        """Atomically write the cache file, if anything changed"""
+        if not self._dirty or not self.persistent:
+            return
+        with atomic_write(self.cache_path, fsync=True, encoding='utf-8') as f:
+            json.dump({
+                'version': HASH_CACHE_VERSION,
+                'root': os.path.abspath(self.assets_dir),
+                'assets': {name: list(self.entries[name]) for name in sorted(self.entries)},
+            }, f, ensure_ascii=False, separators=(',', ':'))
+        self._dirty = False
+
+    def digest(self, relative_path):
+        """
+        SHA-256 of an asset.
+
+        Args:
+            relative_path: '/'-separated path under the assets directory
+
+        Raises:
+            OSError: If the file cannot be read
+        """
+        path = os.path.join(self.assets_dir, *relative_path.split('/'))
+        stat = os.stat(path)
+        entry = self.entries.get(relative_path)
+        if entry is not None and entry[:2] == (stat.st_mtime_ns, stat.st_size):
+            self.hits += 1
+            return entry[2]
+
+        self.misses += 1
+        sha256 = hashlib.sha256()
+        with open(path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            for chunk in iter(lambda: f.read(_HASH_CHUNK), b''):
+                sha256.update(chunk)
+        digest = sha256.hexdigest()
+        self.entries[relative_path] = (stat.st_mtime_ns, stat.st_size, digest)
+        self._dirty = True
+        return digest
+
+
+class AssetPipeline:
+    """
+    Rewrites asset references in template text and publishes the
+    fingerprinted files.
+
+    Every asset is looked up once per pipeline: later references reuse the
+    first answer, so a batch stats each asset once however many templates
+    use it.
+
+    Attributes:
+        assets: URL -> fingerprinted URL of every asset found
+        missing: URLs that did not name a file in the assets directory;
+            their references are left unchanged
+        copied: Fingerprinted files written to the output directory
+        references: References rewritten
+    """
+
+    def __init__(self, assets_dir, output_dir, cache_path=None, hash_length=DEFAULT_HASH_LENGTH,
+                 persistent=True):
+        self.assets_dir = assets_dir
+        self.output_dir = output_dir
+        self.hash_length = hash_length
+        self.hashes = AssetHashCache(assets_dir, cache_path, persistent)
+        self.assets = {}
+        self.missing = set()
+        self.copied = 0
+        self.references = 0
+
+    def fingerprint(self, url):
+        """
+        Fingerprinted URL of an asset, copying the file into the output
+        directory the first time it is seen.
+
+        Returns:
+            The new URL, or None when the URL names a page or no file in
+            the assets directory
+        """
+        if url.lower().endswith(PAGE_EXTENSIONS):
+            return None
+        if url in self.assets:
+            return self.assets[url]
+        if url in self.missing:
+            return None
+
+        relative_path = os.path.normpath(unquote(url).lstrip('/')).replace(os.sep, '/')
+        source = os.path.join(self.assets_dir, *relative_path.split('/'))
+        if relative_path.startswith('..') or not os.path.isfile(source):
+            self.missing.add(url)
+            return None
+
+        try:
+            digest = self.hashes.digest(relative_path)
+            new_url = fingerprinted_url(url, digest[:self.hash_length])
+            self._publish(source, unquote(new_url).lstrip('/'))
+        except OSError:
+            self.missing.add(url)
+            return None
+        self.assets[url] = new_url
+        return new_url
+
+    def _publish(self, source, relative_path):
+        # Same name, same content: an existing copy of the right size is kept
+        target = os.path.join(self.output_dir, *relative_path.split('/'))
+        try:
+            if os.path.getsize(target) == os.path.getsize(source):
+                return
+        except OSError:
+            pass
+        with open(source, 'rb') as src, atomic_write(target) as dst:
+            shutil.copyfileobj(src, dst)
+        self.copied += 1
+
+    def rewrite(self, text):
+        """
+        Replace the asset references in template text.
+
+        Returns:
+            The rewritten text; the same object when nothing was replaced
+        """
+        parts = []
+        pos = 0
+        for match in _REFERENCE_RE.finditer(text):
+            group = 'url' if match.group('url') is not None else 'css_url'
+            new_url = self.fingerprint(match.group(group))
+            if new_url is None:
+                continue
+            parts.append(text[pos:match.start(group)])
+            parts.append(new_url)
+            pos = match.end(group)
+            self.references += 1
+        if not parts:
+            return text
+        parts.append(text[pos:])
+        return ''.join(parts)
+
+    def save(self):
+        self.hashes.save()
+
+    def summary(self):
+        summary = (
+            f"Fingerprinted {len(self.assets)} asset(s): {self.hashes.misses} hashed, "
+            f"{self.copied} copied, {self.references} reference(s) rewritten"
+        )
+        if self.missing:
+            shown = sorted(self.missing)[:MAX_MISSING_SHOWN]
+            more = len(self.missing) - len(shown)
+            summary += f"; {len(self.missing)} not found: {', '.join(shown)}"
+            if more:
+                summary += f" and {more} more"
+        return summary
@@ -0,0 +1,987 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Batch page generation - render many pages from a manifest without the GUI
+
+A manifest is a JSONL or CSV file with one page per row. Every row names the
+template and the output filename; all other columns are field values keyed by
+the class name of the <p class="..."> tag they replace.
+
+    python3 page_maker.py batch posts.jsonl
+    python3 page_maker.py batch posts.jsonl --jobs 4
+    python3 page_maker.py batch posts.jsonl --incremental --prune
+    python3 page_maker.py batch posts.jsonl --writers 8 --fsync
+    python3 page_maker.py batch posts.jsonl --listings --incremental
+    python3 page_maker.py batch posts.jsonl --minify --gzip --jobs 0
+    python3 page_maker.py batch posts.jsonl --assets-dir ../blog
+    python3 page_maker.py batch posts.jsonl --search-index --incremental
+    python3 page_maker.py batch posts.jsonl --report report.json --trace trace.json
+"""
+
+import argparse
+import csv
+import hashlib
+import io
+import json
+import os
+import sys
+import time
+from itertools import islice
+
+import instrumentation
+from assets import DEFAULT_HASH_CACHE_DIR, AssetPipeline, default_hash_cache_path
+from listings import (DEFAULT_LISTING_TEMPLATE, DEFAULT_PAGE_SIZE, LISTING_POLICY, ListingSpec,
+                      ListingSpool, iter_listing_pages)
+from html_utils import (DEFAULT_CACHE_DIR, DEFAULT_EXTRACTOR, DEFAULT_POLICY_KEY, ESCAPE, ESCAPERS,
+                        EXTRACTORS, RAW, RENDERER_VERSION, MappedTemplate, TemplateCache)
+from page_writer import AsyncPageWriter, atomic_write
+from postprocess import (GZIP_SUFFIX, SizeTotals, add_arguments as add_pipeline_arguments,
+                         pipeline_from_args, remove_gzip_sibling)
+from search_index import SearchIndex, SearchSpec
+from template_index import DEFAULT_INDEX_DIR, TemplateIndex, default_index_path
+from template_loader import TemplateLoader, uses_layout
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_TEMPLATES_DIR = os.path.join(BASE_DIR, 'templates')
+DEFAULT_OUTPUT_DIR = os.path.join(BASE_DIR, 'output')
+
+# Manifest columns that are not template fields
+RESERVED_COLUMNS = ('template', 'filename')
+
+# Rows handed to a worker process per task, and tasks queued per worker.
+# Together they bound how much of the manifest is held in memory at once.
+CHUNK_SIZE = 64
+TASKS_PER_WORKER = 4
+
+# The build manifest of an output directory sits next to it, e.g.
+# output.build.json for output/
+BUILD_MANIFEST_SUFFIX = '.build.json'
+
+# With a --cache-dir other than the default, the template index and asset
+# hashes are kept in this subdirectory of it, out of reach of the template
+# cache's LRU eviction
+CACHE_STATE_DIR = 'state'
+
+
+class MalformedRow(dict):
+    """
+    Empty row standing in for a manifest line that could not be read;
+    split_row raises its error, so it is reported like any other bad row
+    """
+
+    def __init__(self, error):
+        super().__init__()
+        self.error = error
+
+
+def read_manifest(manifest_path):
+    """
+    Stream the rows of a manifest file.
+
+    Args:
+        manifest_path: Path to a .jsonl (or .json lines) or .csv manifest
+
+    Yields:
+        (line_number, row) tuples where row is a dict of column -> value,
+        or a MalformedRow for a JSON line that is not a valid object
+    """
+    if manifest_path.lower().endswith('.csv'):
+        with open(manifest_path, 'r', encoding='utf-8', newline='') as f:
+            reader = csv.DictReader(f)
+            for row in reader:
+                yield reader.line_num, row
+        return
+
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                row = MalformedRow(f"invalid JSON: {getattr(e, 'msg', e)}")
+            if not isinstance(row, dict):
+                row = MalformedRow("expected a JSON object")
+            yield line_number, row
+
+
+def is_output_filename(filename):
+    """True if filename is relative and stays inside the output directory"""
+    if os.path.isabs(filename) or os.path.splitdrive(filename)[0]:
+        return False
+    return os.path.normpath(filename).split(os.sep)[0] != os.pardir
+
+
+def split_row(row):
+    """
+    Split a manifest row into its template name, output filename and fields.
+
+    Returns:
+        (template_name, filename, values) tuple; the filename gets the same
+        .html suffix the GUI adds
+
+    Raises:
+        ValueError: the row is a MalformedRow, template or filename is
+            missing, or the filename is absolute or points outside the
+            output directory
+    """
+    if isinstance(row, MalformedRow):
+        raise ValueError(row.error)
+    template_name = str(row.get('template') or '').strip()
+    filename = str(row.get('filename') or '').strip()
+    if not template_name:
+        raise ValueError("missing 'template'")
+    if not filename:
+        raise ValueError("missing 'filename'")
+
+    if not filename.endswith('.html'):
+        filename += '.html'
+    if not is_output_filename(filename):
+        raise ValueError(f"filename outside the output directory: {filename}")
+
+    values = {}
+    for column, value in row.items():
+        if column in RESERVED_COLUMNS or column is None:
+            continue
+        values[column] = '' if value is None else str(value)
+
+    return template_name, filename, values
+
+
+class TemplateStore:
+    """
+    Loads and compiles each template once per process.
+
+    Templates are resolved through a TemplateLoader, so layouts and partials
+    are flattened before compiling. With an AssetPipeline, the asset
+    references of each template are rewritten to fingerprinted names before
+    it is compiled, once per template rather than once per page.
+    """
+
+    def __init__(self, templates_dir=DEFAULT_TEMPLATES_DIR, compiled=None, cache=None,
+                 use_mmap=False, assets=None):
+        self.templates_dir = templates_dir
+        self.cache = cache if cache is not None else TemplateCache()
+        self.loader = TemplateLoader(templates_dir, cache=self.cache)
+        self.use_mmap = use_mmap
+        self.assets = assets
+        self._compiled = dict(compiled or {})
+
+    def get(self, template_name):
+        """
+        Return the compiled template for a template name or path: a
+        CompiledTemplate, or a MappedTemplate when use_mmap is set and the
+        template uses no layout directives (and no assets are rewritten)
+        """
+        compiled = self._compiled.get(template_name)
+        if compiled is None:
+            template_path = self.loader.template_path(template_name)
+            if self.use_mmap and self.assets is None and not uses_layout(template_path):
+                compiled = MappedTemplate(template_path)
+            else:
+                template, _, compiled = self.loader.load(template_name)
+                if self.assets is not None:
+                    with instrumentation.stage('assets'):
+                        rewritten = self.assets.rewrite(template)
+                    if rewritten is not template:
+                        _, compiled = self.cache.get(rewritten)
+            self._compiled[template_name] = compiled
+        return compiled
+
+    def discard(self, template_name):
+        """Drop a compiled template so the next get() reloads it"""
+        compiled = self._compiled.pop(template_name, None)
+        if isinstance(compiled, MappedTemplate):
+            compiled.close()
+
+    def preload(self, template_names):
+        """
+        Compile the given templates up front.
+
+        Returns:
+            Dict of template name -> error message for templates that could
+            not be loaded
+        """
+        failed = {}
+        for template_name in template_names:
+            try:
+                self.get(template_name)
+            except (OSError, ValueError) as e:
+                failed[template_name] = str(e)
+        return failed
+
+    def compiled(self):
+        """Snapshot of the compiled templates, for shipping to workers"""
+        return dict(self._compiled)
+
+    def close(self):
+        """Unmap memory-mapped templates"""
+        for compiled in self._compiled.values():
+            if isinstance(compiled, MappedTemplate):
+                compiled.close()
+        self._compiled = {}
+
+    def __len__(self):
+        return len(self._compiled)
+
+
+def write_page(output_dir, filename, compiled, values, escape_html=True, fsync=False):
+    """
+    Render a page straight into its file in the output directory.
+
+    The page is rendered into a temporary file that replaces the old page
+    only once it is complete (see atomic_write). A .gz sibling left by an
+    earlier compressed build is deleted.
+
+    Returns:
+        Number of bytes written
+    """
+    path = os.path.join(output_dir, filename)
+    with instrumentation.stage('write'):
+        with atomic_write(path, fsync) as f:
+            written = compiled.render_to(f, values, escape_html=escape_html)
+        remove_gzip_sibling(path)
+    instrumentation.count('pages_written')
+    instrumentation.count('bytes_written', written)
+    return written
+
+
+def write_output(output_dir, filename, compiled, values, escape_html=True, fsync=False, pipeline=None):
+    """
+    Write a page, through the output pipeline when one is given.
+
+    Without a pipeline the page is streamed into its file by write_page();
+    with one it is rendered to bytes first, then minified and compressed
+    (see postprocess.OutputPipeline).
+
+    Returns:
+        (bytes_written, sizes) where sizes is the PageSizes of the page, or
+        None without a pipeline
+    """
+    if pipeline is None:
+        return write_page(output_dir, filename, compiled, values, escape_html, fsync), None
+    with instrumentation.stage('write'):
+        data = render_page(compiled, values, escape_html)
+        sizes = pipeline.write(os.path.join(output_dir, filename), data, fsync)
+    instrumentation.count('pages_written')
+    instrumentation.count('bytes_written', sizes.written)
+    return sizes.written, sizes
+
+
+def render_page(compiled, values, escape_html=True):
+    """Render a page to UTF-8 bytes"""
+    buffer = io.BytesIO()
+    compiled.render_to(buffer, values, escape_html=escape_html)
+    return buffer.getvalue()
+
+
+class BatchStats:
+    """Counters for a batch run"""
+
+    def __init__(self):
+        self.incremental = False
+        self.pages = 0
+        self.skipped = 0
+        self.removed = 0
+        self.orphaned = 0
+        self.errors = 0
+        self.bytes_written = 0
+        self.templates = 0
+        self.listing_pages = 0
+        self.sizes = None
+        self.assets = None
+        self.search = None
+        self.writer = None
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self.started
+
+    @property
+    def pages_per_sec(self):
+        return self.pages / self.elapsed if self.elapsed > 0 else 0.0
+
+    def summary(self):
+        summary = (
+            f"Generated {self.pages} page(s) from {self.templates} template(s) "
+            f"in {self.elapsed:.2f}s - {self.pages_per_sec:.1f} pages/sec, "
+            f"{self.bytes_written} bytes written"
+        )
+        if self.incremental:
+            summary += f"; {self.skipped} unchanged page(s) skipped, {self.removed} removed"
+            if self.orphaned:
+                summary += f", {self.orphaned} orphaned page(s) kept"
+        if self.errors:
+            summary += f", {self.errors} error(s)"
+        if self.listing_pages:
+            summary += f" ({self.listing_pages} listing page(s))"
+        if self.assets is not None:
+            summary += f"\n{self.assets.summary()}"
+        if self.sizes is not None and self.sizes.pages:
+            summary += f"\n{self.sizes.summary()}"
+        if self.search is not None:
+            summary += f"\n{self.search.summary()}"
+        if self.writer is not None:
+            summary += f"\n{self.writer.summary()}"
+        return summary
+
+
+def build_manifest_path(output_dir):
+    """Path of the build manifest that belongs to an output directory"""
+    return os.path.normpath(output_dir) + BUILD_MANIFEST_SUFFIX
+
+
+def load_build_manifest(output_dir):
+    """
+    Read the build manifest of an output directory.
+
+    Returns:
+        Dict of output filename -> page hash; empty when there is no usable
+        manifest
+    """
+    try:
+        with open(build_manifest_path(output_dir), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(manifest, dict) or manifest.get('renderer_version') != RENDERER_VERSION:
+        return {}
+    return manifest.get('pages', {})
+
+
+def save_build_manifest(output_dir, pages):
+    """Atomically replace the build manifest of an output directory"""
+    with atomic_write(build_manifest_path(output_dir), fsync=True, encoding='utf-8') as f:
+        json.dump({'renderer_version': RENDERER_VERSION, 'pages': pages}, f,
+                  ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+
+
+def page_hash(compiled, values, escape_html, pipeline=None):
+    """Hash of everything that determines a page's output"""
+    key = [RENDERER_VERSION, compiled.content_hash, escape_html, values]
+    if pipeline is not None:
+        key.append(pipeline.key)
+    key = json.dumps(key, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def prepare_row(store, row, output_dir, escape_html=True, previous=None, pipeline=None):
+    """
+    Resolve a manifest row and decide whether its page must be written.
+
+    Returns:
+        (filename, compiled, values, page_hash, rebuild) tuple; rebuild is
+        False when previous (the last build manifest) has the same hash and
+        the page (and its .gz sibling, when compressing) still exists
+    """
+    template_name, filename, values = split_row(row)
+    compiled = store.get(template_name)
+    digest = page_hash(compiled, values, escape_html, pipeline)
+    return filename, compiled, values, digest, _needs_rebuild(previous, output_dir, filename, digest, pipeline)
+
+
+def _needs_rebuild(previous, output_dir, filename, digest, pipeline=None):
+    if previous is None or previous.get(filename) != digest:
+        return True
+    path = os.path.join(output_dir, filename)
+    if pipeline is not None and pipeline.gzip_level is not None and not os.path.exists(path + GZIP_SUFFIX):
+        return True
+    return not os.path.exists(path)
+
+
+def _search_document(search, filename, digest, values):
+    if search is None or not search.needs(filename, digest):
+        return None
+    with instrumentation.stage('tokenize'):
+        return search.document(filename, values)
+
+
+def render_rows(store, rows, output_dir, escape_html=True, previous=None, fsync=False, listing=None,
+                pipeline=None, search=None):
+    """
+    Render and write a sequence of manifest rows.
+
+    This is the unit of work shared by the serial and the parallel mode, so
+    both produce the same files.
+
+    Args:
+        previous: Build manifest of the last run. When given, pages whose
+            hash is unchanged and whose file still exists are not rewritten.
+        listing: ListingSpec; when given, the metadata record of every
+            page is returned with it
+        pipeline: OutputPipeline every written page goes through
+        search: SearchSpec; when given, pages the search index does not
+            have with this hash are tokenized, whether rebuilt or not
+
+    Returns:
+        (records, bytes_written, errors) where records is a list of
+        (filename, page_hash, rebuilt, metadata, sizes, document) tuples,
+        metadata being None without a listing, sizes the PageSizes of a
+        written page (None without a pipeline or when skipped) and document
+        the SearchSpec.document() of the page or None, and errors a list of
+        (line_number, message) tuples
+    """
+    records = []
+    bytes_written = 0
+    errors = []
+    for line_number, row in rows:
+        try:
+            filename, compiled, values, digest, rebuild = prepare_row(
+                store, row, output_dir, escape_html, previous, pipeline)
+            sizes = None
+            if rebuild:
+                written, sizes = write_output(output_dir, filename, compiled, values, escape_html, fsync,
+                                              pipeline)
+                bytes_written += written
+            records.append((filename, digest, rebuild,
+                            listing.record(filename, values) if listing is not None else None, sizes,
+                            _search_document(search, filename, digest, values)))
+        except (OSError, ValueError) as e:
+            errors.append((line_number, str(e)))
+    return records, bytes_written, errors
+
+
+def render_listings(store, spool, listing, output_dir, previous=None, fsync=False, taken=(),
+                    pipeline=None):
+    """
+    Render and write the listing pages of the posts collected in a spool.
+
+    Listing pages are hashed like any other page, so with previous only
+    those whose posts, pagination or template changed are rewritten.
+
+    Args:
+        taken: Filenames of the manifest's own pages; a listing page with
+            one of these names is reported and not written
+
+    Yields:
+        (records, bytes_written, errors) like render_rows, once per
+        CHUNK_SIZE pages
+    """
+    try:
+        compiled = store.get(listing.template)
+    except (OSError, ValueError) as e:
+        yield [], 0, [('listings', f"{listing.template}: {e}")]
+        return
+
+    records = []
+    bytes_written = 0
+    errors = []
+    for filename, values in iter_listing_pages(spool, listing.page_size):
+        if filename in taken:
+            errors.append(('listings', f"{filename} is also a page of the manifest; listing page not written"))
+            continue
+        digest = page_hash(compiled, values, LISTING_POLICY, pipeline)
+        rebuild = _needs_rebuild(previous, output_dir, filename, digest, pipeline)
+        try:
+            sizes = None
+            if rebuild:
+                written, sizes = write_output(output_dir, filename, compiled, values, LISTING_POLICY, fsync,
+                                              pipeline)
+                bytes_written += written
+            records.append((filename, digest, rebuild, None, sizes, None))
+        except OSError as e:
+            errors.append(('listings', f"{filename}: {e}"))
+        if len(records) >= CHUNK_SIZE:
+            yield records, bytes_written, errors
+            records = []
+            bytes_written = 0
+            errors = []
+    yield records, bytes_written, errors
+
+
+# Per-process state of a batch worker, set once by _init_worker
+_worker_store = None
+_worker_previous = None
+_worker_search = None
+
+
+def _init_worker(templates_dir, compiled, cache_dir, extractor, use_mmap, previous, search, trace):
+    global _worker_store, _worker_previous, _worker_search
+    _worker_store = TemplateStore(templates_dir, compiled, TemplateCache(cache_dir, extractor=extractor),
+                                  use_mmap)
+    _worker_previous = previous
+    _worker_search = search
+    if trace is not None:
+        instrumentation.enable(trace)
+
+
+def _render_chunk(rows, output_dir, escape_html, fsync, listing, pipeline):
+    """
+    Returns:
+        (render_rows result, drained recorder data or None)
+    """
+    result = render_rows(_worker_store, rows, output_dir, escape_html, _worker_previous, fsync, listing,
+                         pipeline, _worker_search)
+    recorder = instrumentation.active()
+    return result, recorder.drain() if recorder is not None else None
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _collect_template_names(manifest_path):
+    names = []
+    seen = set()
+    for _, row in read_manifest(manifest_path):
+        template_name = str(row.get('template') or '').strip()
+        if template_name and template_name not in seen:
+            seen.add(template_name)
+            names.append(template_name)
+    return names
+
+
+def _check_columns(rows, index, manifest_path, metadata_columns=()):
+    """
+    Pass rows through, warning once per template about columns that match
+    no field. Field names come from the template index, so no template is
+    read for this. metadata_columns (the listing metadata and the search
+    title field) never warn.
+    """
+    warned = set()
+    for line_number, row in rows:
+        entry = index.get(str(row.get('template') or '').strip())
+        if entry is not None:
+            fields = entry['fields']
+            for column in row:
+                if (column in RESERVED_COLUMNS or column is None or column in fields
+                        or column in metadata_columns):
+                    continue
+                if (entry['path'], column) not in warned:
+                    warned.add((entry['path'], column))
+                    print(f"{manifest_path}:{line_number}: warning: '{column}' is not a field of "
+                          f"{entry['path']}", file=sys.stderr)
+        yield line_number, row
+
+
+def _run_parallel(manifest_path, rows, store, output_dir, escape_html, jobs, previous, collect, fsync,
+                  listing, pipeline, search):
+    # Imported here: the process pool costs startup time every serial run would pay
+    from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+    # One cheap streaming pass to find the templates, so each worker
+    # receives every compiled template once through its initializer
+    store.preload(_collect_template_names(manifest_path))
+
+    # Workers record into their own recorder and ship it back with every chunk
+    recorder = instrumentation.active()
+
+    max_pending = jobs * TASKS_PER_WORKER
+    pending = set()
+
+    def drain(return_when):
+        nonlocal pending
+        done, pending = wait(pending, return_when=return_when)
+        for future in done:
+            result, metrics = future.result()
+            if metrics is not None:
+                recorder.merge(metrics)
+            collect(result)
+
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker,
+                             initargs=(store.templates_dir, store.compiled(),
+                                       store.cache.cache_dir, store.cache.extractor, store.use_mmap,
+                                       previous, search,
+                                       recorder.trace if recorder is not None else None)) as executor:
+        for chunk in _chunks(rows, CHUNK_SIZE):
+            if len(pending) >= max_pending:
+                drain(FIRST_COMPLETED)
+            pending.add(executor.submit(_render_chunk, chunk, output_dir, escape_html, fsync, listing,
+                                        pipeline))
+        if pending:
+            drain(ALL_COMPLETED)
+
+
+def _run_with_writer(rows, store, output_dir, escape_html, previous, collect, writer, listing, pipeline,
+                     search):
+    """
+    Render in this process and hand the pages to an AsyncPageWriter.
+
+    Pages are collected as built when they are queued; the caller settles
+    the writes that failed from writer.stats.failed, whose tags are
+    (line_number, filename). With a pipeline, a changed .gz sibling is
+    queued right after its page.
+    """
+    import asyncio
+
+    async def run():
+        async with writer:
+            for chunk in _chunks(rows, CHUNK_SIZE):
+                records = []
+                errors = []
+                for line_number, row in chunk:
+                    try:
+                        filename, compiled, values, digest, rebuild = prepare_row(
+                            store, row, output_dir, escape_html, previous, pipeline)
+                        sizes = None
+                        if rebuild:
+                            data = render_page(compiled, values, escape_html)
+                            compressed = None
+                            if pipeline is not None:
+                                data, compressed, sizes = pipeline.process(
+                                    data, os.path.join(output_dir, filename + GZIP_SUFFIX))
+                            await writer.submit(filename, data, tag=(line_number, filename))
+                            if pipeline is None or pipeline.gzip_level is None:
+                                remove_gzip_sibling(os.path.join(output_dir, filename))
+                            elif compressed is not None:
+                                await writer.submit(filename + GZIP_SUFFIX, compressed,
+                                                    tag=(line_number, filename))
+                        records.append((filename, digest, rebuild,
+                                        listing.record(filename, values) if listing is not None else None, sizes,
+                                        _search_document(search, filename, digest, values)))
+                    except (OSError, ValueError) as e:
+                        errors.append((line_number, str(e)))
+                collect((records, 0, errors))
+
+    asyncio.run(run())
+
+
+def _remove_orphans(output_dir, previous, pages, prune, stats):
+    """
+    Handle pages from the last build that are no longer in the manifest.
+
+    Orphans are deleted, together with their .gz sibling, when prune is
+    set, otherwise they are reported and kept in the build manifest so the
+    next run reports them again.
+    """
+    for filename in sorted(set(previous) - set(pages)):
+        if not is_output_filename(filename):
+            continue
+        if prune:
+            for path in (filename, filename + GZIP_SUFFIX):
+                try:
+                    os.remove(os.path.join(output_dir, path))
+                except FileNotFoundError:
+                    pass
+            stats.removed += 1
+        else:
+            print(f"orphaned: {filename}", file=sys.stderr)
+            pages[filename] = previous[filename]
+            stats.orphaned += 1
+
+
+def run_batch(manifest_path, templates_dir=DEFAULT_TEMPLATES_DIR,
+              output_dir=DEFAULT_OUTPUT_DIR, escape_html=True, jobs=1,
+              cache_dir=DEFAULT_CACHE_DIR, incremental=False, prune=False,
+              use_mmap=False, writers=0, fsync=False, listing=None, pipeline=None,
+              size_report=None, assets_dir=None, search=None, index_path=None,
+              asset_cache_path=None, extractor=DEFAULT_EXTRACTOR):
+    """
+    Render every page listed in a manifest.
+
+    Rows that cannot be rendered are reported on stderr and counted as
+    errors; the rest of the batch still runs.
+
+    Args:
+        escape_html: True to escape every field value, False to insert them
+            as raw HTML, or a per-field policy mapping (see
+            html_utils.field_policy)
+        jobs: Number of worker processes. 1 renders in this process, 0 uses
+            one worker per CPU. Workers write their pages themselves, so the
+            output is the same in every mode.
+        cache_dir: Directory of the parsed template cache, None to disable
+            it. The template index and asset hashes are stored with it (see
+            CACHE_STATE_DIR); without it they are kept in memory only.
+        incremental: Only rewrite pages whose template, field values or
+            renderer version changed since the last incremental run, as
+            recorded in the build manifest next to output_dir
+        prune: In incremental mode, delete pages of the last run that are no
+            longer listed. Skipped when the run had errors.
+        use_mmap: Memory-map the templates and write their static parts
+            without decoding them (see MappedTemplate); for very large
+            templates
+        writers: Number of asyncio writer tasks. 0 writes every page right
+            after rendering it; with writers, rendered pages go through a
+            bounded queue (see AsyncPageWriter) so rendering overlaps slow
+            writes. Only used when jobs is 1.
+        fsync: Flush every page to disk before renaming it into place
+        listing: ListingSpec; when given, index, tag and monthly archive
+            pages of the rendered posts are generated as well (see
+            listings.py)
+        pipeline: OutputPipeline that minifies written pages and/or adds
+            .gz siblings (see postprocess.py); part of every page hash, so
+            changing it rebuilds all pages in incremental mode
+        size_report: Path of a JSON Lines file that gets the sizes of every
+            written page when a pipeline is given
+        assets_dir: Site root that root-relative asset URLs such as
+            /src/css/main_style.css refer to. When given, the templates'
+            references to its files are rewritten to content-hashed names
+            and the files are copied into output_dir (see assets.py); use_mmap
+            is then ignored.
+        search: SearchSpec; when given, the field text of the manifest's
+            pages is kept in a sharded search index under output_dir/search
+            that is updated for changed pages only (see search_index.py)
+        index_path: Template index file, instead of the one under cache_dir
+        asset_cache_path: Asset hash cache file, instead of the one under
+            cache_dir
+        extractor: Key of html_utils.EXTRACTORS that finds the fields of
+            each template, 'parser' or 'scanner'
+
+    Returns:
+        BatchStats for the run
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    state_dir = None
+    if cache_dir is not None:
+        state_dir = None if cache_dir == DEFAULT_CACHE_DIR else os.path.join(cache_dir, CACHE_STATE_DIR)
+    if index_path is None and cache_dir is not None:
+        index_path = default_index_path(templates_dir, state_dir or DEFAULT_INDEX_DIR)
+    assets = None
+    if assets_dir is not None:
+        if asset_cache_path is None and cache_dir is not None:
+            asset_cache_path = default_hash_cache_path(assets_dir, state_dir or DEFAULT_HASH_CACHE_DIR)
+        assets = AssetPipeline(assets_dir, output_dir, asset_cache_path,
+                               persistent=asset_cache_path is not None)
+    store = TemplateStore(templates_dir, cache=TemplateCache(cache_dir, extractor=extractor),
+                          use_mmap=use_mmap, assets=assets)
+    stats = BatchStats()
+    stats.assets = assets
+    search_index = SearchIndex(output_dir, search) if search is not None else None
+    stats.incremental = incremental
+    previous = load_build_manifest(output_dir) if incremental else None
+    pages = {}
+
+    index = TemplateIndex(templates_dir, index_path, cache=store.cache, loader=store.loader,
+                          persistent=index_path is not None)
+    index.refresh()
+    metadata_columns = set(listing.columns) if listing is not None else set()
+    if search is not None:
+        metadata_columns.add(search.title_field)
+    rows = _check_columns(read_manifest(manifest_path), index, manifest_path, metadata_columns)
+    spool = ListingSpool() if listing is not None else None
+    if pipeline is not None:
+        stats.sizes = SizeTotals()
+    sizes_file = open(size_report, 'w', encoding='utf-8') if size_report and pipeline is not None else None
+
+    def collect(result):
+        records, bytes_written, errors = result
+        for filename, digest, rebuilt, metadata, sizes, document in records:
+            pages[filename] = digest
+            if rebuilt:
+                stats.pages += 1
+            else:
+                stats.skipped += 1
+            if metadata is not None:
+                spool.add(metadata)
+            if sizes is not None:
+                stats.sizes.add(sizes)
+                if sizes_file is not None:
+                    sizes_file.write(json.dumps(dict(filename=filename, **sizes.as_dict()), ensure_ascii=False))
+                    sizes_file.write('\n')
+            if document is not None:
+                search_index.add(filename, digest, document)
+        stats.bytes_written += bytes_written
+        for line_number, message in errors:
+            stats.errors += 1
+            print(f"{manifest_path}:{line_number}: {message}", file=sys.stderr)
+
+    if jobs == 0:
+        jobs = os.cpu_count() or 1
+
+    try:
+        if jobs > 1:
+            _run_parallel(manifest_path, rows, store, output_dir, escape_html, jobs, previous, collect, fsync,
+                          listing, pipeline, search)
+        elif writers:
+            writer = AsyncPageWriter(output_dir, writers, fsync=fsync)
+            _run_with_writer(rows, store, output_dir, escape_html, previous, collect, writer, listing, pipeline,
+                             search)
+            stats.writer = writer.stats
+            stats.bytes_written += writer.stats.bytes_written
+            failed = set()
+            for (line_number, filename), message in writer.stats.failed:
+                # A page and its .gz sibling share a tag; count the page once
+                if filename not in failed:
+                    failed.add(filename)
+                    stats.pages -= 1
+                    if previous is not None and filename in previous:
+                        pages[filename] = previous[filename]
+                    else:
+                        pages.pop(filename, None)
+                collect(([], 0, [(line_number, message)]))
+        else:
+            for chunk in _chunks(rows, CHUNK_SIZE):
+                collect(render_rows(store, chunk, output_dir, escape_html, previous, fsync, listing, pipeline,
+                                    search))
+
+        if spool is not None:
+            # pages holds only the manifest's pages until the first listing chunk is collected
+            for result in render_listings(store, spool, listing, output_dir, previous, fsync, pages, pipeline):
+                stats.listing_pages += sum(1 for record in result[0] if record[2])
+                collect(result)
+    finally:
+        stats.templates = len(store)
+        store.close()
+        if spool is not None:
+            spool.close()
+        if sizes_file is not None:
+            sizes_file.close()
+        if assets is not None:
+            assets.save()
+
+    if incremental:
+        _remove_orphans(output_dir, previous, pages, prune and not stats.errors, stats)
+        save_build_manifest(output_dir, pages)
+    if search_index is not None:
+        with instrumentation.stage('search_index'):
+            search_index.finish(pages)
+        stats.search = search_index
+
+    stats.finish()
+    return stats
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(
+        prog='page_maker.py batch',
+        description='Render pages from a JSONL or CSV manifest without the GUI'
+    )
+    parser.add_argument('manifest', help='manifest file (.jsonl or .csv)')
+    parser.add_argument('--templates-dir', default=DEFAULT_TEMPLATES_DIR,
+                        help='directory the template names are relative to')
+    parser.add_argument('--output-dir', default=DEFAULT_OUTPUT_DIR,
+                        help='directory the pages are written to')
+    parser.add_argument('--no-escape', action='store_true',
+                        help='insert field values as raw HTML')
+    parser.add_argument('--field-policy', action='append', default=[], metavar='CLASS=POLICY',
+                        help='escaping of one field: escape, raw (trusted HTML) or attribute (repeatable)')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='worker processes (default: 1 = serial, 0 = one per CPU)')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR,
+                        help='directory of the parsed template cache, template index and asset hashes')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='always parse templates and hash assets, without reading or writing any cache')
+    parser.add_argument('--extractor', choices=sorted(EXTRACTORS), default=DEFAULT_EXTRACTOR,
+                        help='field extractor: the HTMLParser-based parser or the faster regex scanner '
+                             '(default: %(default)s)')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only rewrite pages that changed since the last incremental run')
+    parser.add_argument('--prune', action='store_true',
+                        help='with --incremental, delete pages no longer in the manifest')
+    parser.add_argument('--mmap', action='store_true',
+                        help='memory-map templates and write their static parts without decoding')
+    parser.add_argument('--writers', type=int, default=0,
+                        help='write pages from a bounded queue with this many asyncio writers (serial mode only)')
+    parser.add_argument('--fsync', action='store_true',
+                        help='flush every page to disk before renaming it into place')
+    parser.add_argument('--listings', action='store_true',
+                        help='also generate paginated index, tag and monthly archive pages')
+    parser.add_argument('--listing-template', default=DEFAULT_LISTING_TEMPLATE,
+                        help='template of the listing pages (default: %(default)s)')
+    parser.add_argument('--page-size', type=int, default=DEFAULT_PAGE_SIZE,
+                        help='posts per listing page (default: %(default)s)')
+    parser.add_argument('--title-field', default='title', help='column with the post title (default: %(default)s)')
+    parser.add_argument('--date-field', default='date',
+                        help='column with the post date, YYYY-MM-DD (default: %(default)s)')
+    parser.add_argument('--tags-field', default='tags',
+                        help='column with comma-separated post tags (default: %(default)s)')
+    parser.add_argument('--assets-dir', metavar='DIR',
+                        help='site root of /src/... asset URLs; rewrite them to content-hashed names '
+                             'and copy the files into the output directory')
+    parser.add_argument('--search-index', action='store_true',
+                        help='also write a sharded client-side search index to OUTPUT_DIR/search')
+    parser.add_argument('--search-fields', metavar='CLASS,...',
+                        help='with --search-index, only index these columns (default: all fields)')
+    add_pipeline_arguments(parser)
+    parser.add_argument('--size-report', metavar='PATH',
+                        help='with --minify or --gzip, write the sizes of every written page as JSON Lines')
+    parser.add_argument('--report', metavar='PATH',
+                        help='write per-stage timings and counters as JSON')
+    parser.add_argument('--trace', metavar='PATH',
+                        help='write a Chrome trace-event file (chrome://tracing, Perfetto)')
+    parser.add_argument('--cprofile', metavar='PATH',
+                        help='run under cProfile and write pstats data (serial part only)')
+    parser.add_argument('--tracemalloc', action='store_true',
+                        help='add peak memory and top allocation sites to the report (serial part only)')
+    return parser
+
+
+def main(argv=None):
+    parser = build_arg_parser()
+    args = parser.parse_args(argv)
+    if args.jobs < 0:
+        parser.error('--jobs must be 0 or a positive number')
+    if args.writers < 0:
+        parser.error('--writers must be 0 or a positive number')
+    if args.writers and args.jobs != 1:
+        parser.error('--writers can only be used with --jobs 1')
+    if args.page_size < 1:
+        parser.error('--page-size must be a positive number')
+
+    pipeline = pipeline_from_args(parser, args)
+    if args.size_report and pipeline is None:
+        parser.error('--size-report needs --minify or --gzip')
+    if args.assets_dir is not None and not os.path.isdir(args.assets_dir):
+        parser.error(f'assets directory not found: {args.assets_dir}')
+
+    escape_html = not args.no_escape
+    if args.field_policy:
+        policies = {DEFAULT_POLICY_KEY: ESCAPE if escape_html else RAW}
+        for item in args.field_policy:
+            class_name, sep, policy = item.partition('=')
+            if not sep or policy not in ESCAPERS:
+                parser.error(f"--field-policy expects CLASS=POLICY with POLICY one of "
+                             f"{', '.join(ESCAPERS)}: {item}")
+            policies[class_name] = policy
+        escape_html = policies
+
+    listing = None
+    if args.listings:
+        listing = ListingSpec(args.listing_template, args.page_size,
+                              args.title_field, args.date_field, args.tags_field)
+
+    search = None
+    if args.search_fields and not args.search_index:
+        parser.error('--search-fields needs --search-index')
+    if args.search_index:
+        fields = None
+        if args.search_fields:
+            fields = [name.strip() for name in args.search_fields.split(',') if name.strip()]
+        search = SearchSpec(fields, args.title_field)
+
+    recorder = None
+    if args.report or args.trace or args.tracemalloc:
+        recorder = instrumentation.enable(trace=bool(args.trace))
+
+    with instrumentation.profiled(args.cprofile, args.tracemalloc):
+        stats = run_batch(
+            args.manifest,
+            templates_dir=args.templates_dir,
+            output_dir=args.output_dir,
+            escape_html=escape_html,
+            jobs=args.jobs,
+            cache_dir=None if args.no_cache else args.cache_dir,
+            incremental=args.incremental,
+            prune=args.prune,
+            use_mmap=args.mmap,
+            writers=args.writers,
+            fsync=args.fsync,
+            listing=listing,
+            pipeline=pipeline,
+            size_report=args.size_report,
+            assets_dir=args.assets_dir,
+            search=search,
+            extractor=args.extractor
+        )
+
+    print(stats.summary())
+    if recorder is not None:
+        instrumentation.disable()
+        recorder.count('pages', stats.pages)
+        if args.report:
+            recorder.save_report(args.report)
+        if args.trace:
+            recorder.save_trace(args.trace)
+    return 1 if stats.errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,678 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for template parsing and page rendering
+
+Runs every benchmark over synthetic templates scaled by size (10 KB to
+10 MB) and by number of <p class="..."> fields (1 to 5,000), and reports
+ops/sec and peak memory per case.
+
+    python3 benchmarks.py                          # full matrix
+    python3 benchmarks.py --quick                  # small matrix for CI
+    python3 benchmarks.py --memory                 # also field record memory
+    python3 benchmarks.py --quick --startup        # also CLI startup time
+    python3 benchmarks.py --quick --search         # also search index build
+    python3 benchmarks.py --save results.json
+    python3 benchmarks.py --save-baseline baseline.json
+    python3 benchmarks.py --baseline baseline.json --threshold 0.25
+
+With --baseline, the run fails (exit code 1) when any case is slower than
+the baseline by more than the threshold fraction. With --startup, it also
+fails when a headless command imports tkinter.
+"""
+
+import argparse
+import html
+import itertools
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import zlib
+
+from html_utils import (MappedTemplate, PTagParser, PTagScanner, TemplateCache, escape_values,
+                        parse_fields, replace_content_safe, replace_contents_safe)
+
+
+KB = 1024
+MB = 1024 * KB
+
+# Size sweep runs with SIZE_SWEEP_FIELDS fields, field sweep on templates of
+# FIELD_SWEEP_SIZE (grown as needed to hold all fields)
+SIZES = [10 * KB, 100 * KB, 1 * MB, 10 * MB]
+FIELD_COUNTS = [1, 10, 100, 1000, 5000]
+SIZE_SWEEP_FIELDS = 20
+FIELD_SWEEP_SIZE = 100 * KB
+
+QUICK_SIZES = [10 * KB, 100 * KB]
+QUICK_FIELD_COUNTS = [1, 10, 100]
+
+# Each case repeats until it has run for MIN_TIME seconds or MAX_ROUNDS times
+MIN_TIME = 0.2
+MAX_ROUNDS = 1000
+
+DEFAULT_THRESHOLD = 0.25
+
+# Memory sweep: enough templates are parsed and kept alive to hold this many
+# fields in total, up to MEMORY_MAX_TEMPLATES templates
+MEMORY_FIELDS = 20_000
+MEMORY_MAX_TEMPLATES = 1000
+
+# Startup sweep: each command runs in a fresh interpreter under
+# `python -X importtime`, STARTUP_REPEATS times, and the fastest run counts
+STARTUP_REPEATS = 5
+STARTUP_COMMANDS = {
+    'interpreter': ['-c', 'pass'],
+    'import_html_utils': ['-c', 'import html_utils'],
+    'import_batch': ['-c', 'import batch'],
+    'import_page_maker': ['-c', 'import page_maker'],
+    'batch_help': ['page_maker.py', 'batch', '--help'],
+    'templates_help': ['page_maker.py', 'templates', '--help'],
+}
+
+# Search sweep: a synthetic blog of SEARCH_POSTS posts in mixed Chinese,
+# Japanese, English and Latin is indexed from scratch, then again after
+# SEARCH_CHANGED_FRACTION of the posts were edited
+SEARCH_POSTS = 10_000
+QUICK_SEARCH_POSTS = 1000
+# Latin words and CJK runs per post, drawn with Zipf frequencies from a
+# vocabulary of SEARCH_VOCABULARY words and SEARCH_HAN_CHARS Han characters
+SEARCH_WORDS_PER_POST = 100
+SEARCH_VOCABULARY = 5000
+SEARCH_HAN_CHARS = 3000
+SEARCH_CHANGED_FRACTION = 0.01
+
+# Modules a headless command must never load
+GUI_MODULES = ('tkinter', '_tkinter')
+
+_FILLER = (
+    '    <div class="row"><span class="label">段落</span> Lorem ipsum dolor sit amet, '
+    'consectetur adipiscing elit &amp; 文本内容。</div>\n'
+)
+_PLAIN_TEXT = '这是一段普通的博客正文，没有需要转义的字符。Lorem ipsum dolor sit amet.\n'
+_STYLE_RULE = '      .rule-{0} {{ margin: {0}px; color: #333; }}\n'
+_SEARCH_WORDS = (
+    'static site template page render cache index search shard browser query layout '
+    'performance memory parser field content archive tag date post author python '
+    'lorem ipsum dolor sit amet consectetur adipiscing elit sed tempor incididunt labore '
+    'bibliothèque café naïve résumé über straße façade déjà'
+).split()
+_SEARCH_SYLLABLES = 'ka lo re mi su ta ne po vi da ser ton al in qu est um or ul ex pra cor ment tion'.split()
+_SEARCH_KANA = 'のはをにがでとしてますですこれあるいうテンプレートキャッシュページ'
+
+
+def make_template(size, field_count):
+    """
+    Build a synthetic template of roughly `size` bytes (UTF-8).
+
+    A third of the size goes to an inline <style> block, like the shipped
+    templates, and the rest to body markup with the fields spread evenly.
+    """
+    head = ['<!DOCTYPE html>\n<html lang="zh-CN">\n  <head>\n    <meta charset="utf-8">\n    <style>\n']
+    style_size = 0
+    idx = 0
+    while style_size < size // 3:
+        rule = _STYLE_RULE.format(idx)
+        head.append(rule)
+        style_size += len(rule)
+        idx += 1
+    head.append('    </style>\n  </head>\n  <body>\n')
+
+    body_budget = max(size - style_size, 0)
+    fillers = body_budget // len(_FILLER.encode('utf-8'))
+    per_field = fillers // max(field_count, 1)
+
+    body = []
+    for field in range(field_count):
+        body.append(f'    <p class="field-{field}">默认内容 {field} <b>bold</b></p>\n')
+        body.append(_FILLER * per_field)
+
+    return ''.join(head) + ''.join(body) + '  </body>\n</html>\n'
+
+
+def make_values(field_count):
+    return {f'field-{field}': f'新内容 {field} <em>&</em>' for field in range(field_count)}
+
+
+def make_text_values(size, field_count):
+    """
+    Plain-text post content of about `size` bytes split over the fields;
+    one field in ten contains characters that must be escaped.
+    """
+    per_field = max(size // field_count // len(_PLAIN_TEXT.encode('utf-8')), 1)
+    values = {}
+    for field in range(field_count):
+        text = _PLAIN_TEXT * per_field
+        if field % 10 == 0:
+            text += 'Q&A: <b>"引用"</b>\n'
+        values[f'field-{field}'] = text
+    return values
+
+
+def measure(func, min_time=MIN_TIME, max_rounds=MAX_ROUNDS):
+    """
+    Time repeated calls of func, then trace one more call for peak memory.
+
+    Returns:
+        Dict with ops_per_sec, mean_seconds, rounds and peak_memory (bytes)
+    """
+    rounds = 0
+    elapsed = 0.0
+    while rounds < max_rounds and (rounds == 0 or elapsed < min_time):
+        start = time.perf_counter()
+        func()
+        elapsed += time.perf_counter() - start
+        rounds += 1
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'ops_per_sec': rounds / elapsed if elapsed > 0 else float('inf'),
+        'mean_seconds': elapsed / rounds,
+        'rounds': rounds,
+        'peak_memory': peak,
+    }
+
+
+# Benchmarks: name -> setup(template, values, work_dir) returning the callable
+# that is timed
+
+def _bench_ptagparser_feed(template, values, work_dir):
+    def run():
+        parser = PTagParser()
+        parser.feed(template)
+    return run
+
+
+def _bench_ptagscanner_feed(template, values, work_dir):
+    def run():
+        PTagScanner().feed(template)
+    return run
+
+
+def _bench_replace_chain(template, values, work_dir):
+    def run():
+        result = template
+        for class_name, new_content in values.items():
+            result = replace_content_safe(result, class_name, new_content)
+    return run
+
+
+def _bench_bulk_replace(template, values, work_dir):
+    def run():
+        replace_contents_safe(template, values)
+    return run
+
+
+def _bench_escape_stdlib(template, values, work_dir):
+    text_values = make_text_values(len(template), len(values))
+
+    def run():
+        {name: html.escape(content) for name, content in text_values.items()}
+    return run
+
+
+def _bench_escape_policy(template, values, work_dir):
+    text_values = make_text_values(len(template), len(values))
+
+    def run():
+        escape_values(text_values)
+    return run
+
+
+def _bench_compiled_render(template, values, work_dir):
+    _, _, compiled = TemplateCache(None).load(_write_template(template, work_dir))
+
+    def run():
+        compiled.render(values)
+    return run
+
+
+def _bench_end_to_end(template, values, work_dir):
+    template_path = _write_template(template, work_dir)
+    output_path = os.path.join(work_dir, 'output.html')
+    cache = TemplateCache(None)
+
+    def run():
+        _, _, compiled = cache.load(template_path)
+        with open(output_path, 'w', encoding='utf-8') as f:
+            compiled.render_to(f, values)
+    return run
+
+
+def _bench_mapped_end_to_end(template, values, work_dir):
+    template_path = _write_template(template, work_dir)
+    output_path = os.path.join(work_dir, 'output.html')
+
+    def run():
+        with MappedTemplate(template_path) as mapped, open(output_path, 'wb') as f:
+            mapped.render_to(f, values)
+    return run
+
+
+def _write_template(template, work_dir):
+    template_path = os.path.join(work_dir, 'template.html')
+    with open(template_path, 'w', encoding='utf-8') as f:
+        f.write(template)
+    return template_path
+
+
+BENCHMARKS = {
+    'ptagparser_feed': _bench_ptagparser_feed,
+    'ptagscanner_feed': _bench_ptagscanner_feed,
+    'replace_chain': _bench_replace_chain,
+    'bulk_replace': _bench_bulk_replace,
+    'escape_stdlib': _bench_escape_stdlib,
+    'escape_policy': _bench_escape_policy,
+    'compiled_render': _bench_compiled_render,
+    'end_to_end': _bench_end_to_end,
+    'mapped_end_to_end': _bench_mapped_end_to_end,
+}
+
+
+def iter_cases(quick=False):
+    """Yield (size, field_count) pairs of the benchmark matrix"""
+    sizes = QUICK_SIZES if quick else SIZES
+    field_counts = QUICK_FIELD_COUNTS if quick else FIELD_COUNTS
+
+    seen = set()
+    for size in sizes:
+        case = (size, min(SIZE_SWEEP_FIELDS, max(field_counts)))
+        if case not in seen:
+            seen.add(case)
+            yield case
+    for field_count in field_counts:
+        case = (FIELD_SWEEP_SIZE, field_count)
+        if case not in seen:
+            seen.add(case)
+            yield case
+
+
+def case_id(name, size, field_count):
+    return f"{name}/size={size // KB}KB/fields={field_count}"
+
+
+def run_suite(quick=False, only=None, verbose=True):
+    """
+    Run the benchmark matrix.
+
+    Args:
+        quick: Use the small matrix
+        only: Optional list of benchmark names to run
+
+    Returns:
+        Results dict with 'meta' and 'results' (case id -> measurement)
+    """
+    names = only or list(BENCHMARKS)
+    results = {}
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        for size, field_count in iter_cases(quick):
+            template = make_template(size, field_count)
+            values = make_values(field_count)
+            for name in names:
+                run = BENCHMARKS[name](template, values, work_dir)
+                result = measure(run)
+                result['template_bytes'] = len(template.encode('utf-8'))
+                result['fields'] = field_count
+                key = case_id(name, size, field_count)
+                results[key] = result
+                if verbose:
+                    print(format_result(key, result))
+
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'quick': quick,
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'results': results,
+    }
+
+
+def retained_memory(build):
+    """Bytes allocated by build() that are still held by its result"""
+    tracemalloc.start()
+    try:
+        result = build()
+        current, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    return current
+
+
+def run_memory_suite(quick=False, verbose=True):
+    """
+    Compare the memory held by parsed fields as FieldTables against the
+    same fields as one dict per field (the old PTagParser.p_tags format).
+    
+    Returns:
+        Dict of case id -> {'templates', 'fields', 'dict_bytes',
+        'table_bytes', 'reduction'}
+    """
+    results = {}
+    for field_count in (QUICK_FIELD_COUNTS if quick else FIELD_COUNTS):
+        template = make_template(0, field_count)
+        templates = min(MEMORY_MAX_TEMPLATES, max(1, MEMORY_FIELDS // field_count))
+        
+        def as_tables():
+            return [parse_fields(template, 'scanner') for _ in range(templates)]
+        
+        def as_dicts():
+            return [[field.as_dict() for field in parse_fields(template, 'scanner')]
+                    for _ in range(templates)]
+        
+        table_bytes = retained_memory(as_tables)
+        dict_bytes = retained_memory(as_dicts)
+        key = f"field_memory/fields={field_count}"
+        results[key] = {
+            'templates': templates,
+            'fields': templates * field_count,
+            'dict_bytes': dict_bytes,
+            'table_bytes': table_bytes,
+            'reduction': 1 - table_bytes / dict_bytes,
+        }
+        if verbose:
+            print(f"{key:<48} {dict_bytes / KB:>10.1f} KB as dicts "
+                  f"{table_bytes / KB:>10.1f} KB as tables ({-results[key]['reduction']:+.0%})")
+    return results
+
+
+def parse_importtime(output):
+    """
+    Parse the stderr of `python -X importtime`.
+
+    Returns:
+        (total import time in microseconds, set of imported module names)
+    """
+    total = 0
+    modules = set()
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if not cumulative.strip().isdigit():
+            continue
+        modules.add(name.strip())
+        if not name[1:].startswith(' '):
+            total += int(cumulative)
+    return total, modules
+
+
+def run_startup_suite(repeats=STARTUP_REPEATS, verbose=True):
+    """
+    Measure how long the CLI takes to start.
+
+    Returns:
+        Dict of case id -> {'wall_ms', 'import_ms', 'modules', 'gui_modules'}
+        where the times are the best of `repeats` runs and gui_modules lists
+        any tkinter modules the command imported
+    """
+    root = os.path.dirname(os.path.abspath(__file__))
+    results = {}
+    for name, args in STARTUP_COMMANDS.items():
+        command = [sys.executable, '-X', 'importtime', *args]
+        # One untimed run warms the file system (and any .pyc) caches
+        subprocess.run(command, cwd=root, capture_output=True, check=True)
+        walls = []
+        imports = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            process = subprocess.run(command, cwd=root, stdout=subprocess.DEVNULL,
+                                     stderr=subprocess.PIPE, text=True, check=True)
+            walls.append(time.perf_counter() - start)
+            total, modules = parse_importtime(process.stderr)
+            imports.append(total)
+        key = f"startup/{name}"
+        results[key] = {
+            'wall_ms': min(walls) * 1000,
+            'import_ms': min(imports) / 1000,
+            'modules': len(modules),
+            'gui_modules': sorted(modules.intersection(GUI_MODULES)),
+        }
+        if verbose:
+            gui = ' (imports tkinter)' if results[key]['gui_modules'] else ''
+            print(f"{key:<48} {results[key]['wall_ms']:>10.1f} ms wall "
+                  f"{results[key]['import_ms']:>10.1f} ms imports "
+                  f"{len(modules):>5} modules{gui}")
+    return results
+
+
+def make_search_vocabulary(rng):
+    """
+    Vocabulary of the search sweep.
+    
+    Returns:
+        (words, word_weights, han, han_weights): Latin words (real ones,
+        with accents, first) and Han characters, each with cumulative Zipf
+        weights for random.choices
+    """
+    words = list(_SEARCH_WORDS)
+    seen = set(words)
+    while len(words) < SEARCH_VOCABULARY:
+        word = ''.join(rng.choice(_SEARCH_SYLLABLES) for _ in range(rng.randint(1, 4)))
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    han = [chr(0x4e00 + offset) for offset in rng.sample(range(0x5200), SEARCH_HAN_CHARS)]
+    
+    def zipf(count):
+        return list(itertools.accumulate(1 / rank for rank in range(1, count + 1)))
+    
+    return words, zipf(len(words)), han, zipf(len(han))
+
+
+def make_search_post(rng, number, vocabulary):
+    """Field values of one synthetic post for the search sweep"""
+    words, word_weights, han, han_weights = vocabulary
+    parts = []
+    for _ in range(SEARCH_WORDS_PER_POST):
+        kind = rng.random()
+        if kind < 0.4:
+            parts.append(rng.choices(words, cum_weights=word_weights)[0])
+        elif kind < 0.8:
+            parts.append(''.join(rng.choices(han, cum_weights=han_weights, k=rng.randint(2, 8))))
+        else:
+            characters = rng.choices(han, cum_weights=han_weights, k=rng.randint(1, 3))
+            characters += rng.choices(_SEARCH_KANA, k=rng.randint(1, 4))
+            parts.append(''.join(characters))
+    return {
+        'title': f"{rng.choices(words, cum_weights=word_weights)[0]} "
+                 f"{''.join(rng.choices(han, cum_weights=han_weights, k=4))} #{number}",
+        'content': f"<p>{' '.join(parts)}</p>",
+        'tags': ', '.join(rng.sample(words[:50], 3)),
+    }
+
+
+def _index_posts(search_index, posts):
+    spec = search_index.spec
+    for filename, (digest, values) in posts.items():
+        if spec.needs(filename, digest):
+            search_index.add(filename, digest, spec.document(filename, values))
+    search_index.finish(posts)
+
+
+def run_search_suite(quick=False, verbose=True):
+    """
+    Build the search index of a synthetic blog, then update it after one
+    post and after SEARCH_CHANGED_FRACTION of the posts were edited.
+    
+    Returns:
+        Dict of case id -> {'posts', 'build_seconds', 'update_one_seconds',
+        'update_one_shards', 'update_seconds', 'update_shards', 'changed',
+        'shards', 'shard_bytes', 'shard_gzip_bytes', 'max_shard_bytes',
+        'median_shard_bytes', 'doc_bytes', 'state_bytes', 'terms'} where the
+        *_shards values count the shards an update rewrote
+    """
+    from search_index import SearchIndex, SearchSpec
+    
+    post_count = QUICK_SEARCH_POSTS if quick else SEARCH_POSTS
+    rng = random.Random(0)
+    vocabulary = make_search_vocabulary(rng)
+    posts = {f"posts/{number}.html": (f"v1-{number}", make_search_post(rng, number, vocabulary))
+             for number in range(post_count)}
+    changed = rng.sample(sorted(posts), max(1, int(post_count * SEARCH_CHANGED_FRACTION)))
+    
+    with tempfile.TemporaryDirectory() as work_dir:
+        output_dir = os.path.join(work_dir, 'output')
+        start = time.perf_counter()
+        _index_posts(SearchIndex(output_dir, SearchSpec()), posts)
+        build_seconds = time.perf_counter() - start
+        
+        def update(filenames, version):
+            for number, filename in enumerate(filenames):
+                posts[filename] = (f"{version}-{number}", make_search_post(rng, number, vocabulary))
+            search_index = SearchIndex(output_dir, SearchSpec())
+            start = time.perf_counter()
+            _index_posts(search_index, posts)
+            return time.perf_counter() - start, search_index
+        
+        update_one_seconds, one = update(changed[:1], 'v2')
+        update_seconds, search_index = update(changed, 'v3')
+        
+        search_dir = search_index.search_dir
+        state_bytes = os.path.getsize(search_index.state_path)
+        shard_sizes = []
+        gzip_bytes = 0
+        doc_bytes = 0
+        terms = 0
+        for name in sorted(os.listdir(search_dir)):
+            with open(os.path.join(search_dir, name), 'rb') as f:
+                data = f.read()
+            if name.startswith('docs-'):
+                doc_bytes += len(data)
+            elif name != 'index.json':
+                shard_sizes.append(len(data))
+                gzip_bytes += len(zlib.compress(data, 9))
+                terms += len(json.loads(data))
+    
+    shard_sizes.sort()
+    key = f"search/posts={post_count}"
+    results = {key: {
+        'posts': post_count,
+        'build_seconds': build_seconds,
+        'update_one_seconds': update_one_seconds,
+        'update_one_shards': one.shards_written,
+        'update_seconds': update_seconds,
+        'update_shards': search_index.shards_written,
+        'changed': len(changed),
+        'shards': len(shard_sizes),
+        'shard_bytes': sum(shard_sizes),
+        'shard_gzip_bytes': gzip_bytes,
+        'max_shard_bytes': shard_sizes[-1],
+        'median_shard_bytes': shard_sizes[len(shard_sizes) // 2],
+        'doc_bytes': doc_bytes,
+        'state_bytes': state_bytes,
+        'terms': terms,
+    }}
+    if verbose:
+        result = results[key]
+        print(f"{key:<48} {result['build_seconds']:>10.2f} s build, update of 1 post "
+              f"{result['update_one_seconds']:.3f} s ({result['update_one_shards']} shards), "
+              f"of {result['changed']} posts {result['update_seconds']:.3f} s ({result['update_shards']} shards)")
+        print(f"{'':<48} {result['shards']:>10} shards {result['terms']:>10} terms "
+              f"{result['shard_bytes'] / KB:>10.1f} KB ({result['shard_gzip_bytes'] / KB:.1f} KB gzip), "
+              f"max {result['max_shard_bytes'] / KB:.1f} KB, median {result['median_shard_bytes'] / KB:.1f} KB, "
+              f"titles {result['doc_bytes'] / KB:.1f} KB, state {result['state_bytes'] / KB:.1f} KB")
+    return results
+
+
+def format_result(key, result):
+    return (
+        f"{key:<48} {result['ops_per_sec']:>12.1f} ops/sec "
+        f"{result['mean_seconds'] * 1000:>10.3f} ms "
+        f"{result['peak_memory'] / KB:>10.1f} KB peak"
+    )
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """
+    Compare a run against a baseline.
+
+    Returns:
+        List of (case id, baseline ops/sec, current ops/sec) for cases that
+        are slower than the baseline by more than the threshold fraction
+    """
+    regressions = []
+    for key, base in baseline.get('results', {}).items():
+        current = results['results'].get(key)
+        if current is None:
+            continue
+        if current['ops_per_sec'] < base['ops_per_sec'] * (1 - threshold):
+            regressions.append((key, base['ops_per_sec'], current['ops_per_sec']))
+    return regressions
+
+
+def save_results(results, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+
+def load_results(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark template parsing and rendering')
+    parser.add_argument('--quick', action='store_true', help='run the small matrix')
+    parser.add_argument('--only', action='append', choices=sorted(BENCHMARKS),
+                        help='run only this benchmark (repeatable)')
+    parser.add_argument('--memory', action='store_true',
+                        help='also compare the memory held by parsed field records')
+    parser.add_argument('--startup', action='store_true',
+                        help='also measure CLI startup time with python -X importtime')
+    parser.add_argument('--search', action='store_true',
+                        help='also measure search index build time and shard sizes')
+    parser.add_argument('--save', metavar='PATH', help='write the results as JSON')
+    parser.add_argument('--save-baseline', metavar='PATH', help='write the results as the new baseline')
+    parser.add_argument('--baseline', metavar='PATH', help='compare against a stored baseline')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='allowed slowdown as a fraction of baseline ops/sec (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    results = run_suite(quick=args.quick, only=args.only)
+    if args.memory:
+        results['memory'] = run_memory_suite(quick=args.quick)
+    if args.startup:
+        results['startup'] = run_startup_suite()
+    if args.search:
+        results['search'] = run_search_suite(quick=args.quick)
+
+    if args.save:
+        save_results(results, args.save)
+    if args.save_baseline:
+        save_results(results, args.save_baseline)
+
+    if args.startup:
+        gui = [key for key, result in results['startup'].items() if result['gui_modules']]
+        if gui:
+            print(f"\n❌ tkinter imported by: {', '.join(gui)}")
+            return 1
+
+    if args.baseline:
+        regressions = compare(results, load_results(args.baseline), args.threshold)
+        if regressions:
+            print(f"\n❌ {len(regressions)} case(s) regressed by more than {args.threshold:.0%}:")
+            for key, base, current in regressions:
+                print(f"  - {key}: {base:.1f} -> {current:.1f} ops/sec")
+            return 1
+        print(f"\n✅ No regressions beyond {args.threshold:.0%} against {args.baseline}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
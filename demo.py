@@ -6,7 +6,7 @@ This demonstrates the core functionality.
 """
 
 import os
-from html_utils import PTagParser, replace_content_safe
+from html_utils import PTagParser, CompiledTemplate
 
 
 def generate_blog_example():
@@ -45,9 +45,7 @@ def generate_blog_example():
         print(f"  - {key}: \"{value}\"")
     
     # Replace content
-    result_html = template_content
-    for class_name, new_content in custom_content.items():
-        result_html = replace_content_safe(result_html, class_name, new_content)
+    result_html = CompiledTemplate(template_content).render(custom_content)
     
     # Save
     output_path = os.path.join(output_dir, 'demo_blog_post.html')
@@ -93,9 +91,7 @@ def generate_article_example():
         print(f"  - {key}: \"{value}\"")
     
     # Replace content
-    result_html = template_content
-    for class_name, new_content in custom_content.items():
-        result_html = replace_content_safe(result_html, class_name, new_content)
+    result_html = CompiledTemplate(template_content).render(custom_content)
     
     # Save
     output_path = os.path.join(output_dir, 'demo_article.html')
@@ -145,9 +141,7 @@ def generate_tech_note_example():
         print(f"  - {key}: \"{display_value}\"")
     
     # Replace content
-    result_html = template_content
-    for class_name, new_content in custom_content.items():
-        result_html = replace_content_safe(result_html, class_name, new_content)
+    result_html = CompiledTemplate(template_content).render(custom_content)
     
     # Save
     output_path = os.path.join(output_dir, 'demo_tech_note.html')
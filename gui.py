@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tk interface of Page Maker
+
+Imported by page_maker.main only when the GUI is started, so the headless
+subcommands and the core modules never load tkinter.
+"""
+
+import io
+import os
+import queue
+import threading
+import tkinter as tk
+from tkinter import ttk, messagebox
+import instrumentation
+from html_utils import FieldModel, TemplateCache
+from template_index import TemplateIndex
+from template_loader import TemplateLoader
+from page_writer import atomic_write
+from postprocess import remove_gzip_sibling
+
+
+# How often the Tk loop checks for results from the background worker
+POLL_INTERVAL_MS = 50
+
+
+class _FieldRow:
+    """Recyclable widgets for one visible row of a VirtualFieldList"""
+    
+    def __init__(self, canvas):
+        self.frame = ttk.Frame(canvas)
+        self.label = ttk.Label(self.frame, width=20)
+        self.label.pack(side=tk.LEFT, padx=5)
+        # Text widget for multiline support
+        self.text = tk.Text(self.frame, height=3, width=60, wrap=tk.WORD)
+        self.text.pack(side=tk.LEFT, padx=5)
+        self.item = canvas.create_window(0, 0, window=self.frame, anchor="nw", state=tk.HIDDEN)
+        self.index = None
+
+
+class VirtualFieldList(ttk.Frame):
+    """
+    Scrollable editor for a FieldModel.
+    
+    Only as many rows as fit in the viewport are created. While scrolling,
+    the rows are moved and rebound to other fields, writing their text back
+    to the model first, so load time and scrolling cost do not depend on
+    the number of fields.
+    """
+    
+    ROW_HEIGHT = 64
+    
+    def __init__(self, master):
+        super().__init__(master)
+        self.model = FieldModel()
+        self.rows = []
+        
+        # Scrolling by "units" moves by whole rows
+        self.canvas = tk.Canvas(self, highlightthickness=0, yscrollincrement=self.ROW_HEIGHT)
+        scrollbar = ttk.Scrollbar(self, orient="vertical", command=self.yview)
+        self.canvas.configure(yscrollcommand=scrollbar.set)
+        
+        self.canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        
+        self.empty_label = ttk.Label(
+            self.canvas,
+            text="该模板没有可编辑的 <p class=\"...\"></p> 标签",
+            foreground="red"
+        )
+        self.empty_item = self.canvas.create_window(20, 20, window=self.empty_label, anchor="nw", state=tk.HIDDEN)
+        
+        self.canvas.bind("<Configure>", lambda e: self.refresh())
+        self._bind_mousewheel(self.canvas)
+    
+    def set_model(self, model):
+        """Show another model, starting from the top"""
+        for row in self.rows:
+            row.index = None
+        self.model = model
+        self.canvas.itemconfigure(
+            self.empty_item,
+            state=tk.HIDDEN if len(model) else tk.NORMAL
+        )
+        self.canvas.yview_moveto(0)
+        self.refresh()
+    
+    def reload(self):
+        """Reload the visible rows from the model, discarding unsaved edits"""
+        for row in self.rows:
+            row.index = None
+        self.refresh()
+    
+    def flush(self):
+        """Write the text of the visible rows back to the model"""
+        for row in self.rows:
+            if row.index is not None:
+                self.model.set(self.model.names[row.index], row.text.get("1.0", "end-1c"))
+    
+    def yview(self, *args):
+        self.canvas.yview(*args)
+        self.refresh()
+    
+    def refresh(self):
+        """Bind the row widgets to the fields in the viewport"""
+        count = len(self.model)
+        width = self.canvas.winfo_width()
+        self.canvas.configure(scrollregion=(0, 0, width, count * self.ROW_HEIGHT))
+        
+        visible = self.canvas.winfo_height() // self.ROW_HEIGHT + 2
+        while len(self.rows) < min(visible, count):
+            row = _FieldRow(self.canvas)
+            self._bind_mousewheel(row.frame)
+            self._bind_mousewheel(row.label)
+            self.rows.append(row)
+        
+        first = max(int(self.canvas.canvasy(0)) // self.ROW_HEIGHT, 0)
+        first = min(first, max(count - len(self.rows), 0))
+        
+        # Save every row before rebinding any, as rows swap fields
+        self.flush()
+        for slot, row in enumerate(self.rows):
+            index = first + slot
+            if index >= count:
+                row.index = None
+                self.canvas.itemconfigure(row.item, state=tk.HIDDEN)
+                continue
+            
+            if row.index != index:
+                class_name = self.model.names[index]
+                row.label.configure(text=f"[{class_name}]")
+                row.text.delete("1.0", tk.END)
+                row.text.insert("1.0", self.model.get(class_name))
+                row.index = index
+            
+            self.canvas.coords(row.item, 0, index * self.ROW_HEIGHT + 5)
+            self.canvas.itemconfigure(row.item, state=tk.NORMAL, width=max(width - 10, 1))
+    
+    def _bind_mousewheel(self, widget):
+        widget.bind("<MouseWheel>", lambda e: self.yview("scroll", -1 if e.delta > 0 else 1, "units"))
+        widget.bind("<Button-4>", lambda e: self.yview("scroll", -1, "units"))
+        widget.bind("<Button-5>", lambda e: self.yview("scroll", 1, "units"))
+
+
+class PageMakerApp:
+    def __init__(self, root, pipeline=None):
+        self.root = root
+        self.root.title("Blog Page Maker - 博客页面生成器")
+        self.root.geometry("800x700")
+        
+        # Variables
+        self.templates_dir = os.path.join(os.path.dirname(__file__), 'templates')
+        self.output_dir = os.path.join(os.path.dirname(__file__), 'output')
+        self.selected_template = None
+        self.template_content = ""
+        self.compiled_template = None
+        self.editable_fields = []
+        self.field_model = FieldModel()
+        self.pipeline = pipeline
+        self.template_cache = TemplateCache()
+        self.template_loader = TemplateLoader(self.templates_dir, cache=self.template_cache)
+        self.template_index = TemplateIndex(self.templates_dir, cache=self.template_cache,
+                                            loader=self.template_loader)
+        
+        # Background work: one job at a time, results come back through the
+        # queue and are handled on the Tk thread
+        self.task_queue = queue.Queue()
+        self.busy = False
+        
+        # Ensure output directory exists
+        os.makedirs(self.output_dir, exist_ok=True)
+        
+        # Create UI
+        self.create_widgets()
+        self.load_templates()
+    
+    def create_widgets(self):
+        """Create the GUI widgets"""
+        
+        # Template selection frame
+        template_frame = ttk.LabelFrame(self.root, text="步骤1: 选择模板", padding="10")
+        template_frame.pack(fill=tk.X, padx=10, pady=5)
+        
+        self.template_var = tk.StringVar()
+        self.template_combo = ttk.Combobox(
+            template_frame, 
+            textvariable=self.template_var,
+            state='readonly',
+            width=50
+        )
+        self.template_combo.pack(side=tk.LEFT, padx=5)
+        self.template_combo.bind('<<ComboboxSelected>>', self.on_template_selected)
+        
+        self.load_button = ttk.Button(template_frame, text="加载模板", command=self.on_template_selected)
+        self.load_button.pack(side=tk.LEFT, padx=5)
+        
+        # Field count of the selected template, from the template index
+        self.template_info_var = tk.StringVar(value="")
+        ttk.Label(template_frame, textvariable=self.template_info_var).pack(side=tk.LEFT, padx=5)
+        
+        # Editable fields frame (scrollable)
+        fields_frame = ttk.LabelFrame(self.root, text="步骤2: 编辑内容", padding="10")
+        fields_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
+        
+        # Virtualized list: widgets only for the visible fields
+        self.field_list = VirtualFieldList(fields_frame)
+        self.field_list.pack(fill=tk.BOTH, expand=True)
+        
+        # Filename frame
+        filename_frame = ttk.LabelFrame(self.root, text="步骤3: 输入文件名", padding="10")
+        filename_frame.pack(fill=tk.X, padx=10, pady=5)
+        
+        ttk.Label(filename_frame, text="文件名:").pack(side=tk.LEFT, padx=5)
+        self.filename_var = tk.StringVar(value="output.html")
+        ttk.Entry(filename_frame, textvariable=self.filename_var, width=40).pack(side=tk.LEFT, padx=5)
+        
+        # Generate button frame
+        button_frame = ttk.Frame(self.root, padding="10")
+        button_frame.pack(fill=tk.X, padx=10, pady=5)
+        
+        self.generate_button = ttk.Button(button_frame, text="完成 - 生成HTML文件", command=self.generate_html)
+        self.generate_button.pack(side=tk.RIGHT, padx=5)
+        self.reset_button = ttk.Button(button_frame, text="重置", command=self.reset_fields)
+        self.reset_button.pack(side=tk.RIGHT, padx=5)
+        
+        # Progress indicator for background work
+        self.progress = ttk.Progressbar(button_frame, mode='indeterminate', length=150)
+        self.progress.pack(side=tk.LEFT, padx=5)
+        self.status_var = tk.StringVar(value="")
+        ttk.Label(button_frame, textvariable=self.status_var).pack(side=tk.LEFT, padx=5)
+    
+    def run_in_background(self, status, work, on_success, on_error):
+        """
+        Run work() on a worker thread while the UI stays responsive.
+        
+        Buttons are disabled and the progress bar runs until the job ends.
+        on_success(result) or on_error(exception) is then called on the Tk
+        thread. work() must not touch any Tk widget.
+        """
+        if self.busy:
+            return
+        self.set_busy(True, status)
+        
+        def worker():
+            try:
+                self.task_queue.put((on_success, work()))
+            except Exception as e:
+                self.task_queue.put((on_error, e))
+        
+        threading.Thread(target=worker, daemon=True).start()
+        self.root.after(POLL_INTERVAL_MS, self.poll_task_queue)
+    
+    def poll_task_queue(self):
+        """Deliver a finished background job, or check again later"""
+        try:
+            callback, result = self.task_queue.get_nowait()
+        except queue.Empty:
+            self.root.after(POLL_INTERVAL_MS, self.poll_task_queue)
+            return
+        
+        self.set_busy(False)
+        callback(result)
+    
+    def set_busy(self, busy, status=""):
+        """Enable or disable the controls while a background job runs"""
+        self.busy = busy
+        state = tk.DISABLED if busy else tk.NORMAL
+        for button in (self.load_button, self.generate_button, self.reset_button):
+            button.configure(state=state)
+        self.template_combo.configure(state=tk.DISABLED if busy else 'readonly')
+        
+        if busy:
+            self.progress.start(10)
+        else:
+            self.progress.stop()
+        self.status_var.set(status)
+    
+    def load_templates(self):
+        """Load available templates from the template index"""
+        if not os.path.exists(self.templates_dir):
+            messagebox.showerror("错误", f"模板目录不存在: {self.templates_dir}")
+            return
+        
+        def on_indexed(_):
+            templates = self.template_index.names()
+            if not templates:
+                messagebox.showwarning("警告", "模板目录中没有找到HTML文件")
+                return
+            
+            self.template_combo['values'] = templates
+            self.template_combo.current(0)
+            self.show_template_info(templates[0])
+        
+        def on_error(e):
+            messagebox.showerror("错误", f"扫描模板目录失败: {str(e)}")
+        
+        # Only new or modified templates are read while refreshing the index
+        self.run_in_background("正在扫描模板...", self.template_index.refresh, on_indexed, on_error)
+    
+    def show_template_info(self, template_name):
+        """Show the field count of a template without reading it"""
+        entry = self.template_index.get(template_name)
+        if entry is None:
+            self.template_info_var.set("")
+        else:
+            self.template_info_var.set(f"{entry['field_count']} 个可编辑字段")
+    
+    def on_template_selected(self, event=None):
+        """Handle template selection"""
+        template_name = self.template_var.get()
+        if not template_name or self.busy:
+            return
+        
+        self.show_template_info(template_name)
+        
+        def on_loaded(result):
+            # Parsed template: content, editable fields, compiled template
+            self.template_content, self.editable_fields, self.compiled_template = result
+            
+            # Create input widgets for each field
+            self.create_input_fields()
+            
+            messagebox.showinfo("成功", f"已加载模板: {template_name}\n找到 {len(self.editable_fields)} 个可编辑字段")
+        
+        def on_error(e):
+            messagebox.showerror("错误", f"加载模板失败: {str(e)}")
+        
+        # Read, flatten and parse off the Tk thread (cached by content hash)
+        self.run_in_background(
+            "正在加载模板...",
+            lambda: self.template_loader.load(template_name),
+            on_loaded,
+            on_error
+        )
+    
+    def create_input_fields(self):
+        """Show the editable fields of the loaded template"""
+        self.field_model = FieldModel(self.editable_fields)
+        self.field_list.set_model(self.field_model)
+    
+    def reset_fields(self):
+        """Reset all fields to default values"""
+        self.field_model.reset()
+        self.field_list.reload()
+    
+    def generate_html(self):
+        """Generate HTML file with user inputs"""
+        if self.busy:
+            return
+        
+        if not self.template_content:
+            messagebox.showerror("错误", "请先选择并加载一个模板")
+            return
+        
+        filename = self.filename_var.get().strip()
+        if not filename:
+            messagebox.showerror("错误", "请输入文件名")
+            return
+        
+        if not filename.endswith('.html'):
+            filename += '.html'
+        
+        # Collect user inputs on the Tk thread from the field model;
+        # rendering and writing run in the background
+        self.field_list.flush()
+        values = self.field_model.render_values()
+        
+        compiled_template = self.compiled_template
+        output_path = os.path.join(self.output_dir, filename)
+        pipeline = self.pipeline
+        
+        def render_and_save():
+            with instrumentation.stage('write'):
+                if pipeline is not None:
+                    # Minify and/or write the .gz sibling (see postprocess.py)
+                    buffer = io.BytesIO()
+                    compiled_template.render_to(buffer, values)
+                    pipeline.write(output_path, buffer.getvalue())
+                else:
+                    with atomic_write(output_path, encoding='utf-8') as f:
+                        compiled_template.render_to(f, values)
+                    remove_gzip_sibling(output_path)
+            instrumentation.count('pages_written')
+            if instrumentation.active() is not None:
+                instrumentation.count('bytes_written', os.path.getsize(output_path))
+        
+        def on_saved(_):
+            messagebox.showinfo(
+                "成功", 
+                f"HTML文件已生成!\n保存位置: {output_path}"
+            )
+        
+        def on_error(e):
+            messagebox.showerror("错误", f"保存文件失败: {str(e)}")
+        
+        self.run_in_background("正在生成HTML...", render_and_save, on_saved, on_error)
@@ -4,17 +4,183 @@
 Utility functions for page maker - shared HTML parsing and replacement logic
 """
 
+import functools
+import hashlib
+import io
+import json
+import mmap
+import os
 import re
-from html import escape
+import sys
+from array import array
+from html import escape, unescape
 from html.parser import HTMLParser
 
+import instrumentation
+from page_writer import atomic_write
+
+
+# Dict-style keys of a Field and the attributes they map to
+_FIELD_KEYS = {'class': 'class_name', 'content': 'content', 'start_pos': 'start_pos'}
+
+
+class Field:
+    """
+    One editable field: class name, default content and (line, column)
+    start position.
+    
+    Slotted, so it carries no per-instance dict. Supports read-only dict
+    access (field['class'], field.get('content'), keys(), dict(field)) and
+    compares equal to the equivalent dict, for code written against the
+    old dict records.
+    """
+    
+    __slots__ = ('class_name', 'content', 'start_pos')
+    
+    def __init__(self, class_name, content, start_pos):
+        self.class_name = class_name
+        self.content = content
+        self.start_pos = start_pos
+    
+    def __getitem__(self, key):
+        try:
+            return getattr(self, _FIELD_KEYS[key])
+        except KeyError:
+            raise KeyError(key) from None
+    
+    def get(self, key, default=None):
+        attr = _FIELD_KEYS.get(key)
+        return default if attr is None else getattr(self, attr)
+    
+    def keys(self):
+        return _FIELD_KEYS.keys()
+    
+    def __contains__(self, key):
+        return key in _FIELD_KEYS
+    
+    def __iter__(self):
+        return iter(_FIELD_KEYS)
+    
+    def as_dict(self):
+        return {'class': self.class_name, 'content': self.content, 'start_pos': self.start_pos}
+    
+    def __eq__(self, other):
+        if isinstance(other, Field):
+            return ((self.class_name, self.content, self.start_pos)
+                    == (other.class_name, other.content, other.start_pos))
+        if isinstance(other, dict):
+            return self.as_dict() == other
+        return NotImplemented
+    
+    __hash__ = None
+    
+    def __repr__(self):
+        return f"Field({self.class_name!r}, {self.content!r}, {self.start_pos!r})"
+
+
+class FieldTable:
+    """
+    The fields of one template, stored column by column.
+    
+    Class names (interned, so templates sharing names share the strings) and
+    contents are kept in two lists and the start positions as line, column
+    pairs in one integer array; Field records are only created when items
+    are accessed. Behaves like the list of fields it replaces: len(),
+    indexing, slicing, iteration and comparison with a list of Fields or
+    dicts.
+    """
+    
+    __slots__ = ('class_names', 'contents', 'positions')
+    
+    def __init__(self, fields=()):
+        self.class_names = []
+        self.contents = []
+        self.positions = array('l')
+        for field in fields:
+            self.append(field)
+    
+    def add(self, class_name, content, start_pos):
+        self.class_names.append(sys.intern(class_name))
+        self.contents.append(content)
+        self.positions.extend(start_pos)
+    
+    def append(self, field):
+        """Add a Field or a {'class', 'content', 'start_pos'} dict"""
+        self.add(field['class'], field['content'], field['start_pos'])
+    
+    def __len__(self):
+        return len(self.class_names)
+    
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("field index out of range")
+        positions = self.positions
+        return Field(self.class_names[index], self.contents[index],
+                     (positions[2 * index], positions[2 * index + 1]))
+    
+    def __iter__(self):
+        positions = self.positions
+        for index, (class_name, content) in enumerate(zip(self.class_names, self.contents)):
+            yield Field(class_name, content, (positions[2 * index], positions[2 * index + 1]))
+    
+    def __eq__(self, other):
+        if isinstance(other, FieldTable):
+            return (self.class_names == other.class_names and self.contents == other.contents
+                    and self.positions == other.positions)
+        if isinstance(other, (list, tuple)):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+    
+    __hash__ = None
+    
+    def __repr__(self):
+        return f"FieldTable({list(self)!r})"
+
+
+class FieldModel:
+    """
+    Values of the editable fields of the loaded template.
+    
+    Kept independent of any widget, so only the visible rows of the field
+    list need widgets. Fields sharing a class name are edited together, as
+    one value replaces all of them.
+    """
+    
+    def __init__(self, fields=()):
+        self.defaults = {}
+        for field in fields:
+            self.defaults[field['class']] = field['content']
+        self.names = list(self.defaults)
+        self.values = dict(self.defaults)
+    
+    def __len__(self):
+        return len(self.names)
+    
+    def get(self, class_name):
+        return self.values[class_name]
+    
+    def set(self, class_name, value):
+        self.values[class_name] = value
+    
+    def reset(self):
+        """Restore every field to its default content"""
+        self.values = dict(self.defaults)
+    
+    def render_values(self):
+        """Field values as passed to CompiledTemplate.render"""
+        return {class_name: value.strip() for class_name, value in self.values.items()}
+
 
 class PTagParser(HTMLParser):
     """Parser to find <p> tags with class attribute"""
     
     def __init__(self):
         super().__init__()
-        self.p_tags = []  # List of (class_name, content, start_pos)
+        self.p_tags = FieldTable()
         self.current_p_class = None
         self.current_p_start = None
         self.capture_content = False
@@ -33,11 +199,7 @@ class PTagParser(HTMLParser):
     def handle_endtag(self, tag):
         if tag == 'p' and self.capture_content:
             content = ''.join(self.current_content)
-            self.p_tags.append({
-                'class': self.current_p_class,
-                'content': content,
-                'start_pos': self.current_p_start
-            })
+            self.p_tags.add(self.current_p_class, content, self.current_p_start)
             self.capture_content = False
             self.current_p_class = None
             self.current_content = []
@@ -47,6 +209,214 @@ class PTagParser(HTMLParser):
             self.current_content.append(data)
 
 
+# Tokens PTagScanner stops at. Everything else - text outside <p> tags and
+# the inside of comments, declarations and <script>/<style> - is skipped by
+# the regex engine without being tokenized.
+_SCAN_TOKEN_RE = re.compile(r"""
+    <!--.*?(?:-->|\Z)                                       # comment
+  | <![^>]*>                                               # doctype / declaration
+  | <\?[^>]*>                                              # processing instruction
+  | <(?P<start>[a-zA-Z][^\t\n\r\f />\x00]*)                # start tag name
+      (?P<attrs>(?:[^>"']|"[^"]*"|'[^']*')*)>               # attributes
+  | </(?P<end>[a-zA-Z][^\t\n\r\f />\x00]*)[^>]*>           # end tag
+""", re.VERBOSE | re.DOTALL)
+
+# Attribute syntax as accepted by html.parser, including the separators
+# that follow each attribute
+_SCAN_ATTR_RE = re.compile(r"""
+    ((?<=['"\s/])[^\s/>][^\s/=>]*)
+    (?:\s*=+\s*('[^']*'|"[^"]*"|(?!['"])[^>\s]*))?
+    (?:\s|/(?!>))*
+""", re.VERBOSE)
+_SCAN_ATTR_START_RE = re.compile(r'(?:\s|/(?!>))*')
+
+
+class PTagScanner:
+    """
+    Regex-based drop-in for PTagParser.
+    
+    Produces the same p_tags list (class, content with entities decoded,
+    start_pos as (line, column)) but only looks at tags: text outside <p>
+    tags and the bodies of comments, <script> and <style> blocks are
+    jumped over by the regex engine instead of being run through
+    HTMLParser. Unlike PTagParser, feed() expects the whole document at once.
+    """
+    
+    def __init__(self):
+        self.p_tags = FieldTable()
+    
+    def feed(self, data):
+        current_class = None
+        current_start = None
+        content = []
+        pos = 0
+        line, line_start = 1, 0
+        
+        while True:
+            match = _SCAN_TOKEN_RE.search(data, pos)
+            if match is None:
+                break
+            if current_class is not None and match.start() > pos:
+                content.append(unescape(data[pos:match.start()]))
+            pos = match.end()
+            
+            end_tag = match.group('end')
+            if end_tag is not None:
+                if end_tag.lower() == 'p' and current_class is not None:
+                    self._add(current_class, content, current_start)
+                    current_class = None
+                continue
+            
+            tag = match.group('start')
+            if tag is None:
+                continue
+            tag = tag.lower()
+            self_closing = self._is_self_closing(match)
+            
+            if tag in HTMLParser.CDATA_CONTENT_ELEMENTS and not self_closing:
+                # Raw text up to the matching end tag, passed on undecoded
+                # like HTMLParser does
+                close = re.compile(rf'</\s*{tag}\s*>', re.IGNORECASE).search(data, pos)
+                body_end = close.start() if close else len(data)
+                if current_class is not None:
+                    content.append(data[pos:body_end])
+                pos = close.end() if close else len(data)
+            
+            elif tag == 'p':
+                class_name = self._class_of(match)
+                if class_name:
+                    line += data.count('\n', line_start, match.start())
+                    line_start = data.rfind('\n', 0, match.start()) + 1
+                    current_class = class_name
+                    current_start = (line, match.start() - line_start)
+                    content = []
+                # <p/> is a start tag immediately followed by an end tag
+                if self_closing and current_class is not None:
+                    self._add(current_class, content, current_start)
+                    current_class = None
+    
+    def _add(self, class_name, content, start_pos):
+        self.p_tags.add(class_name, ''.join(content), start_pos)
+    
+    @staticmethod
+    def _is_self_closing(match):
+        """
+        True if a start tag match ends in '/>' whose slash is not part of an
+        unquoted attribute value: <p class=a/> has the class 'a/' and stays
+        open, like in HTMLParser
+        """
+        if not match.group(0).endswith('/>'):
+            return False
+        data = match.string
+        pos = _SCAN_ATTR_START_RE.match(data, match.end('start')).end()
+        end = match.end('attrs')
+        while pos < end:
+            attr = _SCAN_ATTR_RE.match(data, pos)
+            if attr is None:
+                break
+            pos = attr.end()
+        return pos < end
+    
+    @staticmethod
+    def _class_of(match):
+        """First non-empty class attribute value of a start tag match, or None"""
+        data = match.string
+        pos = _SCAN_ATTR_START_RE.match(data, match.end('start')).end()
+        end = match.end('attrs')
+        while pos < end:
+            attr = _SCAN_ATTR_RE.match(data, pos, end)
+            if attr is None:
+                break
+            pos = attr.end()
+            value = attr.group(2)
+            if attr.group(1).lower() != 'class' or not value:
+                continue
+            if value[:1] == value[-1:] and value[:1] in ('"', "'"):
+                value = value[1:-1]
+            if value:
+                return unescape(value)
+        return None
+
+
+# Escaping policies of a field value
+ESCAPE = 'escape'        # html.escape(): & < > " ' become entities (the default)
+RAW = 'raw'              # trusted HTML, inserted as is
+ATTRIBUTE = 'attribute'  # every ASCII character except letters and digits as &#xHH;
+
+# Policy of fields a policy mapping does not list
+DEFAULT_POLICY_KEY = '*'
+
+_ATTRIBUTE_TABLE = str.maketrans({
+    chr(code): f'&#x{code:02X};' for code in range(128) if not chr(code).isalnum()
+})
+
+
+def escape_text(value):
+    """
+    Same result as html.escape(value), but values without any of & < > " '
+    are returned as they are without being copied.
+    """
+    if '&' in value or '<' in value or '>' in value or '"' in value or "'" in value:
+        return escape(value)
+    return value
+
+
+def escape_attribute(value):
+    """Escape a value so it is also safe inside any HTML attribute"""
+    return value.translate(_ATTRIBUTE_TABLE)
+
+
+ESCAPERS = {
+    ESCAPE: escape_text,
+    RAW: None,
+    ATTRIBUTE: escape_attribute,
+}
+
+
+def field_policy(escape_html, class_name):
+    """
+    Resolve the escaping policy of one field.
+    
+    Args:
+        escape_html: True (ESCAPE for every field), False (RAW for every
+            field), a policy name, or a mapping of class name -> policy
+            name; fields the mapping does not list use its '*' entry, or
+            ESCAPE
+        class_name: Class name of the field
+    
+    Returns:
+        Policy name
+    """
+    if escape_html is True:
+        return ESCAPE
+    if escape_html is False:
+        return RAW
+    if isinstance(escape_html, str):
+        return escape_html
+    return escape_html.get(class_name, escape_html.get(DEFAULT_POLICY_KEY, ESCAPE))
+
+
+def escape_value(value, policy=ESCAPE):
+    """Apply an escaping policy to a field value"""
+    try:
+        escaper = ESCAPERS[policy]
+    except KeyError:
+        raise ValueError(f"Unknown escaping policy: {policy!r}") from None
+    return value if escaper is None else escaper(value)
+
+
+def escape_values(values, escape_html=True):
+    """
+    Apply each field's escaping policy (see field_policy) to a mapping of
+    class name -> value.
+    """
+    if escape_html is True:
+        return {name: escape_text(content) for name, content in values.items()}
+    if escape_html is False:
+        return values
+    return {name: escape_value(content, field_policy(escape_html, name)) for name, content in values.items()}
+
+
 def replace_content_safe(template, class_name, new_content, escape_html=True):
     """
     Safely replace content in a <p class="..."> tag.
@@ -55,14 +425,16 @@ def replace_content_safe(template, class_name, new_content, escape_html=True):
         template: HTML template string
         class_name: CSS class name of the <p> tag
         new_content: New content to insert
-        escape_html: If True, escapes HTML entities to prevent XSS (default: True)
+        escape_html: If True, escapes HTML entities to prevent XSS (default: True);
+            also accepts a policy name or a per-field policy mapping (see field_policy)
         
     Returns:
         Modified HTML string with content replaced
     """
+    instrumentation.count('replace_calls')
+    
     # Escape HTML to prevent XSS vulnerabilities
-    if escape_html:
-        new_content = escape(new_content)
+    new_content = escape_value(new_content, field_policy(escape_html, class_name))
     
     # Pattern handles both double and single quotes
     pattern = rf'(<p\s+class=["\']?{re.escape(class_name)}["\']?>)(.*?)(</p>)'
@@ -71,3 +443,612 @@ def replace_content_safe(template, class_name, new_content, escape_html=True):
         return match.group(1) + new_content + match.group(3)
     
     return re.sub(pattern, replacement_func, template, flags=re.DOTALL)
+
+
+# Combined patterns kept by bulk_pattern(), one per distinct set of names
+BULK_PATTERN_CACHE_SIZE = 256
+
+
+@functools.lru_cache(maxsize=BULK_PATTERN_CACHE_SIZE)
+def bulk_pattern(class_names):
+    """
+    Compile one pattern that matches the <p> tag of any of the class names.
+    
+    Args:
+        class_names: Sorted tuple of class names
+        
+    Returns:
+        Compiled pattern; group 1 is the opening tag, group 2 the class name
+    """
+    # Longest first, so no name loses to a name that is its prefix
+    alternatives = '|'.join(re.escape(name) for name in sorted(class_names, key=len, reverse=True))
+    return re.compile(rf'(<p\s+class=["\']?({alternatives})["\']?>).*?</p>', re.DOTALL)
+
+
+def replace_contents_safe(template, values, escape_html=True):
+    """
+    Replace the content of several <p class="..."> tags in one pass.
+    
+    Gives the same result as calling replace_content_safe for every item of
+    values in turn, but scans the template once with a single pattern, which
+    is compiled once per set of class names (see bulk_pattern).
+    
+    Args:
+        template: HTML template string
+        values: Mapping of class name to new content
+        escape_html: If True, escapes HTML entities to prevent XSS (default: True);
+            also accepts a policy name or a per-field policy mapping (see field_policy)
+        
+    Returns:
+        Modified HTML string with content replaced
+    """
+    if not values:
+        return template
+    if CompiledTemplate._needs_chained_render(values, escape_html):
+        # Inserted <p> markup can be matched again by later replacements
+        for class_name, new_content in values.items():
+            template = replace_content_safe(template, class_name, new_content, escape_html)
+        return template
+    
+    values = escape_values(values, escape_html)
+    
+    def replacement_func(match):
+        return match.group(1) + values[match.group(2)] + '</p>'
+    
+    with instrumentation.stage('replace'):
+        result, substitutions = bulk_pattern(tuple(sorted(values))).subn(replacement_func, template)
+    instrumentation.count('substitutions', substitutions)
+    return result
+
+
+# Bump whenever the rendered output for the same template and values changes
+RENDERER_VERSION = 1
+
+# Characters encoded per write when streaming to binary files and sockets
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Opening tag of any editable slot. The class value is captured without its
+# quotes; for every class name free of quotes and angle brackets this finds
+# exactly the tags that the per-name pattern in replace_content_safe matches.
+_SLOT_OPEN_RE = re.compile(r'<p\s+class=["\']?([^"\'<>]*)["\']?>')
+_SLOT_CLOSE = '</p>'
+
+
+class CompiledTemplate:
+    """
+    Template with its editable <p class="..."> slots located once.
+
+    The template text is split into static chunks and slots when the object
+    is built, so rendering a page is a single join instead of one full
+    re.sub pass over the template per field. The output is byte-identical
+    to chaining replace_content_safe over the same values.
+    """
+    
+    def __init__(self, template, layout=None):
+        self.template = template
+        self.chunks = []  # Static text around the slots, len(slots) + 1 items
+        self.slots = []   # List of (class_name, default_content, alternates)
+        self._content_hash = None
+        if layout is None:
+            layout = self._scan(template)
+        self.layout = layout
+        self._build(layout)
+    
+    @staticmethod
+    def _scan(text):
+        """
+        Locate the slots of a template.
+        
+        Returns:
+            List of (class_name, content_start, content_end, alternates)
+            tuples; alternates are (offset into the content, class_name) pairs
+        """
+        layout = []
+        openings = _SLOT_OPEN_RE.finditer(text)
+        pending = next(openings, None)
+        
+        while pending is not None:
+            close = text.find(_SLOT_CLOSE, pending.end())
+            if close == -1:
+                # No closing tag left, so no later opening can match either
+                break
+            
+            # Every opening before the closing tag shares it. The regex only
+            # matches the first one unless that one is not being replaced, so
+            # the later ones are kept as alternates (offset into the content).
+            alternates = []
+            following = next(openings, None)
+            while following is not None and following.start() < close:
+                alternates.append((following.end() - pending.end(), following.group(1)))
+                following = next(openings, None)
+            
+            layout.append((pending.group(1), pending.end(), close, tuple(alternates)))
+            pending = following
+        
+        return layout
+    
+    def _build(self, layout):
+        text = self.template
+        pos = 0
+        for class_name, start, end, alternates in layout:
+            self.chunks.append(text[pos:start])
+            self.slots.append((class_name, text[start:end], alternates))
+            pos = end
+        self.chunks.append(text[pos:])
+    
+    @property
+    def content_hash(self):
+        """SHA-256 of the template text encoded as UTF-8"""
+        if self._content_hash is None:
+            self._content_hash = hashlib.sha256(self.template.encode('utf-8')).hexdigest()
+        return self._content_hash
+    
+    @property
+    def slot_names(self):
+        """Class names of the slots, in document order"""
+        return [name for name, _, _ in self.slots]
+    
+    def render(self, values, escape_html=True):
+        """
+        Render the template with the given field values.
+        
+        Args:
+            values: Mapping of class name to new content; slots whose class
+                name is missing keep their default content
+            escape_html: If True, escapes HTML entities to prevent XSS (default: True);
+                also accepts a policy name or a per-field policy mapping (see field_policy)
+            
+        Returns:
+            Rendered HTML string
+        """
+        with instrumentation.stage('render'):
+            return ''.join(self._parts(values, escape_html))
+    
+    def iter_render(self, values, escape_html=True):
+        """
+        Render the template as a sequence of string chunks.
+        
+        Yields the static segments of the template interleaved with the
+        (escaped) field values, without joining them into one page string.
+        Joining the chunks gives exactly what render() returns.
+        """
+        yield from self._parts(values, escape_html)
+    
+    def _parts(self, values, escape_html):
+        """
+        List of the pieces of the rendered page.
+        
+        The pieces are the template's own static chunks and the field
+        values, referenced rather than copied, so the list stays small
+        whatever the size of the page.
+        """
+        if self._needs_chained_render(values, escape_html):
+            instrumentation.count('chained_renders')
+            result = self.template
+            for class_name, new_content in values.items():
+                result = replace_content_safe(result, class_name, new_content, escape_html)
+            return [result]
+        
+        if escape_html is not False:
+            with instrumentation.stage('escape'):
+                values = escape_values(values, escape_html)
+        
+        recorder = instrumentation.active()
+        if recorder is not None:
+            recorder.count('substitutions', sum(1 for name, _, _ in self.slots if name in values))
+        
+        chunks = self.chunks
+        parts = [chunks[0]]
+        for idx, (name, default, alternates) in enumerate(self.slots):
+            if name in values:
+                parts.append(values[name])
+            else:
+                for offset, alt_name in alternates:
+                    if alt_name in values:
+                        parts.append(default[:offset])
+                        parts.append(values[alt_name])
+                        break
+                else:
+                    parts.append(default)
+            parts.append(chunks[idx + 1])
+        
+        return parts
+    
+    def render_to(self, target, values, escape_html=True, encoding='utf-8',
+                  chunk_size=STREAM_CHUNK_SIZE):
+        """
+        Stream the rendered page into a file object or socket.
+        
+        Text streams receive str chunks. Binary files and sockets receive
+        the chunks encoded, at most chunk_size characters at a time, so
+        memory use does not grow with the size of the page.
+        
+        Args:
+            target: Text file, binary file, or socket (anything with sendall)
+            values: Mapping of class name to new content
+            escape_html: If True, escapes HTML entities to prevent XSS (default: True)
+            encoding: Encoding for binary files and sockets
+            chunk_size: Largest piece encoded at once, in characters
+            
+        Returns:
+            Number of bytes written, or characters for text streams
+        """
+        with instrumentation.stage('render'):
+            if isinstance(target, io.TextIOBase):
+                written = 0
+                for chunk in self.iter_render(values, escape_html):
+                    target.write(chunk)
+                    written += len(chunk)
+                return written
+            
+            send = getattr(target, 'sendall', None) or target.write
+            written = 0
+            for chunk in self.iter_render(values, escape_html):
+                for start in range(0, len(chunk), chunk_size):
+                    data = chunk[start:start + chunk_size].encode(encoding)
+                    send(data)
+                    written += len(data)
+            return written
+    
+    @staticmethod
+    def _needs_chained_render(values, escape_html):
+        """
+        Check for inputs the precomputed slot layout cannot reproduce.
+        
+        Raw content that contains <p> markup changes which tags later
+        replacements see, and class names with quotes or angle brackets are
+        never captured by the slot scanner. Both are rendered the slow way.
+        """
+        for name, content in values.items():
+            if (('<p' in content or _SLOT_CLOSE in content)
+                    and field_policy(escape_html, name) == RAW):
+                return True
+            if any(char in name for char in '"\'<>'):
+                return True
+        return False
+
+
+# Field extractors by name. Both produce the same p_tags; 'scanner' skips
+# everything but the tags and is faster on templates with large inline
+# <style> and <script> blocks.
+EXTRACTORS = {
+    'parser': PTagParser,
+    'scanner': PTagScanner,
+}
+DEFAULT_EXTRACTOR = 'parser'
+
+
+def decode_template(data):
+    """
+    Decode the bytes of a template file.
+    
+    Gives the same text as open(path, encoding='utf-8').read(), including
+    its translation of \\r\\n and \\r line endings to \\n.
+    """
+    text = data.decode('utf-8')
+    if '\r' in text:
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+    return text
+
+
+def parse_fields(template, extractor=DEFAULT_EXTRACTOR):
+    """
+    Extract the editable fields of a template.
+    
+    Args:
+        template: HTML template string
+        extractor: Key of EXTRACTORS, 'parser' (PTagParser) or 'scanner' (PTagScanner)
+        
+    Returns:
+        FieldTable of the fields, as in PTagParser.p_tags
+    """
+    try:
+        parser = EXTRACTORS[extractor]()
+    except KeyError:
+        raise ValueError(f"Unknown extractor: {extractor!r}") from None
+    parser.feed(template)
+    return parser.p_tags
+
+
+# Bump whenever PTagParser or the slot scanner changes what they extract, so
+# entries written by an older version are never used
+PARSER_VERSION = 3
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'templates')
+DEFAULT_CACHE_SIZE = 32 * 1024 * 1024  # bytes
+
+
+class TemplateCache:
+    """
+    On-disk cache of parsed templates.
+    
+    Each entry holds the field list from PTagParser and the slot layout of
+    the CompiledTemplate, keyed by the SHA-256 of the template file and
+    PARSER_VERSION. A changed template hashes to a new key, so stale entries
+    are never read; they age out through LRU eviction once the cache grows
+    past max_bytes. A cache_dir of None disables the cache. The extractor
+    (see EXTRACTORS) is part of the key as well.
+    """
+    
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_SIZE,
+                 extractor=DEFAULT_EXTRACTOR):
+        if extractor not in EXTRACTORS:
+            raise ValueError(f"Unknown extractor: {extractor!r}")
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.extractor = extractor
+        self.hits = 0
+        self.misses = 0
+    
+    def load(self, template_path):
+        """
+        Read a template file and return its parsed form.
+        
+        Returns:
+            (template_content, fields, compiled_template) tuple
+        """
+        with instrumentation.stage('read'):
+            with open(template_path, 'rb') as f:
+                data = f.read()
+        instrumentation.count('bytes_read', len(data))
+        template = decode_template(data)
+        fields, compiled = self.get(template, hashlib.sha256(data).hexdigest())
+        return template, fields, compiled
+    
+    def get(self, template, content_hash=None):
+        """
+        Return (fields, compiled_template) for template text, parsing it
+        only when the cache has no entry for it.
+        """
+        if self.cache_dir is None:
+            self.misses += 1
+            fields, compiled = self._parse(template)
+            if content_hash is not None:
+                compiled._content_hash = content_hash
+            return fields, compiled
+        
+        if content_hash is None:
+            content_hash = hashlib.sha256(template.encode('utf-8')).hexdigest()
+        entry_name = f"{content_hash}-v{PARSER_VERSION}-{self.extractor}.json"
+        entry_path = os.path.join(self.cache_dir, entry_name)
+        
+        entry = self._read_entry(entry_path)
+        if entry is not None:
+            self.hits += 1
+            instrumentation.count('template_cache_hits')
+            fields = FieldTable()
+            for class_name, content, start_pos in entry['fields']:
+                fields.add(class_name, content, start_pos)
+            layout = [
+                (class_name, start, end, tuple(tuple(alt) for alt in alternates))
+                for class_name, start, end, alternates in entry['layout']
+            ]
+            compiled = CompiledTemplate(template, layout)
+            compiled._content_hash = content_hash
+            return fields, compiled
+        
+        self.misses += 1
+        fields, compiled = self._parse(template)
+        compiled._content_hash = content_hash
+        self._write_entry(entry_path, {
+            'fields': [[f.class_name, f.content, f.start_pos] for f in fields],
+            'layout': compiled.layout,
+        })
+        return fields, compiled
+    
+    def _parse(self, template):
+        with instrumentation.stage('parse'):
+            fields = parse_fields(template, self.extractor)
+        with instrumentation.stage('compile'):
+            compiled = CompiledTemplate(template)
+        instrumentation.count('bytes_parsed', len(template))
+        instrumentation.count('fields_found', len(fields))
+        return fields, compiled
+    
+    def _read_entry(self, entry_path):
+        try:
+            with open(entry_path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+            # Mark as recently used for LRU eviction
+            os.utime(entry_path)
+            return entry
+        except (OSError, ValueError):
+            return None
+    
+    def _write_entry(self, entry_path, entry):
+        # Caching is best effort: a read-only or full disk just means the
+        # template is parsed again next time
+        try:
+            with atomic_write(entry_path, fsync=True, encoding='utf-8') as f:
+                json.dump(entry, f, ensure_ascii=False, separators=(',', ':'))
+            self.evict()
+        except OSError:
+            pass
+    
+    def evict(self):
+        """Delete least recently used entries until the cache fits in max_bytes"""
+        entries = []
+        total = 0
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if entry.name.endswith('.json') and entry.is_file():
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+        
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+
+# _SLOT_OPEN_RE for UTF-8 bytes. For str patterns \s also matches Unicode
+# whitespace, so the same characters are spelled out as UTF-8 sequences.
+_UNICODE_SPACES = '\x85\xa0\u1680\u2000\u2001\u2002\u2003\u2004\u2005\u2006\u2007\u2008\u2009\u200a\u2028\u2029\u202f\u205f\u3000'
+_BYTES_SPACE = b'(?:[\t\n\x0b\x0c\r\x1c-\x1f ]|' + b'|'.join(
+    re.escape(char.encode('utf-8')) for char in _UNICODE_SPACES) + b')'
+_SLOT_OPEN_BYTES_RE = re.compile(b'<p' + _BYTES_SPACE + b'+class=["\']?([^"\'<>]*)["\']?>')
+_SLOT_CLOSE_BYTES = b'</p>'
+
+
+class MappedTemplate:
+    """
+    Template file rendered straight from a memory map.
+    
+    The slots are located on the raw bytes, and the static regions are kept
+    as memoryview slices of the map, so they are written to the output
+    without being decoded, copied or re-encoded; only the field values are
+    encoded. The output is byte-identical to CompiledTemplate.render() on
+    the decoded template encoded as UTF-8. Templates with \\r line endings,
+    which reading in text mode would translate, and inputs that need the
+    chained fallback of CompiledTemplate are rendered through the str path.
+    
+    Pickling keeps only the path and the slot layout; the file is mapped
+    again when unpickled, e.g. in a batch worker process.
+    """
+    
+    def __init__(self, path, layout=None):
+        self.path = path
+        self._content_hash = None
+        self._compiled = None
+        self._open()
+        
+        if b'\r' in self._map:
+            self._compiled = CompiledTemplate(decode_template(bytes(self._map)))
+            self.layout = []
+        else:
+            self.layout = layout if layout is not None else self._scan(self._map)
+        self._build(self.layout)
+    
+    def _open(self):
+        with open(self.path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                # Empty files cannot be mapped
+                self._map = b''
+        self._view = memoryview(self._map)
+    
+    @staticmethod
+    def _scan(data):
+        """Slot layout in byte offsets, as CompiledTemplate._scan"""
+        layout = []
+        openings = _SLOT_OPEN_BYTES_RE.finditer(data)
+        pending = next(openings, None)
+        
+        while pending is not None:
+            close = data.find(_SLOT_CLOSE_BYTES, pending.end())
+            if close == -1:
+                break
+            
+            alternates = []
+            following = next(openings, None)
+            while following is not None and following.start() < close:
+                alternates.append((following.end() - pending.end(), following.group(1).decode('utf-8')))
+                following = next(openings, None)
+            
+            layout.append((pending.group(1).decode('utf-8'), pending.end(), close, tuple(alternates)))
+            pending = following
+        
+        return layout
+    
+    def _build(self, layout):
+        view = self._view
+        self.chunks = []  # memoryview slices of the static regions
+        self.slots = []   # List of (class_name, default_view, alternates)
+        pos = 0
+        for class_name, start, end, alternates in layout:
+            self.chunks.append(view[pos:start])
+            self.slots.append((class_name, view[start:end], alternates))
+            pos = end
+        self.chunks.append(view[pos:])
+    
+    @property
+    def content_hash(self):
+        """SHA-256 of the template file"""
+        if self._content_hash is None:
+            self._content_hash = hashlib.sha256(self._map).hexdigest()
+        return self._content_hash
+    
+    def render_to(self, target, values, escape_html=True, encoding='utf-8'):
+        """
+        Write the rendered page to a binary file object or socket.
+        
+        Returns:
+            Number of bytes written
+        """
+        with instrumentation.stage('render'):
+            if encoding != 'utf-8':
+                raise ValueError("MappedTemplate only renders UTF-8")
+            send = getattr(target, 'sendall', None) or target.write
+            
+            if self._compiled is not None or CompiledTemplate._needs_chained_render(values, escape_html):
+                html = ''.join(self._str_template()._parts(values, escape_html)).encode('utf-8')
+                send(html)
+                return len(html)
+            
+            encoded = {}
+            for name, content in escape_values(values, escape_html).items():
+                encoded[name] = content.encode('utf-8')
+            
+            chunks = self.chunks
+            written = len(chunks[0])
+            send(chunks[0])
+            for idx, (name, default, alternates) in enumerate(self.slots):
+                if name in encoded:
+                    piece = encoded[name]
+                else:
+                    piece = default
+                    for offset, alt_name in alternates:
+                        if alt_name in encoded:
+                            send(default[:offset])
+                            written += offset
+                            piece = encoded[alt_name]
+                            break
+                send(piece)
+                send(chunks[idx + 1])
+                written += len(piece) + len(chunks[idx + 1])
+            return written
+    
+    def render_bytes(self, values, escape_html=True):
+        """Rendered page as UTF-8 bytes"""
+        buffer = io.BytesIO()
+        self.render_to(buffer, values, escape_html)
+        return buffer.getvalue()
+    
+    def render(self, values, escape_html=True):
+        """Rendered page as a string, like CompiledTemplate.render"""
+        return self.render_bytes(values, escape_html).decode('utf-8')
+    
+    def _str_template(self):
+        if self._compiled is None:
+            self._compiled = CompiledTemplate(decode_template(bytes(self._map)))
+        return self._compiled
+    
+    def close(self):
+        """Release the memoryviews and unmap the file"""
+        for view in self.chunks:
+            view.release()
+        for _, default, _ in self.slots:
+            default.release()
+        self.chunks, self.slots = [], []
+        self._view.release()
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+    
+    def __getstate__(self):
+        return {'path': self.path, 'layout': self.layout}
+    
+    def __setstate__(self, state):
+        self.__init__(state['path'], state['layout'])
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Opt-in timings and counters for the generation pipeline
+
+Recording is off by default; stage() then returns a shared no-op context
+manager and count() returns at once, so the hooks in html_utils and batch
+cost one global lookup each. Turn it on around a run:
+
+    import instrumentation
+
+    recorder = instrumentation.enable(trace=True)
+    ...  # load templates, render pages
+    instrumentation.disable()
+    recorder.save_report('report.json')     # per-stage timings and counters
+    recorder.save_trace('trace.json')       # chrome://tracing / Perfetto
+
+Stages nest: 'write' covers the 'render' that streams into the file.
+
+    python3 page_maker.py batch posts.jsonl --report report.json --trace trace.json
+    python3 page_maker.py batch posts.jsonl --cprofile batch.prof --tracemalloc
+"""
+
+import contextlib
+import json
+import os
+import threading
+import time
+
+
+# Trace events kept per recorder; timings and counters are always complete
+MAX_TRACE_EVENTS = 1_000_000
+
+# Allocation sites listed in the report with --tracemalloc
+TRACEMALLOC_TOP = 20
+
+_recorder = None
+
+
+class _NullStage:
+    """Context manager that does nothing, used while recording is off"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    __slots__ = ('recorder', 'name', 'start')
+
+    def __init__(self, recorder, name):
+        self.recorder = recorder
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.recorder.add_timing(self.name, self.start, time.perf_counter_ns() - self.start)
+        return False
+
+
+class Recorder:
+    """
+    Collected stage timings, counters and (optionally) trace events.
+
+    Attributes:
+        stages: Stage name -> [calls, total_ns, max_ns]
+        counters: Counter name -> value
+        events: (name, start_ns, duration_ns, pid, tid) tuples when tracing
+    """
+
+    def __init__(self, trace=False):
+        self.trace = trace
+        self.stages = {}
+        self.counters = {}
+        self.events = []
+        self.memory = None
+        self.started = time.perf_counter_ns()
+        self.stopped = None
+        self._lock = threading.Lock()
+
+    def stage(self, name):
+        return _Stage(self, name)
+
+    def add_timing(self, name, start, duration):
+        with self._lock:
+            timing = self.stages.get(name)
+            if timing is None:
+                self.stages[name] = [1, duration, duration]
+            else:
+                timing[0] += 1
+                timing[1] += duration
+                if duration > timing[2]:
+                    timing[2] = duration
+            if self.trace and len(self.events) < MAX_TRACE_EVENTS:
+                self.events.append((name, start, duration, os.getpid(), threading.get_ident()))
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def drain(self):
+        """
+        Return everything recorded so far as a picklable dict and start
+        over; used to ship a worker process's data to the parent
+        """
+        with self._lock:
+            data = {'stages': self.stages, 'counters': self.counters, 'events': self.events}
+            self.stages = {}
+            self.counters = {}
+            self.events = []
+        return data
+
+    def merge(self, data):
+        """Add the output of another recorder's drain()"""
+        with self._lock:
+            for name, (calls, total, longest) in data['stages'].items():
+                timing = self.stages.setdefault(name, [0, 0, 0])
+                timing[0] += calls
+                timing[1] += total
+                timing[2] = max(timing[2], longest)
+            for name, amount in data['counters'].items():
+                self.counters[name] = self.counters.get(name, 0) + amount
+            room = MAX_TRACE_EVENTS - len(self.events)
+            if self.trace and room > 0:
+                self.events.extend(data['events'][:room])
+
+    def report(self):
+        """Timings in milliseconds and counters as a JSON-ready dict"""
+        end = self.stopped if self.stopped is not None else time.perf_counter_ns()
+        stages = {}
+        for name, (calls, total, longest) in sorted(self.stages.items()):
+            stages[name] = {
+                'calls': calls,
+                'total_ms': total / 1e6,
+                'mean_ms': total / calls / 1e6,
+                'max_ms': longest / 1e6,
+            }
+        report = {
+            'wall_ms': (end - self.started) / 1e6,
+            'stages': stages,
+            'counters': dict(sorted(self.counters.items())),
+        }
+        if self.memory is not None:
+            report['memory'] = self.memory
+        return report
+
+    def trace_events(self):
+        """Events in the Chrome trace-event format (complete 'X' events, microseconds)"""
+        return [
+            {'name': name, 'cat': 'page_maker', 'ph': 'X', 'pid': pid, 'tid': tid,
+             'ts': (start - self.started) / 1000, 'dur': duration / 1000}
+            for name, start, duration, pid, tid in self.events
+        ]
+
+    def save_report(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.report(), f, indent=2, ensure_ascii=False)
+
+    def save_trace(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': self.trace_events(), 'displayTimeUnit': 'ms'}, f)
+
+
+def enable(trace=False):
+    """
+    Start recording in this process.
+
+    Args:
+        trace: Also keep every stage as a trace event (for save_trace)
+
+    Returns:
+        The new Recorder
+    """
+    global _recorder
+    _recorder = Recorder(trace)
+    return _recorder
+
+
+def disable():
+    """
+    Stop recording.
+
+    Returns:
+        The Recorder that was active, or None
+    """
+    global _recorder
+    recorder = _recorder
+    _recorder = None
+    if recorder is not None:
+        recorder.stopped = time.perf_counter_ns()
+    return recorder
+
+
+def active():
+    """The active Recorder, or None when recording is off"""
+    return _recorder
+
+
+def stage(name):
+    """Context manager timing one stage; a no-op while recording is off"""
+    if _recorder is None:
+        return _NULL_STAGE
+    return _Stage(_recorder, name)
+
+
+def count(name, amount=1):
+    """Add to a counter; a no-op while recording is off"""
+    if _recorder is not None:
+        _recorder.count(name, amount)
+
+
+@contextlib.contextmanager
+def profiled(cprofile_path=None, trace_memory=False):
+    """
+    Run the block under cProfile and/or tracemalloc.
+
+    Args:
+        cprofile_path: Write pstats data here (view with `python -m pstats`)
+        trace_memory: Record the peak traced memory and the top allocation
+            sites in the active recorder's report
+    """
+    # Imported only when asked for, so that ordinary runs do not pay for them
+    profiler = None
+    if cprofile_path:
+        import cProfile
+        profiler = cProfile.Profile()
+    if trace_memory:
+        import tracemalloc
+        tracemalloc.start()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(cprofile_path)
+        if trace_memory:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            if _recorder is not None:
+                _recorder.memory = {
+                    'current_bytes': current,
+                    'peak_bytes': peak,
+                    'top': [
+                        {'site': str(stat.traceback), 'bytes': stat.size, 'blocks': stat.count}
+                        for stat in snapshot.statistics('lineno')[:TRACEMALLOC_TOP]
+                    ],
+                }
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Listing pages - paginated index, tag and monthly archive pages
+
+While a batch renders posts, a small metadata record (date, title, tags,
+output filename) is taken from the field values of every row and added to a
+ListingSpool. The spool keeps at most SORT_RUN_SIZE entries in memory: full
+buffers are sorted and spilled to temporary files, and the listing pages are
+produced from a heapq.merge of those runs, so a manifest of 100k+ posts is
+never held in memory at once.
+
+Every listing page is an ordinary template render. The listing template
+(templates/_listing.html by default) has three fields:
+
+    <p class="listing-title">     page title, escaped
+    <p class="listing-items">     list of links to the posts, HTML
+    <p class="listing-pagination">links to the other pages, HTML
+
+    python3 page_maker.py batch posts.jsonl --listings --incremental
+"""
+
+import hashlib
+import heapq
+import json
+import os
+import re
+import tempfile
+from html import escape
+from itertools import groupby, islice
+from urllib.parse import quote
+
+from html_utils import DEFAULT_POLICY_KEY, ESCAPE, RAW
+
+
+DEFAULT_LISTING_TEMPLATE = '_listing.html'
+DEFAULT_PAGE_SIZE = 20
+
+# Listing entries sorted in memory before a run is spilled to disk, and
+# runs merged at once (more are first merged into fewer, longer runs)
+SORT_RUN_SIZE = 10_000
+MAX_MERGE_RUNS = 64
+
+# The item and pagination fields are built here and inserted as HTML
+LISTING_POLICY = {DEFAULT_POLICY_KEY: ESCAPE, 'listing-items': RAW, 'listing-pagination': RAW}
+
+INDEX_KEY = 'index'
+TAG_PREFIX = 'tag:'
+MONTH_PREFIX = 'month:'
+
+_MONTH_RE = re.compile(r'(\d{4})[-/.年](\d{1,2})')
+_TAG_SPLIT_RE = re.compile(r'[,，、;；]')
+_UNSAFE_FILENAME_RE = re.compile(r'[\\/:*?"<>|#%&\s]+')
+
+
+def month_of(date):
+    """'YYYY-MM' of a date string such as 2024-01-19 or 2024年1月, or None"""
+    match = _MONTH_RE.search(date)
+    if match is None:
+        return None
+    return f"{match.group(1)}-{int(match.group(2)):02d}"
+
+
+def slugify(name):
+    """
+    Filename-safe form of a tag. Characters that are unsafe in filenames
+    or URLs are replaced and a short hash is appended, so distinct tags
+    never share a page.
+    """
+    slug = _UNSAFE_FILENAME_RE.sub('-', name).strip('-')
+    if slug != name or not slug:
+        slug = f"{slug}-{hashlib.sha1(name.encode('utf-8')).hexdigest()[:6]}".lstrip('-')
+    return slug
+
+
+def listing_filename(key, page):
+    """Output filename of page `page` (1-based) of a listing"""
+    if key == INDEX_KEY:
+        base = 'index'
+    elif key.startswith(TAG_PREFIX):
+        base = f"tag-{slugify(key[len(TAG_PREFIX):])}"
+    else:
+        base = f"archive-{key[len(MONTH_PREFIX):]}"
+    return f"{base}.html" if page == 1 else f"{base}-{page}.html"
+
+
+def listing_title(key):
+    if key == INDEX_KEY:
+        return '全部文章'
+    if key.startswith(TAG_PREFIX):
+        return f"标签：{key[len(TAG_PREFIX):]}"
+    return f"{key[len(MONTH_PREFIX):]} 归档"
+
+
+class ListingSpec:
+    """
+    Which manifest columns hold the metadata of a post, and how listing
+    pages are rendered.
+
+    Attributes:
+        template: Listing template name, relative to the templates directory
+        page_size: Posts per listing page
+        title_field, date_field, tags_field: Columns (field class names)
+            with the title, the date (sorted as text, so use YYYY-MM-DD) and
+            the comma-separated tags of a post
+    """
+
+    def __init__(self, template=DEFAULT_LISTING_TEMPLATE, page_size=DEFAULT_PAGE_SIZE,
+                 title_field='title', date_field='date', tags_field='tags'):
+        if page_size < 1:
+            raise ValueError("page_size must be at least 1")
+        self.template = template
+        self.page_size = page_size
+        self.title_field = title_field
+        self.date_field = date_field
+        self.tags_field = tags_field
+
+    @property
+    def columns(self):
+        return (self.title_field, self.date_field, self.tags_field)
+
+    def record(self, filename, values):
+        """
+        Metadata record of one post.
+
+        Returns:
+            (date, title, tags, filename) with tags as a tuple
+        """
+        title = values.get(self.title_field, '').strip() or filename
+        date = values.get(self.date_field, '').strip()
+        tags = []
+        for tag in _TAG_SPLIT_RE.split(values.get(self.tags_field, '')):
+            tag = tag.strip()
+            if tag and tag not in tags:
+                tags.append(tag)
+        return date, title, tuple(tags), filename
+
+
+class ListingSpool:
+    """
+    Collects listing entries and returns them sorted by listing, newest
+    first, without holding more than run_size of them in memory.
+
+    Each post becomes one entry in the index, one per tag and one in the
+    archive of its month. Entries are (listing key, date, title, filename)
+    tuples.
+
+    Attributes:
+        counts: Listing key -> number of entries, for pagination
+        runs: Number of sorted runs spilled to disk so far
+    """
+
+    def __init__(self, run_size=SORT_RUN_SIZE):
+        self.run_size = run_size
+        self.counts = {}
+        self.runs = 0
+        self._buffer = []
+        self._run_paths = []
+        self._work_dir = None
+        self._files = 0
+
+    def add(self, record):
+        date, title, tags, filename = record
+        keys = [INDEX_KEY]
+        keys.extend(TAG_PREFIX + tag for tag in tags)
+        month = month_of(date)
+        if month is not None:
+            keys.append(MONTH_PREFIX + month)
+        for key in keys:
+            self._buffer.append((key, date, title, filename))
+            self.counts[key] = self.counts.get(key, 0) + 1
+        if len(self._buffer) >= self.run_size:
+            self._spill()
+
+    def _spill(self):
+        self._buffer.sort(reverse=True)
+        self._run_paths.append(self._write_run(self._buffer))
+        self.runs += 1
+        self._buffer = []
+
+    def _write_run(self, entries):
+        if self._work_dir is None:
+            self._work_dir = tempfile.TemporaryDirectory(prefix='page_maker-listings-')
+        self._files += 1
+        path = os.path.join(self._work_dir.name, f"run-{self._files}.jsonl")
+        with open(path, 'w', encoding='utf-8') as f:
+            for entry in entries:
+                f.write(json.dumps(entry, ensure_ascii=False))
+                f.write('\n')
+        return path
+
+    @staticmethod
+    def _read_run(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                yield tuple(json.loads(line))
+
+    def entries(self):
+        """Iterate over all entries, grouped by listing key, newest first"""
+        if not self._run_paths:
+            return iter(sorted(self._buffer, reverse=True))
+        if self._buffer:
+            self._spill()
+        while len(self._run_paths) > MAX_MERGE_RUNS:
+            merged = []
+            for start in range(0, len(self._run_paths), MAX_MERGE_RUNS):
+                paths = self._run_paths[start:start + MAX_MERGE_RUNS]
+                merged.append(self._write_run(self._merge(paths)))
+                for path in paths:
+                    os.remove(path)
+            self._run_paths = merged
+        return self._merge(self._run_paths)
+
+    def _merge(self, paths):
+        return heapq.merge(*(self._read_run(path) for path in paths), reverse=True)
+
+    def close(self):
+        if self._work_dir is not None:
+            self._work_dir.cleanup()
+            self._work_dir = None
+        self._buffer = []
+        self._run_paths = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def render_items(entries):
+    # Inline markup only, as it is placed inside a <p>
+    items = []
+    for _, date, title, filename in entries:
+        items.append(f'<span class="listing-item"><a href="{quote(filename)}">{escape(title)}</a>')
+        if date:
+            items.append(f' <span class="listing-date">{escape(date)}</span>')
+        items.append('</span><br>\n')
+    return ''.join(items)
+
+
+def render_pagination(key, page, pages):
+    if pages == 1:
+        return ''
+    links = []
+    if page > 1:
+        links.append(f'<a href="{quote(listing_filename(key, page - 1))}">上一页</a>')
+    links.append(f'<span>第 {page} / {pages} 页</span>')
+    if page < pages:
+        links.append(f'<a href="{quote(listing_filename(key, page + 1))}">下一页</a>')
+    return ' '.join(links)
+
+
+def iter_listing_pages(spool, page_size=DEFAULT_PAGE_SIZE):
+    """
+    Stream the listing pages of a spool.
+
+    Yields:
+        (filename, values) for every page, values being the listing
+        template's field values; only one page of entries is in memory
+    """
+    for key, group in groupby(spool.entries(), key=lambda entry: entry[0]):
+        pages = -(-spool.counts[key] // page_size)
+        page = 0
+        while True:
+            entries = list(islice(group, page_size))
+            if not entries:
+                break
+            page += 1
+            title = listing_title(key)
+            yield listing_filename(key, page), {
+                'listing-title': title if page == 1 else f"{title}（第 {page} 页）",
+                'listing-items': render_items(entries),
+                'listing-pagination': render_pagination(key, page, pages),
+            }
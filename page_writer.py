@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Page writer - atomic output files and an asyncio write pipeline
+
+Every page is written to a temporary file next to its destination and
+renamed into place, so readers and crashes never see a half-written page.
+
+AsyncPageWriter drains a bounded queue of rendered pages with several
+writer tasks, so slow storage does not stall rendering; when the writers
+fall behind, submit() waits, which keeps memory flat.
+
+    async with AsyncPageWriter('output', writers=8) as writer:
+        await writer.submit('post.html', data)
+    print(writer.stats.summary())
+
+asyncio is imported only by the writer itself, so modules that just need
+atomic_write() do not pay for loading it.
+"""
+
+import contextlib
+import itertools
+import os
+import stat
+import time
+
+
+DEFAULT_WRITERS = 4
+DEFAULT_QUEUE_SIZE = 64
+
+# Suffixes that keep the temporary files of one process apart
+_tmp_numbers = itertools.count()
+
+
+def _create_temp(directory, name):
+    """
+    Exclusively create a temporary file for `name` in directory.
+
+    Created with mode 0666 like open() does, so the kernel applies the
+    umask and a new page gets the usual permissions.
+
+    Returns:
+        (fd, tmp_path) tuple
+    """
+    flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0)
+    while True:
+        tmp_path = os.path.join(directory, f".{name}.{os.getpid()}-{next(_tmp_numbers)}.tmp")
+        try:
+            return os.open(tmp_path, flags, 0o666), tmp_path
+        except FileExistsError:
+            continue
+
+
+@contextlib.contextmanager
+def atomic_write(path, fsync=False, encoding=None):
+    """
+    Open a temporary file that replaces `path` when the block exits cleanly.
+
+    The temporary file is created in the destination directory so the
+    final os.replace() is atomic. It gets the mode of the file it replaces,
+    or the umask default for a new file. If the block raises, it is removed
+    and `path` is left untouched.
+
+    Args:
+        path: Destination file
+        fsync: Flush the file to disk before renaming it
+        encoding: Open in text mode with this encoding; binary when None
+
+    Yields:
+        The open temporary file
+    """
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = _create_temp(directory, os.path.basename(path))
+    try:
+        if encoding is None:
+            f = os.fdopen(fd, 'wb')
+        else:
+            f = os.fdopen(fd, 'w', encoding=encoding)
+        with f:
+            yield f
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        try:
+            os.chmod(tmp_path, stat.S_IMODE(os.stat(path).st_mode))
+        except FileNotFoundError:
+            pass
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def write_file(path, data, fsync=False):
+    """
+    Atomically write bytes to a file.
+
+    Returns:
+        Number of bytes written
+    """
+    with atomic_write(path, fsync) as f:
+        f.write(data)
+    return len(data)
+
+
+class WriterStats:
+    """Counters and timings of an AsyncPageWriter"""
+
+    def __init__(self):
+        self.pages = 0
+        self.bytes_written = 0
+        self.failed = []
+        self.latencies = []
+        self.max_queue_depth = 0
+        self._depth_total = 0
+        self._depth_samples = 0
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    def sample_queue(self, depth):
+        self.max_queue_depth = max(self.max_queue_depth, depth)
+        self._depth_total += depth
+        self._depth_samples += 1
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self.started
+
+    @property
+    def mean_queue_depth(self):
+        return self._depth_total / self._depth_samples if self._depth_samples else 0.0
+
+    @property
+    def bytes_per_sec(self):
+        return self.bytes_written / self.elapsed if self.elapsed > 0 else 0.0
+
+    def latency_percentile(self, percent):
+        """Write latency in seconds at the given percentile (0-100)"""
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        index = min(len(ordered) - 1, max(0, round(percent / 100 * len(ordered)) - 1))
+        return ordered[index]
+
+    def summary(self):
+        return (
+            f"Wrote {self.pages} file(s), {self.bytes_written} bytes "
+            f"({self.bytes_per_sec / 1024 / 1024:.1f} MB/s); "
+            f"write latency p50 {self.latency_percentile(50) * 1000:.2f} ms, "
+            f"p95 {self.latency_percentile(95) * 1000:.2f} ms, "
+            f"p99 {self.latency_percentile(99) * 1000:.2f} ms; "
+            f"queue depth mean {self.mean_queue_depth:.1f}, max {self.max_queue_depth}"
+        )
+
+
+class AsyncPageWriter:
+    """
+    Write rendered pages from a bounded queue with several writer tasks.
+
+    Each page is written with write_file() in a worker thread, so the event
+    loop stays free to render and queue the next pages. Failed writes do
+    not stop the writer; they are collected in stats.failed as
+    (tag, message) tuples.
+    """
+
+    def __init__(self, output_dir, writers=DEFAULT_WRITERS, queue_size=DEFAULT_QUEUE_SIZE, fsync=False):
+        if writers < 1:
+            raise ValueError("writers must be at least 1")
+        self.output_dir = output_dir
+        self.writers = writers
+        self.queue_size = queue_size
+        self.fsync = fsync
+        self.stats = WriterStats()
+        self._queue = None
+        self._tasks = []
+
+    async def start(self):
+        import asyncio
+        self._queue = asyncio.Queue(self.queue_size)
+        self._tasks = [asyncio.create_task(self._writer()) for _ in range(self.writers)]
+
+    async def submit(self, filename, data, tag=None):
+        """
+        Queue a page for writing, waiting while the queue is full.
+
+        Args:
+            filename: Path relative to the output directory
+            data: Page content as bytes
+            tag: Reported with the error if the write fails; defaults to
+                the filename
+        """
+        self.stats.sample_queue(self._queue.qsize())
+        await self._queue.put((filename, data, filename if tag is None else tag))
+
+    async def close(self):
+        """Wait until every queued page is written and stop the writers"""
+        import asyncio
+        for _ in self._tasks:
+            await self._queue.put(None)
+        await asyncio.gather(*self._tasks)
+        self._tasks = []
+        self.stats.finish()
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def _writer(self):
+        import asyncio
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                return
+            filename, data, tag = item
+            path = os.path.join(self.output_dir, filename)
+            start = time.perf_counter()
+            try:
+                written = await loop.run_in_executor(None, write_file, path, data, self.fsync)
+            except OSError as e:
+                self.stats.failed.append((tag, str(e)))
+                continue
+            self.stats.latencies.append(time.perf_counter() - start)
+            self.stats.pages += 1
+            self.stats.bytes_written += written
+
+
+def write_pages(pages, output_dir, writers=DEFAULT_WRITERS, queue_size=DEFAULT_QUEUE_SIZE, fsync=False):
+    """
+    Write an iterable of (filename, data) pairs through an AsyncPageWriter.
+
+    The iterable is consumed lazily, so only about queue_size pages are
+    held in memory at a time.
+
+    Returns:
+        WriterStats of the run
+    """
+    import asyncio
+
+    async def run():
+        async with AsyncPageWriter(output_dir, writers, queue_size, fsync) as writer:
+            for filename, data in pages:
+                await writer.submit(filename, data)
+        return writer.stats
+
+    return asyncio.run(run())
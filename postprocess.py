@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Output pipeline - HTML minification and precompressed .gz siblings
+
+A rendered page can go through an optional post-render stage before it is
+written:
+
+    minify    collapse whitespace and drop comments, leaving <pre>,
+              <textarea>, <script> and <style> untouched
+    gzip      also write page.html.gz next to page.html, so a web server
+              (e.g. nginx gzip_static) can send it without compressing the
+              page on every request
+
+The .gz files are deterministic and carry the (shortened) SHA-256 of the
+page they were made from in their gzip header comment; a page whose
+content did not change is not compressed again.
+
+    python3 page_maker.py batch posts.jsonl --minify --gzip --jobs 0
+"""
+
+import hashlib
+import os
+import re
+import struct
+import zlib
+
+import instrumentation
+from page_writer import write_file
+
+
+DEFAULT_GZIP_LEVEL = 9
+GZIP_SUFFIX = '.gz'
+
+# Elements whose content is kept byte for byte; custom elements such as
+# <pre-block> are not among them
+_TOKEN_RE = re.compile(
+    rb'<!--.*?-->|<(pre|textarea|script|style)(?=[\s/>]).*?</\1\s*>|<[^>]*>',
+    re.DOTALL | re.IGNORECASE
+)
+# ASCII whitespace only: U+3000 and &nbsp; are content
+_WHITESPACE_RE = re.compile(rb'[ \t\r\n\f]+')
+
+_GZIP_MAGIC = b'\x1f\x8b\x08'
+_FEXTRA, _FNAME, _FCOMMENT = 0x04, 0x08, 0x10
+# The .gz header records the first 128 bits of the page's SHA-256
+_COMMENT_PREFIX = b'sha256='
+_COMMENT_HASH_LENGTH = 32
+
+
+def remove_gzip_sibling(path):
+    """
+    Delete the .gz sibling of a page, if there is one.
+
+    Called whenever a page is written without compression or removed, so a
+    web server never sends a .gz of an older version of the page.
+    """
+    try:
+        os.remove(path + GZIP_SUFFIX)
+    except FileNotFoundError:
+        pass
+
+
+def _collapse(match):
+    return b'\n' if b'\n' in match.group() else b' '
+
+
+def minify_html(data):
+    """
+    Minify UTF-8 HTML.
+
+    Runs of whitespace between tags and in text become a single space (or a
+    newline when the run contained one), and comments are removed except
+    IE conditional comments. Tags themselves, and the content of <pre>,
+    <textarea>, <script> and <style>, are kept as they are.
+
+    Args:
+        data: Page as UTF-8 bytes
+
+    Returns:
+        Minified page as bytes
+    """
+    parts = []
+    text = []
+    pos = 0
+    for match in _TOKEN_RE.finditer(data):
+        text.append(data[pos:match.start()])
+        pos = match.end()
+        token = match.group()
+        if token.startswith(b'<!--') and not token.startswith((b'<!--[', b'<!--<!')):
+            continue
+        parts.append(_WHITESPACE_RE.sub(_collapse, b''.join(text)))
+        parts.append(token)
+        text = []
+    text.append(data[pos:])
+    parts.append(_WHITESPACE_RE.sub(_collapse, b''.join(text)))
+    return b''.join(parts)
+
+
+def gzip_bytes(data, level=DEFAULT_GZIP_LEVEL, comment=b''):
+    """
+    Compress bytes into a gzip member with a zero mtime, so the same input
+    always gives the same file.
+
+    Args:
+        comment: Stored in the header's FCOMMENT field when given
+    """
+    flags = _FCOMMENT if comment else 0
+    extra_flags = 2 if level == 9 else 4 if level == 1 else 0
+    header = _GZIP_MAGIC + bytes([flags]) + b'\0\0\0\0' + bytes([extra_flags, 255])
+    if comment:
+        header += comment + b'\0'
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    body = compressor.compress(data) + compressor.flush()
+    return header + body + struct.pack('<II', zlib.crc32(data), len(data) & 0xffffffff)
+
+
+def read_gzip_comment(path):
+    """
+    Header comment of a gzip file, or None when the file is missing, is not
+    gzip or has no comment
+    """
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(10)
+            if len(header) < 10 or header[:3] != _GZIP_MAGIC or not header[3] & _FCOMMENT:
+                return None
+            flags = header[3]
+            if flags & _FEXTRA:
+                f.read(struct.unpack('<H', f.read(2))[0])
+            if flags & _FNAME:
+                while f.read(1) not in (b'\0', b''):
+                    pass
+            comment = bytearray()
+            while len(comment) < 256:
+                byte = f.read(1)
+                if byte in (b'\0', b''):
+                    return bytes(comment)
+                comment += byte
+    except (OSError, struct.error):
+        pass
+    return None
+
+
+class PageSizes:
+    """
+    Sizes of one page through the pipeline.
+
+    Attributes:
+        rendered: Bytes as rendered
+        output: Bytes of the page written, after minification
+        compressed: Bytes of the .gz sibling, None without gzip
+        recompressed: Whether the .gz sibling was written (False when the
+            page content was unchanged)
+        written: Bytes written to disk, the page and a new .gz together
+    """
+
+    __slots__ = ('rendered', 'output', 'compressed', 'recompressed', 'written')
+
+    def __init__(self, rendered, output, compressed=None, recompressed=False, written=0):
+        self.rendered = rendered
+        self.output = output
+        self.compressed = compressed
+        self.recompressed = recompressed
+        self.written = written
+
+    @property
+    def saved(self):
+        """Bytes saved by minification"""
+        return self.rendered - self.output
+
+    def as_dict(self):
+        return {
+            'rendered': self.rendered,
+            'minified': self.output,
+            'gzip': self.compressed,
+        }
+
+
+class OutputPipeline:
+    """
+    Post-render stage applied to every page before it is written.
+
+    Attributes:
+        minify: Minify the HTML (see minify_html)
+        gzip_level: zlib level (1-9) of the .gz sibling, None for no .gz
+    """
+
+    def __init__(self, minify=False, gzip_level=None):
+        if gzip_level is not None and not 1 <= gzip_level <= 9:
+            raise ValueError("gzip_level must be between 1 and 9")
+        self.minify = minify
+        self.gzip_level = gzip_level
+
+    @property
+    def key(self):
+        """Settings that change the output, for page hashes"""
+        return {'minify': self.minify, 'gzip': self.gzip_level}
+
+    def process(self, data, gzip_path=None):
+        """
+        Apply the pipeline to a rendered page.
+
+        Args:
+            data: Rendered page as bytes
+            gzip_path: Existing .gz sibling to compare with; when its header
+                records the same content and level it is not rebuilt
+
+        Returns:
+            (data, compressed, sizes) where compressed is the new .gz
+            content, or None when there is nothing to write
+        """
+        rendered = len(data)
+        if self.minify:
+            with instrumentation.stage('minify'):
+                data = minify_html(data)
+        if self.gzip_level is None:
+            return data, None, PageSizes(rendered, len(data))
+
+        digest = hashlib.sha256(data).hexdigest()[:_COMMENT_HASH_LENGTH]
+        comment = b'%s%s level=%d' % (_COMMENT_PREFIX, digest.encode('ascii'), self.gzip_level)
+        if gzip_path is not None and read_gzip_comment(gzip_path) == comment:
+            instrumentation.count('gzip_unchanged')
+            return data, None, PageSizes(rendered, len(data), os.path.getsize(gzip_path))
+        with instrumentation.stage('compress'):
+            compressed = gzip_bytes(data, self.gzip_level, comment)
+        return data, compressed, PageSizes(rendered, len(data), len(compressed), True)
+
+    def write(self, path, data, fsync=False):
+        """
+        Process a rendered page and atomically write it, and its .gz sibling
+        when that changed. Without gzip an existing .gz sibling is deleted.
+
+        Returns:
+            PageSizes of the page
+        """
+        data, compressed, sizes = self.process(data, path + GZIP_SUFFIX)
+        sizes.written = write_file(path, data, fsync)
+        if self.gzip_level is None:
+            remove_gzip_sibling(path)
+        elif compressed is not None:
+            sizes.written += write_file(path + GZIP_SUFFIX, compressed, fsync)
+        instrumentation.count('bytes_saved', sizes.saved)
+        return sizes
+
+
+class SizeTotals:
+    """Bytes before and after the pipeline, summed over pages"""
+
+    def __init__(self):
+        self.pages = 0
+        self.rendered = 0
+        self.output = 0
+        self.compressed = 0
+        self.compressed_pages = 0
+        self.unchanged = 0
+
+    def add(self, sizes):
+        self.pages += 1
+        self.rendered += sizes.rendered
+        self.output += sizes.output
+        if sizes.compressed is not None:
+            self.compressed += sizes.compressed
+            self.compressed_pages += 1
+            if not sizes.recompressed:
+                self.unchanged += 1
+
+    def summary(self):
+        saved = self.rendered - self.output
+        summary = (
+            f"Post-processed {self.pages} page(s): {self.rendered} -> {self.output} bytes, "
+            f"{saved} saved ({saved / self.rendered * 100 if self.rendered else 0.0:.1f}%)"
+        )
+        if self.compressed_pages:
+            summary += (
+                f"; gzip {self.compressed} bytes "
+                f"({self.compressed / self.output * 100 if self.output else 0.0:.1f}% of the pages), "
+                f"{self.unchanged} .gz file(s) unchanged"
+            )
+        return summary
+
+
+def add_arguments(parser):
+    """Add the --minify and --gzip options to an argument parser"""
+    parser.add_argument('--minify', action='store_true',
+                        help='collapse whitespace and remove comments (not in pre, textarea, script, style)')
+    parser.add_argument('--gzip', action='store_true',
+                        help='also write a precompressed .gz file next to every page')
+    parser.add_argument('--gzip-level', type=int, default=DEFAULT_GZIP_LEVEL,
+                        help='compression level of the .gz files, 1-9 (default: %(default)s)')
+
+
+def pipeline_from_args(parser, args):
+    """
+    OutputPipeline for the options added by add_arguments, or None when
+    neither is given
+    """
+    if not 1 <= args.gzip_level <= 9:
+        parser.error('--gzip-level must be between 1 and 9')
+    if not (args.minify or args.gzip):
+        return None
+    return OutputPipeline(args.minify, args.gzip_level if args.gzip else None)
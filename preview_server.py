@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Preview server - render pages on request instead of writing them to disk
+
+Serves the pages of a manifest (the same JSONL or CSV files batch generation
+reads) and any template with field values from the query string:
+
+    python3 page_maker.py preview posts.jsonl
+    http://127.0.0.1:8000/                                  index
+    http://127.0.0.1:8000/pages/post-1.html                 manifest page
+    http://127.0.0.1:8000/templates/lit_init.html?blog-post-content-in=正文
+
+Rendered pages are kept in an in-memory LRU cache bounded by bytes and keyed
+by the page hash (template content, field values, renderer version), so an
+edited template or manifest row is simply a different key. Responses carry
+an ETag and are gzip-compressed for clients that accept it.
+"""
+
+import argparse
+import gzip
+import html
+import os
+import sys
+import threading
+from collections import OrderedDict
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, quote, unquote, urlsplit
+
+from batch import DEFAULT_TEMPLATES_DIR, page_hash, read_manifest, split_row
+from html_utils import TemplateCache
+from template_loader import TemplateLoader, is_partial
+
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8000
+DEFAULT_CACHE_BYTES = 64 * 1024 * 1024
+
+# Smaller responses are not worth compressing
+GZIP_MIN_SIZE = 1024
+
+
+class PageCache:
+    """LRU mapping of page hash -> RenderedPage, bounded by total bytes"""
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            page = self._pages.get(key)
+            if page is None:
+                self.misses += 1
+                return None
+            self._pages.move_to_end(key)
+            self.hits += 1
+            return page
+
+    def put(self, key, page):
+        """Insert or re-account a page, then evict the least recently used"""
+        with self._lock:
+            old = self._pages.pop(key, None)
+            if old is not None:
+                self.size -= old.size
+            if page.size > self.max_bytes:
+                return
+            self._pages[key] = page
+            self.size += page.size
+            while self.size > self.max_bytes:
+                _, evicted = self._pages.popitem(last=False)
+                self.size -= evicted.size
+
+    def __len__(self):
+        return len(self._pages)
+
+
+class RenderedPage:
+    """A rendered page with its ETag and, once requested, its gzip form"""
+
+    def __init__(self, key, body):
+        self.key = key
+        self.body = body
+        self.gzip_body = None
+
+    @property
+    def size(self):
+        return len(self.body) + len(self.gzip_body or b'')
+
+    def etag(self, gzipped=False):
+        return f'"{self.key[:32]}-gz"' if gzipped else f'"{self.key[:32]}"'
+
+
+class PreviewSite:
+    """
+    Renders manifest pages and templates on demand.
+
+    Templates (with their layouts and partials) are stat()ed on every
+    request and reloaded when their mtime or size changed; the manifest is
+    re-read the same way.
+    """
+
+    def __init__(self, templates_dir=DEFAULT_TEMPLATES_DIR, manifest_path=None,
+                 escape_html=True, cache_bytes=DEFAULT_CACHE_BYTES, template_cache=None):
+        self.templates_dir = templates_dir
+        self.manifest_path = manifest_path
+        self.escape_html = escape_html
+        self.pages = PageCache(cache_bytes)
+        self.template_cache = template_cache if template_cache is not None else TemplateCache()
+        self.loader = TemplateLoader(templates_dir, cache=self.template_cache)
+        self._manifest = {}
+        self._manifest_signature = None
+        self._lock = threading.Lock()
+
+    def template_path(self, template_name):
+        """
+        Resolve a template name inside the templates directory.
+
+        Raises:
+            ValueError: If the name points outside the templates directory
+        """
+        root = os.path.realpath(self.templates_dir)
+        path = os.path.realpath(os.path.join(root, template_name))
+        if os.path.commonpath([root, path]) != root:
+            raise ValueError(f"Invalid template name: {template_name}")
+        return path
+
+    def template(self, template_name):
+        """CompiledTemplate for a template name, reloaded when any of its files change"""
+        self.template_path(template_name)
+        with self._lock:
+            _, _, compiled = self.loader.load(template_name)
+        return compiled
+
+    def manifest(self):
+        """Dict of output filename -> (template_name, values) from the manifest"""
+        if self.manifest_path is None:
+            return {}
+        stat = os.stat(self.manifest_path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            if signature == self._manifest_signature:
+                return self._manifest
+        pages = {}
+        for _, row in read_manifest(self.manifest_path):
+            try:
+                template_name, filename, values = split_row(row)
+            except ValueError:
+                continue
+            pages[filename] = (template_name, values)
+        with self._lock:
+            self._manifest = pages
+            self._manifest_signature = signature
+        return pages
+
+    def render(self, template_name, values):
+        """
+        Return the RenderedPage for a template and field values, rendering it
+        only on a cache miss.
+        """
+        compiled = self.template(template_name)
+        key = page_hash(compiled, values, self.escape_html)
+        page = self.pages.get(key)
+        if page is None:
+            page = RenderedPage(key, compiled.render(values, escape_html=self.escape_html).encode('utf-8'))
+            self.pages.put(key, page)
+        return page
+
+    def compress(self, page):
+        """Gzip a page once and keep the result with it in the cache"""
+        if page.gzip_body is None:
+            page.gzip_body = gzip.compress(page.body, compresslevel=6, mtime=0)
+            self.pages.put(page.key, page)
+        return page.gzip_body
+
+    def index(self):
+        """HTML listing of the manifest pages and the templates"""
+        items = ['<!DOCTYPE html>\n<html lang="zh-CN">\n<head><meta charset="utf-8"><title>预览</title></head>\n<body>\n']
+        manifest = self.manifest()
+        if manifest:
+            items.append(f'<h1>页面 ({len(manifest)})</h1>\n<ul>\n')
+            for filename in sorted(manifest):
+                items.append(f'<li><a href="/pages/{quote(filename)}">{html.escape(filename)}</a></li>\n')
+            items.append('</ul>\n')
+        items.append('<h1>模板</h1>\n<ul>\n')
+        for name in sorted(os.listdir(self.templates_dir)):
+            if name.endswith('.html') and not is_partial(name):
+                items.append(f'<li><a href="/templates/{quote(name)}">{html.escape(name)}</a></li>\n')
+        items.append('</ul>\n')
+        items.append(f'<p>缓存: {len(self.pages)} 个页面, {self.pages.size} 字节, '
+                     f'命中 {self.pages.hits} / 未命中 {self.pages.misses}</p>\n</body>\n</html>\n')
+        return ''.join(items).encode('utf-8')
+
+
+class PreviewHandler(BaseHTTPRequestHandler):
+    """Routes requests to the PreviewSite of the server"""
+
+    server_version = 'PageMakerPreview/1.0'
+
+    def do_GET(self):
+        self.handle_request(send_body=True)
+
+    def do_HEAD(self):
+        self.handle_request(send_body=False)
+
+    def handle_request(self, send_body):
+        site = self.server.site
+        url = urlsplit(self.path)
+        path = unquote(url.path)
+
+        try:
+            if path == '/':
+                self.send_page(site.index(), None, send_body)
+                return
+            if path.startswith('/pages/'):
+                entry = site.manifest().get(path[len('/pages/'):])
+                if entry is None:
+                    self.send_error(HTTPStatus.NOT_FOUND, 'No such page in the manifest')
+                    return
+                page = site.render(*entry)
+            elif path.startswith('/templates/'):
+                values = dict(parse_qsl(url.query, keep_blank_values=True))
+                page = site.render(path[len('/templates/'):], values)
+            else:
+                self.send_error(HTTPStatus.NOT_FOUND)
+                return
+        except FileNotFoundError:
+            self.send_error(HTTPStatus.NOT_FOUND, 'Template not found')
+            return
+        except (OSError, ValueError) as e:
+            self.send_error(HTTPStatus.BAD_REQUEST, str(e))
+            return
+
+        self.send_page(page.body, page, send_body)
+
+    def send_page(self, body, page, send_body):
+        gzipped = len(body) >= GZIP_MIN_SIZE and self.accepts_gzip()
+        if gzipped:
+            body = self.server.site.compress(page) if page is not None else gzip.compress(body, mtime=0)
+
+        if page is not None:
+            etag = page.etag(gzipped)
+            if self.etag_matches(etag):
+                self.send_response(HTTPStatus.NOT_MODIFIED)
+                self.send_header('ETag', etag)
+                self.end_headers()
+                return
+
+        self.send_response(HTTPStatus.OK)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Vary', 'Accept-Encoding')
+        if page is not None:
+            self.send_header('ETag', etag)
+        if gzipped:
+            self.send_header('Content-Encoding', 'gzip')
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def accepts_gzip(self):
+        for coding in self.headers.get('Accept-Encoding', '').split(','):
+            name, _, params = coding.partition(';')
+            if name.strip().lower() != 'gzip':
+                continue
+            params = params.replace(' ', '')
+            if not params.startswith('q='):
+                return True
+            try:
+                return float(params[2:]) > 0
+            except ValueError:
+                return False
+        return False
+
+    def etag_matches(self, etag):
+        header = self.headers.get('If-None-Match')
+        if not header:
+            return False
+        if header.strip() == '*':
+            return True
+        candidates = [tag.strip() for tag in header.split(',')]
+        return any(tag[2:] == etag if tag.startswith('W/') else tag == etag for tag in candidates)
+
+
+def make_server(site, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    """Create the HTTP server for a PreviewSite; port 0 picks a free port"""
+    server = ThreadingHTTPServer((host, port), PreviewHandler)
+    server.daemon_threads = True
+    server.site = site
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='page_maker.py preview',
+        description='Serve rendered pages from memory for previewing'
+    )
+    parser.add_argument('manifest', nargs='?', help='manifest file (.jsonl or .csv) with the pages to serve')
+    parser.add_argument('--templates-dir', default=DEFAULT_TEMPLATES_DIR,
+                        help='directory the template names are relative to')
+    parser.add_argument('--host', default=DEFAULT_HOST, help='address to listen on (default: %(default)s)')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='port to listen on (default: %(default)s)')
+    parser.add_argument('--no-escape', action='store_true', help='insert field values as raw HTML')
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_CACHE_BYTES // (1024 * 1024),
+                        help='rendered page cache size in MB (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    site = PreviewSite(args.templates_dir, args.manifest, escape_html=not args.no_escape,
+                       cache_bytes=args.cache_size * 1024 * 1024)
+    server = make_server(site, args.host, args.port)
+    print(f"Preview server on http://{args.host}:{server.server_address[1]}/ (Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,404 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Search index - sharded inverted index of the pages' field text
+
+While a batch renders pages, the text of their fields is tokenized and an
+inverted index is written to output/search/ as small JSON files, so the
+search box of a static site can look terms up without fetching every page:
+
+    search/index.json        format parameters and the list of shards
+    search/<shard>.json      term -> [doc_id_delta, term_frequency, ...]
+    search/docs-<n>.json     doc_id -> [filename, title] for ids
+                             n * DOCS_PER_SHARD to (n + 1) * DOCS_PER_SHARD - 1
+
+Tokenization works for mixed Chinese, Japanese, Korean and Latin text:
+text is NFKC-normalized and case-folded; Latin words lose their accents
+(Bibliothèque -> bibliotheque); runs of CJK characters become overlapping
+character bigrams (页面生成 -> 页面, 面生, 生成), a single CJK character
+stays a term of its own.
+
+A term is stored in the shard named by shard_key(): the first LATIN_PREFIX
+characters of an ASCII term, or '_' and the hex code point of the first
+character of any other term (shifted right by CJK_BLOCK_BITS). A browser
+tokenizes the query the same way, loads index.json once and then only the
+shards of the query terms; a one-character CJK query matches the bigrams
+starting with that character, which are in the same shard.
+
+The index is updated in place: the page hash (batch.page_hash) of every
+indexed page is kept next to the build manifest (output.search.json for
+output/), only pages whose hash changed are tokenized again, and only the
+shards holding their old or new terms are rewritten.
+
+    python3 page_maker.py batch posts.jsonl --search-index --incremental
+"""
+
+import html
+import itertools
+import json
+import operator
+import os
+import re
+import unicodedata
+from collections import Counter
+
+from page_writer import write_file
+
+
+SEARCH_DIR = 'search'
+INDEX_FILENAME = 'index.json'
+STATE_SUFFIX = '.search.json'
+
+# Bump when tokenization or the file format changes; the index is then rebuilt
+INDEX_VERSION = 1
+
+LATIN_PREFIX = 2
+# 0 gives every CJK character its own shard; common characters already
+# start thousands of bigrams in a large blog
+CJK_BLOCK_BITS = 0
+DOCS_PER_SHARD = 1000
+
+# Longer words are cut to this length (in the index and in queries alike)
+MAX_TERM_LENGTH = 32
+
+# Han (with 々), Hiragana, Katakana and Hangul syllables
+_CJK_CHARS = '\u3005\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af'
+_TOKEN_RE = re.compile(rf'(?P<cjk>[{_CJK_CHARS}]+)|(?P<word>[^\W_{_CJK_CHARS}]+)')
+_TAG_RE = re.compile(r'<[^>]*>')
+_SHARD_FILE_RE = re.compile(r'^(?:[0-9a-z]{1,%d}|_[0-9a-f]+|docs-\d+)\.json$' % LATIN_PREFIX)
+
+
+def _fold_word(word):
+    if word.isascii():
+        return word[:MAX_TERM_LENGTH]
+    decomposed = unicodedata.normalize('NFKD', word)
+    return ''.join(char for char in decomposed if not unicodedata.combining(char))[:MAX_TERM_LENGTH]
+
+
+def tokenize(text):
+    """
+    Split text into search terms.
+
+    Returns:
+        List of terms in document order: folded words and CJK bigrams (or
+        single CJK characters)
+    """
+    terms = []
+    text = unicodedata.normalize('NFKC', text).casefold()
+    for cjk, word in _TOKEN_RE.findall(text):
+        if word:
+            terms.append(_fold_word(word))
+        elif len(cjk) == 1:
+            terms.append(cjk)
+        else:
+            terms.extend(map(str.__add__, cjk, cjk[1:]))
+    return terms
+
+
+def plain_text(value):
+    """Field value without HTML tags and entities"""
+    if '<' in value:
+        value = _TAG_RE.sub(' ', value)
+    if '&' in value:
+        value = html.unescape(value)
+    return value
+
+
+def shard_key(term):
+    """Name of the shard that holds a term"""
+    if term.isascii():
+        return term[:LATIN_PREFIX]
+    return f"_{ord(term[0]) >> CJK_BLOCK_BITS:x}"
+
+
+def encode_postings(postings):
+    """
+    Shard form of a flat [doc_id, count, ...] list sorted by id: every id
+    is stored as the difference to the previous one, which keeps frequent
+    terms short
+    """
+    encoded = list(postings)
+    encoded[2::2] = map(operator.sub, postings[2::2], postings[0:-2:2])
+    return encoded
+
+
+def decode_postings(encoded):
+    """Flat [doc_id, count, ...] list of a shard's postings"""
+    postings = list(encoded)
+    postings[::2] = itertools.accumulate(encoded[::2])
+    return postings
+
+
+def _sorted_postings(postings):
+    ids = postings[::2]
+    if all(map(operator.lt, ids, ids[1:])):
+        return postings
+    return list(itertools.chain.from_iterable(sorted(zip(ids, postings[1::2]))))
+
+
+class SearchSpec:
+    """
+    What is indexed, and which pages need indexing.
+
+    Attributes:
+        fields: Field (column) names whose text is indexed; None for all
+        title_field: Field shown as the title of a result
+        known: Filename -> page hash of the pages already in the index, set
+            by SearchIndex; pages with the same hash are not tokenized
+    """
+
+    def __init__(self, fields=None, title_field='title'):
+        self.fields = tuple(fields) if fields is not None else None
+        self.title_field = title_field
+        self.known = {}
+
+    @property
+    def config(self):
+        return {'version': INDEX_VERSION, 'fields': self.fields and list(self.fields),
+                'title_field': self.title_field}
+
+    def needs(self, filename, digest):
+        return self.known.get(filename) != digest
+
+    def document(self, filename, values):
+        """
+        Search document of one page.
+
+        Returns:
+            (title, terms) where terms maps each term to its count
+        """
+        terms = Counter()
+        for name, value in values.items():
+            if self.fields is None or name in self.fields:
+                terms.update(tokenize(plain_text(value)))
+        title = ' '.join(plain_text(values.get(self.title_field, '')).split()) or filename
+        return title, terms
+
+
+class SearchIndex:
+    """
+    The search index of an output directory, updated page by page.
+
+    Feed every page of a run to add(), then call finish() with the
+    filenames that still exist; only shards whose postings changed are
+    rewritten.
+
+    Attributes:
+        spec: SearchSpec; its known hashes are filled from the saved state
+        updated: Pages (re)indexed in this run
+        removed: Pages dropped from the index in this run
+        shards_written: Term shards rewritten or deleted in this run
+    """
+
+    def __init__(self, output_dir, spec):
+        self.output_dir = output_dir
+        self.search_dir = os.path.join(output_dir, SEARCH_DIR)
+        self.state_path = os.path.normpath(output_dir) + STATE_SUFFIX
+        self.spec = spec
+        self.updated = 0
+        self.removed = 0
+        self.shards_written = 0
+        self.docs = {}
+        self.next_id = 0
+        self._reset = True
+        self._load_state()
+        spec.known = {filename: doc[1] for filename, doc in self.docs.items()}
+
+        self._shard_keys = {}
+        self._pending = {}
+        self._stale_ids = set()
+        self._dirty_shards = set()
+        self._titles = {}
+        self._dirty_doc_shards = set()
+
+    def _load_state(self):
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return
+        if not isinstance(state, dict) or state.get('config') != self.spec.config:
+            return
+        if not os.path.exists(os.path.join(self.search_dir, INDEX_FILENAME)):
+            return
+        self.docs = state['docs']
+        self.next_id = state['next_id']
+        self._reset = False
+
+    def add(self, filename, digest, document):
+        """
+        Record a page of this run.
+
+        Args:
+            digest: Page hash
+            document: SearchSpec.document() result, or None when the page
+                was not tokenized because the index already has this hash
+        """
+        if document is None:
+            return
+        old = self.docs.get(filename)
+        if old is not None:
+            doc_id = old[0]
+            if doc_id in self._titles:
+                # Listed twice in one run: the first row stays indexed
+                return
+            self._forget(doc_id, old[2])
+        else:
+            doc_id = self.next_id
+            self.next_id += 1
+
+        title, terms = document
+        # Flat [doc_id, count, ...] lists: millions of pair tuples would
+        # keep the cyclic garbage collector busy
+        pending = self._pending
+        shard_keys = self._shard_keys
+        for term, count in terms.items():
+            postings = pending.get(term)
+            if postings is None:
+                pending[term] = [doc_id, count]
+                if term not in shard_keys:
+                    shard_keys[term] = shard_key(term)
+            else:
+                postings.append(doc_id)
+                postings.append(count)
+        keys = set(map(shard_keys.__getitem__, terms))
+        self._dirty_shards.update(keys)
+        self.docs[filename] = [doc_id, digest, sorted(keys)]
+        self._titles[doc_id] = [filename, title]
+        self._dirty_doc_shards.add(doc_id // DOCS_PER_SHARD)
+        self.updated += 1
+
+    def _forget(self, doc_id, keys):
+        self._stale_ids.add(doc_id)
+        self._dirty_shards.update(keys)
+        self._dirty_doc_shards.add(doc_id // DOCS_PER_SHARD)
+
+    def finish(self, filenames):
+        """
+        Drop pages that are gone and write the changed shards, the index
+        file and the state.
+
+        Args:
+            filenames: Every page the output directory should keep; indexed
+                pages not among them are removed from the index
+        """
+        for filename in [filename for filename in self.docs if filename not in filenames]:
+            doc_id, _, keys = self.docs.pop(filename)
+            self._forget(doc_id, keys)
+            self._titles[doc_id] = None
+            self.removed += 1
+
+        os.makedirs(self.search_dir, exist_ok=True)
+        if self._reset:
+            for name in os.listdir(self.search_dir):
+                if _SHARD_FILE_RE.match(name):
+                    os.remove(os.path.join(self.search_dir, name))
+
+        terms_by_shard = {}
+        for term in self._pending:
+            terms_by_shard.setdefault(self._shard_keys[term], []).append(term)
+        shards = set(self._existing_shards())
+        for key in sorted(self._dirty_shards):
+            if self._write_shard(key, terms_by_shard.get(key, ())):
+                shards.add(key)
+            else:
+                shards.discard(key)
+            self.shards_written += 1
+        for number in sorted(self._dirty_doc_shards):
+            self._write_doc_shard(number)
+
+        self._write_json(os.path.join(self.search_dir, INDEX_FILENAME), {
+            'version': INDEX_VERSION,
+            'latin_prefix': LATIN_PREFIX,
+            'cjk_block_bits': CJK_BLOCK_BITS,
+            'max_term_length': MAX_TERM_LENGTH,
+            'docs_per_shard': DOCS_PER_SHARD,
+            'documents': len(self.docs),
+            'shards': sorted(shards),
+        })
+        self._write_json(self.state_path, {
+            'config': self.spec.config,
+            'next_id': self.next_id,
+            'docs': self.docs,
+        })
+        self._pending = {}
+        self._stale_ids = set()
+        self._dirty_shards = set()
+        self._titles = {}
+        self._dirty_doc_shards = set()
+        self._reset = False
+
+    def _existing_shards(self):
+        try:
+            with open(os.path.join(self.search_dir, INDEX_FILENAME), 'r', encoding='utf-8') as f:
+                return [] if self._reset else json.load(f)['shards']
+        except (OSError, ValueError, KeyError):
+            return []
+
+    def _read_json(self, path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_json(self, path, data):
+        text = json.dumps(data, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+        write_file(path, text.encode('utf-8'))
+
+    def _write_shard(self, key, terms):
+        """
+        Rewrite one term shard with the pending postings of its terms;
+        returns False when it became empty
+        """
+        path = os.path.join(self.search_dir, f"{key}.json")
+        shard = self._read_json(path) if not self._reset else {}
+        stale = self._stale_ids
+        if stale:
+            for term in list(shard):
+                postings = decode_postings(shard[term])
+                if stale.isdisjoint(postings[::2]):
+                    continue
+                postings = [number for i in range(0, len(postings), 2) if postings[i] not in stale
+                            for number in postings[i:i + 2]]
+                if postings:
+                    shard[term] = encode_postings(postings)
+                else:
+                    del shard[term]
+        for term in terms:
+            postings = self._pending[term]
+            if term in shard:
+                postings = decode_postings(shard[term]) + postings
+            shard[term] = encode_postings(_sorted_postings(postings))
+        if not shard:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            return False
+        self._write_json(path, shard)
+        return True
+
+    def _write_doc_shard(self, number):
+        path = os.path.join(self.search_dir, f"docs-{number}.json")
+        docs = self._read_json(path) if not self._reset else {}
+        for doc_id, entry in self._titles.items():
+            if doc_id // DOCS_PER_SHARD != number:
+                continue
+            if entry is None:
+                docs.pop(str(doc_id), None)
+            else:
+                docs[str(doc_id)] = entry
+        if docs:
+            self._write_json(path, docs)
+        else:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def summary(self):
+        return (
+            f"Search index: {len(self.docs)} page(s), {self.updated} indexed, {self.removed} removed, "
+            f"{self.shards_written} shard(s) written"
+        )
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Template index - field metadata of a whole templates tree
+
+The index records path, mtime, size, content hash and field names of every
+.html file under the templates directory (recursively) in a small JSON file.
+Refreshing it only stats the files and re-reads the ones whose mtime or
+size changed, or whose layouts or partials did, so listing templates and
+their fields never needs to read the templates themselves.
+
+    python3 page_maker.py templates
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+
+from html_utils import TemplateCache
+from page_writer import atomic_write
+from template_loader import TemplateLoader, is_partial
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_TEMPLATES_DIR = os.path.join(BASE_DIR, 'templates')
+DEFAULT_INDEX_DIR = os.path.join(BASE_DIR, '.cache')
+
+# Bump when the entry format changes; older index files are then rebuilt
+INDEX_VERSION = 2
+
+
+def default_index_path(templates_dir, index_dir=DEFAULT_INDEX_DIR):
+    """One index file per templates directory, under index_dir (.cache/)"""
+    root = os.path.abspath(templates_dir)
+    digest = hashlib.sha1(root.encode('utf-8')).hexdigest()[:12]
+    return os.path.join(index_dir, f"template_index-{digest}.json")
+
+
+class TemplateIndex:
+    """
+    Persistent index of the templates under a directory.
+
+    Entries are dicts with 'path' (relative, '/'-separated), 'mtime_ns',
+    'size', 'hash', 'fields' (class names in document order, after
+    flattening layouts and partials), 'field_count' and 'dependencies'
+    (path -> [mtime_ns, size] of the layouts and partials it uses).
+
+    With persistent=False the index lives in memory only: no file is read
+    or written.
+    """
+
+    def __init__(self, templates_dir=DEFAULT_TEMPLATES_DIR, index_path=None, cache=None, loader=None,
+                 persistent=True):
+        self.templates_dir = templates_dir
+        self.index_path = index_path or default_index_path(templates_dir)
+        self.persistent = persistent
+        self.cache = cache if cache is not None else TemplateCache()
+        self.loader = loader if loader is not None else TemplateLoader(templates_dir, cache=self.cache)
+        self.entries = {}
+        if persistent:
+            self._load()
+
+    def _load(self):
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get('version') != INDEX_VERSION:
+            return
+        if data.get('root') != os.path.abspath(self.templates_dir):
+            return
+        self.entries = {}
+        for entry in data.get('templates', []):
+            # Many templates share field names; keep one string per name
+            entry['fields'] = [sys.intern(name) for name in entry['fields']]
+            self.entries[entry['path']] = entry
+
+    def save(self):
+        """Atomically write the index file"""
+        with atomic_write(self.index_path, fsync=True, encoding='utf-8') as f:
+            json.dump({
+                'version': INDEX_VERSION,
+                'root': os.path.abspath(self.templates_dir),
+                'templates': [self.entries[name] for name in sorted(self.entries)],
+            }, f, ensure_ascii=False, separators=(',', ':'))
+
+    def scan(self):
+        """
+        Walk the templates tree.
+
+        Yields:
+            (relative_path, os.stat_result) for every .html file
+        """
+        stack = [self.templates_dir]
+        visited = set()
+        while stack:
+            directory = stack.pop()
+            try:
+                # Symlinked directories are followed, but every directory is
+                # read once, so a link back up the tree cannot loop forever
+                stat = os.stat(directory)
+                if (stat.st_dev, stat.st_ino) in visited:
+                    continue
+                visited.add((stat.st_dev, stat.st_ino))
+                with os.scandir(directory) as it:
+                    for entry in it:
+                        if entry.name.startswith('.'):
+                            continue
+                        if entry.is_dir():
+                            stack.append(entry.path)
+                        elif entry.name.endswith('.html') and entry.is_file():
+                            relative = os.path.relpath(entry.path, self.templates_dir)
+                            yield relative.replace(os.sep, '/'), entry.stat()
+            except OSError:
+                continue
+
+    def refresh(self):
+        """
+        Bring the index up to date with the templates tree.
+
+        Files whose mtime and size are unchanged, and whose layouts and
+        partials are unchanged, are not opened. Changed files are hashed,
+        and parsed only when their content changed.
+
+        Returns:
+            (added, updated, removed) counts
+        """
+        added = updated = 0
+        stats = dict(self.scan())
+
+        for name, stat in stats.items():
+            entry = self.entries.get(name)
+            if entry is not None and self._is_current(entry, stat, stats):
+                continue
+
+            try:
+                new_entry = self._read_entry(name, stat, entry)
+            except (OSError, ValueError):
+                # Unreadable or not UTF-8: leave it out of the index
+                self.entries.pop(name, None)
+                continue
+
+            if entry is None:
+                added += 1
+            else:
+                updated += 1
+            self.entries[name] = new_entry
+
+        removed = [name for name in self.entries if name not in stats]
+        for name in removed:
+            del self.entries[name]
+
+        if self.persistent and (added or updated or removed or not os.path.exists(self.index_path)):
+            try:
+                self.save()
+            except OSError:
+                pass
+
+        return added, updated, len(removed)
+
+    @staticmethod
+    def _is_current(entry, stat, stats):
+        if entry['mtime_ns'] != stat.st_mtime_ns or entry['size'] != stat.st_size:
+            return False
+        for name, signature in entry['dependencies'].items():
+            dependency = stats.get(name)
+            if dependency is None or [dependency.st_mtime_ns, dependency.st_size] != signature:
+                return False
+        return True
+
+    def _read_entry(self, name, stat, old_entry):
+        resolved = self.loader.resolve(name)
+        content_hash = resolved.content_hash
+
+        if old_entry is not None and old_entry['hash'] == content_hash:
+            # Touched but not changed
+            fields = old_entry['fields']
+        else:
+            parsed_fields, _ = self.cache.get(resolved.text, content_hash)
+            fields = list(parsed_fields.class_names)
+
+        return {
+            'path': name,
+            'mtime_ns': stat.st_mtime_ns,
+            'size': stat.st_size,
+            'hash': content_hash,
+            'fields': fields,
+            'field_count': len(fields),
+            'dependencies': {
+                dependency: list(signature)
+                for dependency, signature in sorted(resolved.dependencies.items())
+                if dependency != resolved.name
+            },
+        }
+
+    def names(self):
+        """Relative paths of all indexed templates, sorted; layouts and partials are left out"""
+        return sorted(name for name in self.entries if not is_partial(name))
+
+    def get(self, name):
+        """Index entry for a template name, or None"""
+        return self.entries.get(name.replace(os.sep, '/'))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='page_maker.py templates',
+        description='List templates and their editable fields from the template index'
+    )
+    parser.add_argument('--templates-dir', default=DEFAULT_TEMPLATES_DIR,
+                        help='templates directory to index')
+    parser.add_argument('--fields', action='store_true',
+                        help='also list the field names of every template')
+    args = parser.parse_args(argv)
+
+    index = TemplateIndex(args.templates_dir)
+    added, updated, removed = index.refresh()
+
+    for name in index.names():
+        entry = index.get(name)
+        print(f"{name}  ({entry['field_count']} field(s))")
+        if args.fields:
+            for class_name in entry['fields']:
+                print(f"    - {class_name}")
+
+    print(f"\n{len(index.entries)} template(s); {added} added, {updated} updated, {removed} removed since last scan")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Template loader - layouts, blocks and partials
+
+Templates can extend a base layout and include shared fragments through
+HTML comments, so every template stays a valid HTML file:
+
+    <!-- extends "_layouts/base.html" -->
+    <!-- block "content" -->
+      <p class="blog-post-content-in">正文</p>
+    <!-- endblock -->
+
+    _layouts/base.html:
+    <html>
+      <head><!-- include "_partials/head.html" --></head>
+      <body><!-- block "content" -->默认内容<!-- endblock --></body>
+    </html>
+
+A template that extends a layout replaces the layout's blocks of the same
+name; everything outside its blocks is ignored. Layouts can extend other
+layouts, blocks can nest and included fragments can use the same
+directives. Names are relative to the templates directory; files and
+directories whose name starts with '_' are treated as layouts and partials
+and are not listed as templates.
+
+TemplateLoader flattens each template once into plain HTML, which is then
+parsed and compiled like any other template (and kept in the TemplateCache
+under the hash of the flattened text), so the <p class="..."> fields of
+every piece are editable and rendering cost does not depend on how deeply
+the pieces are nested. A flattened template remembers the mtime and size of
+every file it was built from and is rebuilt only when one of them changes.
+"""
+
+import hashlib
+import mmap
+import os
+import re
+
+import instrumentation
+from html_utils import TemplateCache, decode_template
+
+
+# Deepest chain of extends and includes before giving up
+MAX_DEPTH = 32
+
+# Names are always quoted, so ordinary comments such as <!-- include footer -->
+# or <!-- block-header --> are left alone
+_DIRECTIVE_RE = re.compile(r"""
+    <!--\s*
+    (extends|include|block|endblock)
+    (?:\s+(?:"([^"]*)"|'([^']*)'))?
+    \s*-->
+""", re.VERBOSE)
+_DIRECTIVE_BYTES_RE = re.compile(rb'<!--\s*(?:extends|include|block|endblock)(?:\s+["\']|\s*-->)')
+
+
+def normalize_name(template_name):
+    """Template name as used for dependencies, '/'-separated"""
+    return os.path.normpath(template_name).replace(os.sep, '/')
+
+
+def is_partial(template_name):
+    """True for layouts and partials: any path component starting with '_'"""
+    return any(part.startswith('_') for part in normalize_name(template_name).split('/'))
+
+
+def uses_layout(path):
+    """
+    Whether a template file contains layout directives, checked through a
+    memory map so large templates are not read into memory
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return False
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return _DIRECTIVE_BYTES_RE.search(data) is not None
+
+
+def parse_layout(text, template_name='<template>'):
+    """
+    Split template text at its layout directives.
+
+    Args:
+        text: Template text
+        template_name: Used in error messages
+
+    Returns:
+        (parent, nodes, blocks) where parent is the name given by extends
+        or None, nodes a list of strings, ('include', name) and
+        ('block', name, nodes) tuples, and blocks maps every block name,
+        nested ones included, to its tuple
+
+    Raises:
+        ValueError: On misplaced, unclosed or incomplete directives
+    """
+    parent = None
+    nodes = []
+    blocks = {}
+    stack = [(None, nodes)]
+    pos = 0
+
+    for match in _DIRECTIVE_RE.finditer(text):
+        if match.start() > pos:
+            stack[-1][1].append(text[pos:match.start()])
+        pos = match.end()
+        keyword = match.group(1)
+        argument = next((group for group in match.groups()[1:] if group is not None), None)
+
+        if keyword == 'endblock':
+            if len(stack) == 1:
+                raise ValueError(f"{template_name}: endblock without block")
+            block_name, _ = stack.pop()
+            if argument is not None and argument != block_name:
+                raise ValueError(f"{template_name}: endblock {argument} closes block {block_name}")
+            continue
+
+        if not argument:
+            raise ValueError(f"{template_name}: {keyword} needs a name")
+        if keyword == 'extends':
+            if parent is not None:
+                raise ValueError(f"{template_name}: extends appears more than once")
+            if len(stack) > 1:
+                raise ValueError(f"{template_name}: extends inside block {stack[-1][0]}")
+            parent = argument
+        elif keyword == 'include':
+            stack[-1][1].append(('include', argument))
+        else:
+            if argument in blocks:
+                raise ValueError(f"{template_name}: block {argument} defined twice")
+            block = ('block', argument, [])
+            blocks[argument] = block
+            stack[-1][1].append(block)
+            stack.append((argument, block[2]))
+
+    if len(stack) > 1:
+        raise ValueError(f"{template_name}: block {stack[-1][0]} is not closed")
+    if pos < len(text):
+        nodes.append(text[pos:])
+    return parent, nodes, blocks
+
+
+class ResolvedTemplate:
+    """
+    A template with its extends and includes flattened.
+
+    Attributes:
+        name: Normalized template name
+        text: Flattened template text
+        content_hash: SHA-256 of the template file for a template without
+            directives (as TemplateCache.load computes it), otherwise of
+            the flattened text
+        dependencies: Normalized name -> (mtime_ns, size) of every file
+            the text was built from, the template itself included
+        flattened: Whether the template used any directive
+    """
+
+    def __init__(self, name, text, content_hash, dependencies, flattened):
+        self.name = name
+        self.text = text
+        self.content_hash = content_hash
+        self.dependencies = dependencies
+        self.flattened = flattened
+        self.fields = None
+        self.compiled = None
+
+
+class TemplateLoader:
+    """
+    Resolves, flattens and compiles templates by name, once per change.
+
+    Attributes:
+        hits: Lookups answered from memory
+        misses: Lookups that had to flatten the template again
+    """
+
+    def __init__(self, templates_dir, cache=None):
+        self.templates_dir = templates_dir
+        self.cache = cache if cache is not None else TemplateCache()
+        self.hits = 0
+        self.misses = 0
+        self._resolved = {}
+        self._files = {}
+
+    def template_path(self, template_name):
+        return os.path.join(self.templates_dir, os.path.normpath(template_name))
+
+    def resolve(self, template_name):
+        """
+        Return the ResolvedTemplate for a template name, flattening it again
+        only when the template or one of its layouts or partials changed.
+
+        Raises:
+            OSError: If a file cannot be read
+            ValueError: On malformed directives, a missing name or an
+                extends/include cycle
+        """
+        name = normalize_name(template_name)
+        resolved = self._resolved.get(name)
+        if resolved is not None and self._is_current(resolved):
+            self.hits += 1
+            return resolved
+
+        self.misses += 1
+        with instrumentation.stage('resolve'):
+            dependencies = {}
+            text = self._flatten(name, [], dependencies)
+        signature, data_hash, source = self._files[name]
+        flattened = len(dependencies) > 1 or text != source
+        content_hash = hashlib.sha256(text.encode('utf-8')).hexdigest() if flattened else data_hash
+        resolved = ResolvedTemplate(name, text, content_hash, dependencies, flattened)
+        self._resolved[name] = resolved
+        return resolved
+
+    def load(self, template_name):
+        """
+        Resolve a template and return its parsed form, like TemplateCache.load.
+
+        Returns:
+            (template_content, fields, compiled_template) tuple
+        """
+        resolved = self.resolve(template_name)
+        if resolved.compiled is None:
+            resolved.fields, resolved.compiled = self.cache.get(resolved.text, resolved.content_hash)
+        return resolved.text, resolved.fields, resolved.compiled
+
+    def dependents(self, template_name):
+        """Names of the resolved templates built from the given file, other than itself"""
+        name = normalize_name(template_name)
+        return {
+            resolved.name for resolved in self._resolved.values()
+            if name in resolved.dependencies and resolved.name != name
+        }
+
+    def _is_current(self, resolved):
+        for name, signature in resolved.dependencies.items():
+            try:
+                stat = os.stat(self.template_path(name))
+            except OSError:
+                return False
+            if (stat.st_mtime_ns, stat.st_size) != signature:
+                return False
+        return True
+
+    def _read(self, name, dependencies):
+        """Text of one file, re-read only when its mtime or size changed"""
+        path = self.template_path(name)
+        stat = os.stat(path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        cached = self._files.get(name)
+        if cached is None or cached[0] != signature:
+            with instrumentation.stage('read'):
+                with open(path, 'rb') as f:
+                    stat = os.fstat(f.fileno())
+                    data = f.read()
+            instrumentation.count('bytes_read', len(data))
+            signature = (stat.st_mtime_ns, stat.st_size)
+            cached = (signature, hashlib.sha256(data).hexdigest(), decode_template(data))
+            self._files[name] = cached
+        dependencies[name] = signature
+        return cached[2]
+
+    def _flatten(self, name, stack, dependencies):
+        if name in stack:
+            raise ValueError(f"Template cycle: {' -> '.join(stack + [name])}")
+        if len(stack) >= MAX_DEPTH:
+            raise ValueError(f"Templates nested more than {MAX_DEPTH} deep: {name}")
+        depth = len(stack)
+        stack.append(name)
+
+        text = self._read(name, dependencies)
+        if '<!--' not in text:
+            del stack[depth:]
+            return text
+
+        parent, nodes, blocks = parse_layout(text, name)
+        overrides = {}
+        while parent is not None:
+            # The most derived template's blocks win
+            for block_name, block in blocks.items():
+                overrides.setdefault(block_name, block)
+            parent_name = normalize_name(parent)
+            if parent_name in stack:
+                raise ValueError(f"Template cycle: {' -> '.join(stack + [parent_name])}")
+            if len(stack) >= MAX_DEPTH:
+                raise ValueError(f"Templates nested more than {MAX_DEPTH} deep: {parent_name}")
+            stack.append(parent_name)
+            parent, nodes, blocks = parse_layout(self._read(parent_name, dependencies), parent_name)
+
+        parts = []
+        self._render(nodes, overrides, parts, stack, dependencies)
+        del stack[depth:]
+        return ''.join(parts)
+
+    def _render(self, nodes, overrides, parts, stack, dependencies):
+        for node in nodes:
+            if isinstance(node, str):
+                parts.append(node)
+            elif node[0] == 'include':
+                parts.append(self._flatten(normalize_name(node[1]), stack, dependencies))
+            else:
+                self._render(overrides.get(node[1], node)[2], overrides, parts, stack, dependencies)
@@ -4,8 +4,23 @@
 Integration test for page_maker.py - simulates HTML generation
 """
 
+import gzip
+import io
+import json
 import os
-from html_utils import PTagParser, replace_content_safe
+import shutil
+import tempfile
+import threading
+import urllib.error
+import urllib.request
+from contextlib import redirect_stderr
+from html_utils import PTagParser, CompiledTemplate
+from batch import run_batch
+from listings import ListingSpec
+from postprocess import OutputPipeline
+from preview_server import PreviewSite, make_server
+from search_index import SearchSpec
+from watch import Watcher
 
 
 def test_html_generation():
@@ -13,11 +28,11 @@ def test_html_generation():
     templates_dir = os.path.join(os.path.dirname(__file__), 'templates')
     output_dir = os.path.join(os.path.dirname(__file__), 'output')
     
-    # Test with blog_post.html template
-    template_path = os.path.join(templates_dir, 'blog_post.html')
+    # Test with lit_init.html template
+    template_path = os.path.join(templates_dir, 'lit_init.html')
     
     print("Testing HTML generation...")
-    print(f"Using template: blog_post.html")
+    print(f"Using template: lit_init.html")
     
     # Read template
     with open(template_path, 'r', encoding='utf-8') as f:
@@ -31,10 +46,8 @@ def test_html_generation():
     
     # Simulate user input
     user_inputs = {
-        'title': '我的第一篇博客',
-        'author': '作者: 张三',
-        'date': '日期: 2024-01-19',
-        'content-main': '这是一篇测试博客文章。通过Page Maker工具生成，验证功能是否正常工作。'
+        'blog-post-meta-in': '日期: 2024-01-19 分组：翻译作品',
+        'blog-post-content-in': '这是一篇测试博客文章。通过Page Maker工具生成，验证功能是否正常工作。'
     }
     
     print("\nSimulating user inputs:")
@@ -42,10 +55,7 @@ def test_html_generation():
         print(f"  {class_name}: {content}")
     
     # Generate HTML
-    result_html = template_content
-    
-    for class_name, new_content in user_inputs.items():
-        result_html = replace_content_safe(result_html, class_name, new_content)
+    result_html = CompiledTemplate(template_content).render(user_inputs)
     
     # Save result
     output_path = os.path.join(output_dir, 'test_output.html')
@@ -70,12 +80,761 @@ def test_html_generation():
     return all_present
 
 
+def test_batch_generation():
+    """Test headless batch generation from a JSONL manifest"""
+    templates_dir = os.path.join(os.path.dirname(__file__), 'templates')
+    
+    print("Testing batch generation...")
+    
+    with tempfile.TemporaryDirectory() as work_dir:
+        index_path = os.path.join(work_dir, 'template_index.json')
+        manifest_path = os.path.join(work_dir, 'manifest.jsonl')
+        output_dir = os.path.join(work_dir, 'output')
+        
+        rows = [
+            {'template': 'lit_init.html', 'filename': f'post-{i}', 'blog-post-meta-in': f'2024-01-{i + 1:02d}'}
+            for i in range(5)
+        ]
+        rows.append({'template': 'blog_init.html', 'filename': 'note.html', 'content': '<内容>'})
+        with open(manifest_path, 'w', encoding='utf-8') as f:
+            for row in rows:
+                f.write(json.dumps(row, ensure_ascii=False) + '\n')
+        
+        stats = run_batch(manifest_path, templates_dir=templates_dir, output_dir=output_dir,
+                          index_path=index_path)
+        print(stats.summary())
+        
+        all_present = stats.pages == len(rows) and stats.errors == 0 and stats.templates == 2
+        
+        with open(os.path.join(output_dir, 'post-3.html'), 'r', encoding='utf-8') as f:
+            all_present = all_present and '2024-01-04' in f.read()
+        with open(os.path.join(output_dir, 'note.html'), 'r', encoding='utf-8') as f:
+            all_present = all_present and '&lt;内容&gt;' in f.read()
+        
+        # --cache-dir keeps the template index with the cache; --no-cache writes no state.
+        # The scanner extractor gives the same pages as the parser.
+        cache_dir = os.path.join(work_dir, 'cache')
+        run_batch(manifest_path, templates_dir=templates_dir, output_dir=output_dir, cache_dir=cache_dir)
+        no_cache_dir = os.path.join(work_dir, 'no-cache')
+        scanned = run_batch(manifest_path, templates_dir=templates_dir, output_dir=no_cache_dir, cache_dir=None,
+                            extractor='scanner')
+        
+        def read_pages(directory):
+            pages = {}
+            for filename in os.listdir(directory):
+                with open(os.path.join(directory, filename), 'rb') as f:
+                    pages[filename] = f.read()
+            return pages
+        
+        all_present = (
+            all_present
+            and (scanned.pages, scanned.errors) == (len(rows), 0)
+            and read_pages(no_cache_dir) == read_pages(output_dir)
+            and os.path.exists(index_path)
+            and os.listdir(os.path.join(cache_dir, 'state'))[0].startswith('template_index-')
+            and len(os.listdir(no_cache_dir)) == len(rows)
+            and sorted(os.listdir(work_dir)) == ['cache', 'manifest.jsonl', 'no-cache', 'output',
+                                                 'template_index.json']
+        )
+    
+    if all_present:
+        print("  ✓ All batch pages generated")
+    else:
+        print("  ❌ Batch output is incomplete")
+    
+    assert all_present
+    return all_present
+
+
+def test_parallel_batch_matches_serial():
+    """Test that --jobs N writes the same files as the serial mode"""
+    templates_dir = os.path.join(os.path.dirname(__file__), 'templates')
+    
+    print("Testing parallel batch generation...")
+    
+    with tempfile.TemporaryDirectory() as work_dir:
+        index_path = os.path.join(work_dir, 'template_index.json')
+        manifest_path = os.path.join(work_dir, 'manifest.jsonl')
+        with open(manifest_path, 'w', encoding='utf-8') as f:
+            for i in range(200):
+                template = 'lit_init.html' if i % 2 else 'blog_init.html'
+                row = {'template': template, 'filename': f'page-{i}', 'content': f'第{i}页 & more',
+                       'blog-post-content-in': f'正文 {i}'}
+                f.write(json.dumps(row, ensure_ascii=False) + '\n')
+        
+        outputs = {}
+        for jobs in (1, 2):
+            output_dir = os.path.join(work_dir, f'output-{jobs}')
+            stats = run_batch(manifest_path, templates_dir=templates_dir, output_dir=output_dir, jobs=jobs,
+                              index_path=index_path)
+            print(f"  jobs={jobs}: {stats.summary()}")
+            
+            outputs[jobs] = {}
+            for filename in os.listdir(output_dir):
+                with open(os.path.join(output_dir, filename), 'rb') as f:
+                    outputs[jobs][filename] = f.read()
+    
+    matched = len(outputs[1]) == 200 and outputs[1] == outputs[2]
+    if matched:
+        print("  ✓ Parallel output matches serial output")
+    else:
+        print("  ❌ Parallel output differs from serial output")
+    
+    assert matched
+    return matched
+
+
+def test_async_writer_batch():
+    """Test that pages written through the async writer match the serial mode"""
+    templates_dir = os.path.join(os.path.dirname(__file__), 'templates')
+    
+    print("Testing batch generation with async writers...")
+    
+    with tempfile.TemporaryDirectory() as work_dir:
+        index_path = os.path.join(work_dir, 'template_index.json')
+        manifest_path = os.path.join(work_dir, 'manifest.jsonl')
+        with open(manifest_path, 'w', encoding='utf-8') as f:
+            for i in range(100):
+                row = {'template': 'blog_init.html', 'filename': f'page-{i}', 'content': f'第{i}页'}
+                f.write(json.dumps(row, ensure_ascii=False) + '\n')
+        
+        outputs = {}
+        for writers in (0, 3):
+            output_dir = os.path.join(work_dir, f'output-{writers}')
+            # A directory in the way of one page makes its write fail
+            os.makedirs(os.path.join(output_dir, 'page-7.html'))
+            stats = run_batch(manifest_path, templates_dir=templates_dir, output_dir=output_dir,
+                              writers=writers, fsync=True, index_path=index_path)
+            print(f"  writers={writers}: {stats.summary()}")
+            
+            outputs[writers] = (stats.pages, stats.errors, stats.bytes_written, {})
+            for filename in os.listdir(output_dir):
+                path = os.path.join(output_dir, filename)
+                if os.path.isfile(path):
+                    with open(path, 'rb') as f:
+                        outputs[writers][3][filename] = f.read()
+    
+    matched = outputs[0] == outputs[3] and outputs[3][:2] == (99, 1) and len(outputs[3][3]) == 99
+    if matched:
+        print("  ✓ Async writer output matches serial output, failed write reported")
+    else:
+        print("  ❌ Async writer output differs from serial output")
+    
+    assert matched
+    return matched
+
+
+def test_incremental_batch():
+    """Test that incremental batch runs only rewrite changed pages"""
+    templates_dir = os.path.join(os.path.dirname(__file__), 'templates')
+    
+    print("Testing incremental batch generation...")
+    
+    with tempfile.TemporaryDirectory() as work_dir:
+        index_path = os.path.join(work_dir, 'template_index.json')
+        manifest_path = os.path.join(work_dir, 'manifest.jsonl')
+        output_dir = os.path.join(work_dir, 'output')
+        
+        def build(rows, prune=False):
+            with open(manifest_path, 'w', encoding='utf-8') as f:
+                for row in rows:
+                    f.write((row if isinstance(row, str) else json.dumps(row, ensure_ascii=False)) + '\n')
+            stats = run_batch(manifest_path, templates_dir=templates_dir, output_dir=output_dir,
+                              incremental=True, prune=prune, index_path=index_path)
+            print(f"  {stats.summary()}")
+            return stats
+        
+        rows = [{'template': 'blog_init.html', 'filename': f'post-{i}', 'content': f'内容 {i}'} for i in range(10)]
+        first = build(rows)
+        
+        rows[3]['content'] = '修改后的内容'
+        second = build(rows[:8], prune=True)
+        
+        # Filenames outside the output directory and malformed lines are
+        # row errors, never written
+        outside = os.path.join(work_dir, 'outside.html')
+        escaping = [{'template': 'blog_init.html', 'filename': name, 'content': '越界'}
+                    for name in ('../outside', outside, 'posts/../../outside.html')]
+        malformed = ['{"template": "blog_init.html", "filename": ', '[1, 2]']
+        errors = io.StringIO()
+        with redirect_stderr(errors):
+            third = build(rows[:8] + escaping + malformed, prune=True)
+        
+        results_ok = (
+            (first.pages, first.skipped) == (10, 0)
+            and (second.pages, second.skipped, second.removed) == (1, 7, 2)
+            and (third.pages, third.skipped, third.errors) == (0, 8, 5)
+            and 'manifest.jsonl:12: invalid JSON' in errors.getvalue()
+            and 'manifest.jsonl:13: expected a JSON object' in errors.getvalue()
+            and not os.path.exists(outside)
+            and sorted(os.listdir(output_dir)) == sorted(f'post-{i}.html' for i in range(8))
+        )
+    
+    if results_ok:
+        print("  ✓ Only the changed page was rebuilt and orphans were removed")
+    else:
+        print("  ❌ Incremental build rebuilt or removed the wrong pages")
+    
+    assert results_ok
+    return results_ok
+
+
+def test_preview_server():
+    """Test on-demand rendering, ETag revalidation, gzip and template reloads"""
+    templates_dir = os.path.join(os.path.dirname(__file__), 'templates')
+    
+    print("Testing preview server...")
+    
+    with tempfile.TemporaryDirectory() as work_dir:
+        shutil.copy(os.path.join(templates_dir, 'blog_init.html'), work_dir)
+        manifest_path = os.path.join(work_dir, 'drafts.jsonl')
+        with open(manifest_path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({'template': 'blog_init.html', 'filename': 'draft', 'content': '草稿 <1>'},
+                               ensure_ascii=False) + '\n')
+        
+        server = make_server(PreviewSite(work_dir, manifest_path), port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base = f"http://127.0.0.1:{server.server_address[1]}"
+        
+        def fetch(path, **headers):
+            request = urllib.request.Request(base + path, headers=headers)
+            try:
+                with urllib.request.urlopen(request) as response:
+                    return response.status, response.headers, response.read()
+            except urllib.error.HTTPError as e:
+                return e.code, e.headers, b''
+        
+        try:
+            status, headers, body = fetch('/pages/draft.html')
+            etag = headers['ETag']
+            results_ok = status == 200 and '草稿 &lt;1&gt;' in body.decode('utf-8')
+            
+            status, headers, body = fetch('/pages/draft.html', **{'If-None-Match': etag})
+            results_ok = results_ok and status == 304
+            
+            status, headers, body = fetch('/pages/draft.html', **{'Accept-Encoding': 'gzip'})
+            results_ok = (results_ok and headers['Content-Encoding'] == 'gzip'
+                          and '草稿' in gzip.decompress(body).decode('utf-8'))
+            
+            status, _, body = fetch('/templates/blog_init.html?content=%E9%A2%84%E8%A7%88')
+            results_ok = results_ok and status == 200 and '预览' in body.decode('utf-8')
+            
+            # An edited template is a new page hash, so the old ETag no longer matches
+            template_path = os.path.join(work_dir, 'blog_init.html')
+            with open(template_path, 'a', encoding='utf-8') as f:
+                f.write('<!-- edited -->\n')
+            status, headers, body = fetch('/pages/draft.html', **{'If-None-Match': etag})
+            results_ok = results_ok and status == 200 and b'<!-- edited -->' in body
+            
+            results_ok = results_ok and fetch('/pages/missing.html')[0] == 404
+            results_ok = results_ok and fetch('/templates/..%2Fdrafts.jsonl')[0] == 400
+        finally:
+            server.shutdown()
+            server.server_close()
+    
+    if results_ok:
+        print("  ✓ Pages are rendered on demand, revalidated and reloaded")
+    else:
+        print("  ❌ Preview server responses are wrong")
+    
+    assert results_ok
+    return results_ok
+
+
+def test_watch_rebuilds_affected_pages():
+    """Test that watch mode only re-renders pages whose inputs changed"""
+    templates_dir = os.path.join(os.path.dirname(__file__), 'templates')
+    
+    print("Testing watch mode...")
+    
+    with tempfile.TemporaryDirectory() as work_dir:
+        watched_templates = os.path.join(work_dir, 'templates')
+        content_dir = os.path.join(work_dir, 'content')
+        output_dir = os.path.join(work_dir, 'output')
+        os.makedirs(content_dir)
+        shutil.copytree(templates_dir, watched_templates)
+        
+        def write_manifest(name, rows):
+            with open(os.path.join(content_dir, name), 'w', encoding='utf-8') as f:
+                for row in rows:
+                    f.write(json.dumps(row, ensure_ascii=False) + '\n')
+        
+        blog_rows = [{'template': 'blog_init.html', 'filename': f'blog-{i}', 'content': f'博客 {i}'}
+                     for i in range(3)]
+        write_manifest('blog.jsonl', blog_rows)
+        write_manifest('lit.jsonl', [{'template': 'lit_init.html', 'filename': 'lit-0',
+                                      'blog-post-content-in': '正文'}])
+        
+        watcher = Watcher(watched_templates, content_dir, output_dir)
+        first = watcher.build()
+        
+        # Template edit: only the pages built from it
+        with open(os.path.join(watched_templates, 'lit_init.html'), 'a', encoding='utf-8') as f:
+            f.write('<!-- edited -->\n')
+        template_change = watcher.rebuild(watcher.changes())
+        with open(os.path.join(output_dir, 'lit-0.html'), 'r', encoding='utf-8') as f:
+            edited = '<!-- edited -->' in f.read()
+        
+        # Manifest edit: one row changed, one removed
+        blog_rows[1]['content'] = '修改后的博客'
+        write_manifest('blog.jsonl', blog_rows[:2])
+        content_change = watcher.rebuild(watcher.changes())
+        with open(os.path.join(output_dir, 'blog-1.html'), 'r', encoding='utf-8') as f:
+            updated = '修改后的博客' in f.read()
+        
+        results_ok = (
+            (first.pages, first.errors) == (4, 0)
+            and edited and template_change.pages == 1
+            and updated and (content_change.pages, content_change.removed) == (1, 1)
+            and sorted(os.listdir(output_dir)) == ['blog-0.html', 'blog-1.html', 'lit-0.html']
+            and not watcher.changes()
+        )
+    
+    if results_ok:
+        print("  ✓ Only the affected pages were re-rendered")
+    else:
+        print("  ❌ Watch mode rebuilt the wrong pages")
+    
+    assert results_ok
+    return results_ok
+
+
+def test_layouts_and_partials():
+    """Test that batch and watch builds follow layout and partial changes"""
+    print("Testing layouts and partials...")
+    
+    with tempfile.TemporaryDirectory() as work_dir:
+        index_path = os.path.join(work_dir, 'template_index.json')
+        templates_dir = os.path.join(work_dir, 'templates')
+        content_dir = os.path.join(work_dir, 'content')
+        output_dir = os.path.join(work_dir, 'output')
+        os.makedirs(os.path.join(templates_dir, '_partials'))
+        os.makedirs(content_dir)
+        
+        def write(path, content):
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(content)
+        
+        def read(filename):
+            with open(os.path.join(output_dir, filename), 'r', encoding='utf-8') as f:
+                return f.read()
+        
+        write(os.path.join(templates_dir, '_partials', 'header.html'), '<header>博客</header>\n')
+        write(os.path.join(templates_dir, '_base.html'),
+              '<html><body><!-- include "_partials/header.html" -->\n'
+              '<!-- block "main" --><p class="body">默认</p><!-- endblock --></body></html>\n')
+        write(os.path.join(templates_dir, 'post.html'),
+              '<!-- extends "_base.html" -->\n'
+              '<!-- block "main" --><h1><p class="title">标题</p></h1><p class="body">正文</p><!-- endblock -->')
+        write(os.path.join(templates_dir, 'note.html'),
+              '<!-- extends "_base.html" -->')
+        write(os.path.join(templates_dir, 'plain.html'), '<p class="body">独立页面</p>\n')
+        
+        manifest_path = os.path.join(content_dir, 'pages.jsonl')
+        with open(manifest_path, 'w', encoding='utf-8') as f:
+            for template, filename in (('post.html', 'post'), ('note.html', 'note'), ('plain.html', 'plain')):
+                row = {'template': template, 'filename': filename, 'body': '内容'}
+                if template == 'post.html':
+                    row['title'] = '<标题>'
+                f.write(json.dumps(row, ensure_ascii=False) + '\n')
+        
+        # Batch: the same pages with and without --mmap, then only the pages
+        # built from the changed partial
+        first = run_batch(manifest_path, templates_dir=templates_dir, output_dir=output_dir,
+                          incremental=True, index_path=index_path)
+        post = read('post.html')
+        mapped_dir = os.path.join(work_dir, 'mapped')
+        run_batch(manifest_path, templates_dir=templates_dir, output_dir=mapped_dir, use_mmap=True,
+                  index_path=index_path)
+        with open(os.path.join(mapped_dir, 'post.html'), 'r', encoding='utf-8') as f:
+            mapped_post = f.read()
+        
+        write(os.path.join(templates_dir, '_partials', 'header.html'), '<header>新的博客标题</header>\n')
+        second = run_batch(manifest_path, templates_dir=templates_dir, output_dir=output_dir,
+                           incremental=True, index_path=index_path)
+        
+        # Watch: a partial edit re-renders the dependent pages only
+        watcher = Watcher(templates_dir, content_dir, output_dir)
+        watcher.build()
+        write(os.path.join(templates_dir, '_partials', 'header.html'), '<header>第三版页眉内容</header>\n')
+        change = watcher.rebuild(watcher.changes())
+        
+        results_ok = (
+            (first.pages, first.errors) == (3, 0)
+            and post == ('<html><body><header>博客</header>\n\n'
+                         '<h1><p class="title">&lt;标题&gt;</p></h1><p class="body">内容</p></body></html>\n')
+            and mapped_post == post
+            and '<p class="body">内容</p>' in read('note.html')
+            and (second.pages, second.skipped) == (2, 1)
+            and change.pages == 2
+            and '第三版页眉内容' in read('post.html') and '第三版页眉内容' in read('note.html')
+        )
+        print(f"  {second.summary()}")
+    
+    if results_ok:
+        print("  ✓ Pages were flattened and rebuilt when their partial changed")
+    else:
+        print("  ❌ Layout or partial changes were not followed")
+    
+    assert results_ok
+    return results_ok
+
+
+def test_listing_pages():
+    """Test that listing pages are generated and rebuilt only when they change"""
+    print("Testing listing pages...")
+    
+    with tempfile.TemporaryDirectory() as work_dir:
+        index_path = os.path.join(work_dir, 'template_index.json')
+        templates_dir = os.path.join(work_dir, 'templates')
+        output_dir = os.path.join(work_dir, 'output')
+        os.makedirs(templates_dir)
+        shutil.copy(os.path.join(os.path.dirname(__file__), 'templates', '_listing.html'), templates_dir)
+        with open(os.path.join(templates_dir, 'post.html'), 'w', encoding='utf-8') as f:
+            f.write('<h1><p class="title">标题</p></h1><p class="body">正文</p>\n')
+        
+        manifest_path = os.path.join(work_dir, 'posts.jsonl')
+        
+        def write_manifest(renamed=None):
+            with open(manifest_path, 'w', encoding='utf-8') as f:
+                for i in range(10):
+                    row = {
+                        'template': 'post.html',
+                        'filename': f'post-{i}',
+                        'title': renamed if i == 0 and renamed else f'文章 {i}',
+                        'body': '内容',
+                        'date': f'2024-{1 + i % 2:02d}-{10 + i:02d}',
+                        'tags': 'python' if i < 4 else '随笔',
+                    }
+                    f.write(json.dumps(row, ensure_ascii=False) + '\n')
+        
+        def read(filename):
+            with open(os.path.join(output_dir, filename), 'r', encoding='utf-8') as f:
+                return f.read()
+        
+        listing = ListingSpec(page_size=4)
+        write_manifest()
+        first = run_batch(manifest_path, templates_dir=templates_dir, output_dir=output_dir,
+                          incremental=True, listing=listing, index_path=index_path)
+        names = sorted(name for name in os.listdir(output_dir) if not name.startswith('post-'))
+        index = read('index.html')
+        second = run_batch(manifest_path, templates_dir=templates_dir, output_dir=output_dir,
+                           incremental=True, listing=listing, jobs=2, index_path=index_path)
+        
+        # post-0 is on the last index page, the python tag page and the
+        # January archive only
+        write_manifest('<改名>')
+        third = run_batch(manifest_path, templates_dir=templates_dir, output_dir=output_dir,
+                          incremental=True, listing=listing, index_path=index_path)
+        
+        results_ok = (
+            (first.pages, first.listing_pages, first.errors) == (20, 10, 0)
+            and names == ['archive-2024-01-2.html', 'archive-2024-01.html', 'archive-2024-02-2.html',
+                          'archive-2024-02.html', 'index-2.html', 'index-3.html', 'index.html',
+                          'tag-python.html', 'tag-随笔-2.html', 'tag-随笔.html']
+            and '<a href="post-9.html">文章 9</a>' in index
+            and '<a href="post-0.html">' not in index
+            and '下一页' in index
+            and (second.pages, second.skipped) == (0, 20)
+            and (third.pages, third.skipped) == (4, 16)
+            and '&lt;改名&gt;' in read('index-3.html')
+            and '&lt;改名&gt;' in read('tag-python.html')
+            and '&lt;改名&gt;' in read('archive-2024-01-2.html')
+        )
+        print(f"  {third.summary()}")
+    
+    if results_ok:
+        print("  ✓ Listing pages were generated and rebuilt incrementally")
+    else:
+        print("  ❌ Listing pages were generated or rebuilt incorrectly")
+    
+    assert results_ok
+    return results_ok
+
+
+def test_minified_gzip_batch():
+    """Test that batch builds minify pages and keep their .gz siblings current"""
+    print("Testing minified and precompressed output...")
+    
+    with tempfile.TemporaryDirectory() as work_dir:
+        index_path = os.path.join(work_dir, 'template_index.json')
+        templates_dir = os.path.join(work_dir, 'templates')
+        os.makedirs(templates_dir)
+        template_path = os.path.join(templates_dir, 'post.html')
+        with open(template_path, 'w', encoding='utf-8') as f:
+            f.write('<html>\n  <body>\n    <!-- 正文 -->\n    <h1><p class="title">标题</p></h1>\n'
+                    '    <pre>  保留\n  空白</pre>\n  </body>\n</html>\n')
+        
+        manifest_path = os.path.join(work_dir, 'pages.jsonl')
+        with open(manifest_path, 'w', encoding='utf-8') as f:
+            for i in range(100):
+                f.write(json.dumps({'template': 'post.html', 'filename': f'post-{i}', 'title': f'文章 {i}'},
+                                   ensure_ascii=False) + '\n')
+        
+        def read_output(output_dir):
+            files = {}
+            for name in sorted(os.listdir(output_dir)):
+                with open(os.path.join(output_dir, name), 'rb') as f:
+                    files[name] = f.read()
+            return files
+        
+        pipeline = OutputPipeline(minify=True, gzip_level=6)
+        serial_dir = os.path.join(work_dir, 'serial')
+        size_report = os.path.join(work_dir, 'sizes.jsonl')
+        first = run_batch(manifest_path, templates_dir=templates_dir, output_dir=serial_dir,
+                          incremental=True, pipeline=pipeline, size_report=size_report,
+                          index_path=index_path)
+        serial = read_output(serial_dir)
+        parallel_dir = os.path.join(work_dir, 'parallel')
+        run_batch(manifest_path, templates_dir=templates_dir, output_dir=parallel_dir,
+                  jobs=2, pipeline=pipeline, index_path=index_path)
+        writer_dir = os.path.join(work_dir, 'writer')
+        run_batch(manifest_path, templates_dir=templates_dir, output_dir=writer_dir,
+                  writers=2, pipeline=pipeline, index_path=index_path)
+        parallel = read_output(parallel_dir)
+        writer = read_output(writer_dir)
+        with open(size_report, 'r', encoding='utf-8') as f:
+            sizes = [json.loads(line) for line in f]
+        
+        # Only a comment changes: every page is rebuilt, no .gz is rewritten
+        with open(template_path, 'r', encoding='utf-8') as f:
+            template = f.read()
+        with open(template_path, 'w', encoding='utf-8') as f:
+            f.write(template.replace('<!-- 正文 -->', '<!-- 文章正文 -->'))
+        gzip_mtime = os.stat(os.path.join(serial_dir, 'post-0.html.gz')).st_mtime_ns
+        second = run_batch(manifest_path, templates_dir=templates_dir, output_dir=serial_dir,
+                           incremental=True, pipeline=pipeline, index_path=index_path)
+        second_gzip_mtime = os.stat(os.path.join(serial_dir, 'post-0.html.gz')).st_mtime_ns
+        
+        # Pages rewritten without gzip lose their stale .gz siblings, in every mode
+        run_batch(manifest_path, templates_dir=templates_dir, output_dir=serial_dir, incremental=True,
+                  index_path=index_path)
+        run_batch(manifest_path, templates_dir=templates_dir, output_dir=parallel_dir, jobs=2,
+                  pipeline=OutputPipeline(minify=True), index_path=index_path)
+        run_batch(manifest_path, templates_dir=templates_dir, output_dir=writer_dir, writers=2,
+                  index_path=index_path)
+        stale = [name for directory in (serial_dir, parallel_dir, writer_dir)
+                 for name in os.listdir(directory) if name.endswith('.gz')]
+        
+        results_ok = (
+            (first.pages, first.errors) == (100, 0)
+            and len(serial) == 200
+            and serial['post-0.html'] == ('<html>\n<body>\n<h1><p class="title">文章 0</p></h1>\n'
+                                          '<pre>  保留\n  空白</pre>\n</body>\n</html>\n').encode('utf-8')
+            and all(gzip.decompress(serial[f'post-{i}.html.gz']) == serial[f'post-{i}.html'] for i in range(100))
+            and parallel == serial
+            and writer == serial
+            and len(sizes) == 100
+            and sizes[0]['minified'] == len(serial[sizes[0]['filename']]) < sizes[0]['rendered']
+            and first.sizes.compressed == sum(len(serial[f'post-{i}.html.gz']) for i in range(100))
+            and (second.pages, second.sizes.unchanged) == (100, 100)
+            and second_gzip_mtime == gzip_mtime
+            and stale == []
+        )
+        print(f"  {first.summary()}")
+    
+    if results_ok:
+        print("  ✓ Pages were minified and their .gz files kept current")
+    else:
+        print("  ❌ Minified or precompressed output was wrong")
+    
+    assert results_ok
+    return results_ok
+
+
+def test_fingerprinted_assets_batch():
+    """Test that batch builds link fingerprinted assets and follow their changes"""
+    print("Testing asset fingerprinting...")
+    
+    with tempfile.TemporaryDirectory() as work_dir:
+        index_path = os.path.join(work_dir, 'template_index.json')
+        asset_cache_path = os.path.join(work_dir, 'asset_hashes.json')
+        templates_dir = os.path.join(work_dir, 'templates')
+        site_dir = os.path.join(work_dir, 'site')
+        output_dir = os.path.join(work_dir, 'output')
+        os.makedirs(templates_dir)
+        os.makedirs(os.path.join(site_dir, 'src', 'css'))
+        style_path = os.path.join(site_dir, 'src', 'css', 'main_style.css')
+        with open(style_path, 'w', encoding='utf-8') as f:
+            f.write('body { color: #333; }\n')
+        with open(os.path.join(templates_dir, 'post.html'), 'w', encoding='utf-8') as f:
+            f.write('<link href="/src/css/main_style.css" rel="stylesheet">\n<p class="title">标题</p>\n')
+        with open(os.path.join(templates_dir, 'plain.html'), 'w', encoding='utf-8') as f:
+            f.write('<p class="title">标题</p>\n')
+        
+        manifest_path = os.path.join(work_dir, 'pages.jsonl')
+        with open(manifest_path, 'w', encoding='utf-8') as f:
+            for i in range(20):
+                template = 'post.html' if i % 2 == 0 else 'plain.html'
+                f.write(json.dumps({'template': template, 'filename': f'page-{i}', 'title': f'页面 {i}'},
+                                   ensure_ascii=False) + '\n')
+        
+        def read(filename, directory=output_dir):
+            with open(os.path.join(directory, filename), 'r', encoding='utf-8') as f:
+                return f.read()
+        
+        first = run_batch(manifest_path, templates_dir=templates_dir, output_dir=output_dir,
+                          incremental=True, assets_dir=site_dir, index_path=index_path,
+                          asset_cache_path=asset_cache_path)
+        first_link = read('page-0.html').split('"')[1]
+        parallel_dir = os.path.join(work_dir, 'parallel')
+        run_batch(manifest_path, templates_dir=templates_dir, output_dir=parallel_dir, jobs=2,
+                  use_mmap=True, assets_dir=site_dir, index_path=index_path,
+                  asset_cache_path=asset_cache_path)
+        unchanged = run_batch(manifest_path, templates_dir=templates_dir, output_dir=output_dir,
+                              incremental=True, assets_dir=site_dir, index_path=index_path,
+                              asset_cache_path=asset_cache_path)
+        parallel_same = all(read(f'page-{i}.html', parallel_dir) == read(f'page-{i}.html') for i in range(20))
+        
+        # A changed stylesheet gets a new name; only the pages using it change
+        with open(style_path, 'w', encoding='utf-8') as f:
+            f.write('body { color: #000; }\n')
+        changed = run_batch(manifest_path, templates_dir=templates_dir, output_dir=output_dir,
+                            incremental=True, assets_dir=site_dir, index_path=index_path,
+                            asset_cache_path=asset_cache_path)
+        second_link = read('page-0.html').split('"')[1]
+        
+        results_ok = (
+            (first.pages, first.errors) == (20, 0)
+            and first_link.startswith('/src/css/main_style.') and first_link.endswith('.css')
+            and read(first_link.lstrip('/')) == 'body { color: #333; }\n'
+            and parallel_same
+            and (unchanged.pages, unchanged.assets.hashes.misses, unchanged.assets.copied) == (0, 0, 0)
+            and (changed.pages, changed.skipped) == (10, 10)
+            and second_link != first_link
+            and read(second_link.lstrip('/')) == 'body { color: #000; }\n'
+            and os.path.exists(os.path.join(output_dir, first_link.lstrip('/')))
+            and os.path.exists(index_path) and os.path.exists(asset_cache_path)
+        )
+        print(f"  {changed.summary()}")
+    
+    if results_ok:
+        print("  ✓ Pages linked fingerprinted assets that follow their content")
+    else:
+        print("  ❌ Assets were not fingerprinted correctly")
+    
+    assert results_ok
+    return results_ok
+
+
+def test_search_index_batch():
+    """Test that batch builds keep a search index of the changed pages up to date"""
+    print("Testing search index...")
+    
+    with tempfile.TemporaryDirectory() as work_dir:
+        index_path = os.path.join(work_dir, 'template_index.json')
+        templates_dir = os.path.join(work_dir, 'templates')
+        output_dir = os.path.join(work_dir, 'output')
+        os.makedirs(templates_dir)
+        with open(os.path.join(templates_dir, 'post.html'), 'w', encoding='utf-8') as f:
+            f.write('<p class="title">标题</p>\n<p class="content">正文</p>\n')
+        
+        manifest_path = os.path.join(work_dir, 'posts.jsonl')
+        
+        def write_manifest(rows):
+            with open(manifest_path, 'w', encoding='utf-8') as f:
+                for row in rows:
+                    f.write(json.dumps(row, ensure_ascii=False) + '\n')
+        
+        def read_search(directory):
+            search_dir = os.path.join(directory, 'search')
+            files = {}
+            for name in sorted(os.listdir(search_dir)):
+                with open(os.path.join(search_dir, name), 'r', encoding='utf-8') as f:
+                    files[name] = json.load(f)
+            return files
+        
+        rows = [{'template': 'post.html', 'filename': f'post-{i}.html', 'title': f'文章 {i}',
+                 'content': f'静态网站生成 static site number{i}'} for i in range(30)]
+        write_manifest(rows)
+        
+        first = run_batch(manifest_path, templates_dir=templates_dir, output_dir=output_dir,
+                          incremental=True, search=SearchSpec(), index_path=index_path)
+        serial_index = read_search(output_dir)
+        same_everywhere = True
+        for name, options in (('parallel', {'jobs': 2}), ('writers', {'writers': 4})):
+            directory = os.path.join(work_dir, name)
+            run_batch(manifest_path, templates_dir=templates_dir, output_dir=directory, search=SearchSpec(),
+                      index_path=index_path, **options)
+            same_everywhere = same_everywhere and read_search(directory) == serial_index
+        
+        unchanged = run_batch(manifest_path, templates_dir=templates_dir, output_dir=output_dir,
+                              incremental=True, search=SearchSpec(), index_path=index_path)
+        
+        # One edited and one deleted post: only their shards are rewritten
+        rows[3]['content'] = 'rewritten 博客'
+        del rows[7]
+        write_manifest(rows)
+        changed = run_batch(manifest_path, templates_dir=templates_dir, output_dir=output_dir,
+                            incremental=True, prune=True, search=SearchSpec(), index_path=index_path)
+        index = read_search(output_dir)
+        
+        # A title column that is not a template field is not reported as one
+        for row in rows:
+            row['headline'] = f"头条 {row['filename']}"
+        write_manifest(rows)
+        warnings = io.StringIO()
+        with redirect_stderr(warnings):
+            titled = run_batch(manifest_path, templates_dir=templates_dir,
+                               output_dir=os.path.join(work_dir, 'titled'),
+                               search=SearchSpec(title_field='headline'), index_path=index_path)
+        
+        results_ok = (
+            (first.pages, first.errors, first.search.updated) == (30, 0, 30)
+            and same_everywhere
+            and len(serial_index['st.json']['static']) == 60
+            and (unchanged.search.updated, unchanged.search.shards_written) == (0, 0)
+            and (changed.search.updated, changed.search.removed) == (1, 1)
+            and changed.search.shards_written < first.search.shards_written
+            and len(index['st.json']['static']) == 56
+            and index['re.json']['rewritten'] == [3, 1]
+            and 'number7' not in index['nu.json']
+            and '7' not in index['docs-0.json']
+            and index['index.json']['documents'] == 29
+            and (titled.pages, titled.errors) == (29, 0)
+            and 'headline' not in warnings.getvalue()
+            and '头条 post-0.html' in json.dumps(read_search(os.path.join(work_dir, 'titled')),
+                                               ensure_ascii=False)
+        )
+        print(f"  {changed.summary()}")
+    
+    if results_ok:
+        print("  ✓ Search index followed the edited and removed posts")
+    else:
+        print("  ❌ Search index was not updated correctly")
+    
+    assert results_ok
+    return results_ok
+
+
 if __name__ == "__main__":
     print("=" * 60)
     print("Page Maker - Integration Test")
     print("=" * 60 + "\n")
     
     success = test_html_generation()
+    print()
+    success = test_batch_generation() and success
+    print()
+    success = test_parallel_batch_matches_serial() and success
+    print()
+    success = test_async_writer_batch() and success
+    print()
+    success = test_incremental_batch() and success
+    print()
+    success = test_preview_server() and success
+    print()
+    success = test_watch_rebuilds_affected_pages() and success
+    print()
+    success = test_layouts_and_partials() and success
+    print()
+    success = test_listing_pages() and success
+    print()
+    success = test_minified_gzip_batch() and success
+    print()
+    success = test_fingerprinted_assets_batch() and success
+    print()
+    success = test_search_index_batch() and success
     
     print("\n" + "=" * 60)
     if success:
@@ -4,9 +4,15 @@
 Test script for page_maker.py - validates template parsing functionality
 """
 
+import io
 import os
 import sys
-from html_utils import PTagParser
+import tempfile
+import instrumentation
+from html import escape
+from html_utils import (PTagParser, PTagScanner, CompiledTemplate, Field, FieldModel, FieldTable,
+                        MappedTemplate, TemplateCache, escape_text, replace_content_safe,
+                        replace_contents_safe)
 
 
 def test_template_parsing():
@@ -55,6 +61,877 @@ def test_template_parsing():
     return all_passed
 
 
+def test_scanner_matches_parser():
+    """Test that PTagScanner extracts the same fields as PTagParser"""
+    templates_dir = os.path.join(os.path.dirname(__file__), 'templates')
+    
+    samples = {}
+    for template_name in sorted(os.listdir(templates_dir)):
+        if template_name.endswith('.html'):
+            with open(os.path.join(templates_dir, template_name), 'r', encoding='utf-8') as f:
+                samples[template_name] = f.read()
+    
+    samples['<synthetic>'] = (
+        '<!DOCTYPE html>\n<style>p { color: red }</style>\n'
+        '<script>var s = "<p class=\'fake\'>no</p>";</script>\n'
+        '<!-- <p class="commented">no</p> -->\n'
+        '<p class="double">A &amp; <b>bold</b> <a href="#">link</a></p>\n'
+        "<p class='single'>single</p><p class=unquoted>bare</p>\n"
+        '<P id="x" CLASS="multi class">multi\nline</P>\n'
+        '<p class="" class="second">second</p><p class="empty"/><p>plain</p>\n'
+        '<p class=open/>kept <b>open</b></p><p class="closed" /><p class=spaced />\n'
+        '<p class="quoted"/><p class=last>end</p>\n'
+    )
+    
+    all_passed = True
+    for name, template in samples.items():
+        parser = PTagParser()
+        parser.feed(template)
+        scanner = PTagScanner()
+        scanner.feed(template)
+        
+        if scanner.p_tags != parser.p_tags:
+            print(f"❌ {name}: scanner found {scanner.p_tags}, parser found {parser.p_tags}")
+            all_passed = False
+    
+    if all_passed:
+        print(f"\n✓ Scanner and parser agree on {len(samples)} template(s)")
+    
+    assert all_passed
+    return all_passed
+
+
+def test_field_table_compatibility():
+    """Test that FieldTable and Field records still behave like the old list of dicts"""
+    parser = PTagParser()
+    parser.feed('<p class="title">标题</p>\n<p class=\'body\'>a &amp; b</p>')
+    fields = parser.p_tags
+    
+    expected = [
+        {'class': 'title', 'content': '标题', 'start_pos': (1, 0)},
+        {'class': 'body', 'content': 'a & b', 'start_pos': (2, 0)},
+    ]
+    
+    all_passed = (
+        isinstance(fields, FieldTable)
+        and fields == expected
+        and [dict(field) for field in fields] == expected
+        and fields[-1]['class'] == 'body' and fields[0].get('content') == '标题'
+        and fields[0].get('missing', 'x') == 'x'
+        and fields[1:] == [Field('body', 'a & b', (2, 0))]
+        and FieldTable(expected) == fields
+        and fields.class_names == ['title', 'body']
+    )
+    
+    if all_passed:
+        print("\n✓ Field records support dict-style access")
+    else:
+        print(f"\n❌ Field records differ from dicts: {fields!r}")
+    
+    assert all_passed
+    return all_passed
+
+
+def test_compiled_template_matches_chained():
+    """Test that CompiledTemplate and replace_contents_safe render exactly like chained replace_content_safe calls"""
+    templates_dir = os.path.join(os.path.dirname(__file__), 'templates')
+    
+    samples = {}
+    for template_name in sorted(os.listdir(templates_dir)):
+        if template_name.endswith('.html'):
+            with open(os.path.join(templates_dir, template_name), 'r', encoding='utf-8') as f:
+                samples[template_name] = f.read()
+    
+    # Quote styles, a tag with extra attributes, a slot without </p> and
+    # slots sharing one closing tag
+    samples['<synthetic>'] = (
+        "<p class='title'>t</p><p class=author>a</p><p class=\"x\" id=\"y\">x</p>"
+        "<p class=\"intro\">one<p class=\"title\">two</p><p class=\"content\">open"
+    )
+    
+    all_passed = True
+    for name, template in samples.items():
+        parser = PTagParser()
+        parser.feed(template)
+        
+        values = {field['class']: f"<b>{field['class']}</b> & \"new\"" for field in parser.p_tags}
+        values['missing'] = 'not in template'
+        
+        for escape_html in (True, False):
+            expected = template
+            for class_name, new_content in values.items():
+                expected = replace_content_safe(expected, class_name, new_content, escape_html)
+            
+            actual = CompiledTemplate(template).render(values, escape_html=escape_html)
+            if actual != expected:
+                print(f"❌ {name}: compiled output differs (escape_html={escape_html})")
+                all_passed = False
+            
+            if replace_contents_safe(template, values, escape_html) != expected:
+                print(f"❌ {name}: bulk replacement differs (escape_html={escape_html})")
+                all_passed = False
+    
+    if all_passed:
+        print(f"\n✓ Compiled templates and bulk replacement match chained replacement for {len(samples)} template(s)")
+    
+    assert all_passed
+    return all_passed
+
+
+def test_escaping_policies():
+    """Test the escaping fast path and per-field escaping policies"""
+    samples = ['', '纯文本内容', 'a & b', '<script>alert("x")</script>', "it's", '&amp;' * 3]
+    all_passed = all(escape_text(sample) == escape(sample) for sample in samples)
+    
+    template = '<p class="title">t</p><p class="body">b</p><p class="tag">g</p>'
+    values = {'title': '<b>标题</b>', 'body': '<em>正文</em>', 'tag': 'a "b" c'}
+    policies = {'body': 'raw', 'tag': 'attribute'}
+    expected = (
+        '<p class="title">&lt;b&gt;标题&lt;/b&gt;</p>'
+        '<p class="body"><em>正文</em></p>'
+        '<p class="tag">a&#x20;&#x22;b&#x22;&#x20;c</p>'
+    )
+    all_passed = (
+        all_passed
+        and CompiledTemplate(template).render(values, policies) == expected
+        and replace_contents_safe(template, values, policies) == expected
+    )
+    
+    try:
+        CompiledTemplate(template).render(values, {'title': 'unknown'})
+        all_passed = False
+    except ValueError:
+        pass
+    
+    if all_passed:
+        print("\n✓ Escaping fast path matches html.escape and per-field policies apply")
+    else:
+        print("\n❌ Escaping policies give unexpected output")
+    
+    assert all_passed
+    return all_passed
+
+
+def test_streaming_render():
+    """Test that streamed output matches CompiledTemplate.render byte for byte"""
+    templates_dir = os.path.join(os.path.dirname(__file__), 'templates')
+    
+    class Socket:
+        def __init__(self):
+            self.sent = []
+        
+        def sendall(self, data):
+            self.sent.append(data)
+    
+    all_passed = True
+    for template_name in sorted(os.listdir(templates_dir)):
+        if not template_name.endswith('.html'):
+            continue
+        _, fields, compiled = TemplateCache(None).load(os.path.join(templates_dir, template_name))
+        values = {field['class']: f"{field['class']} 内容 <&> " * 50 for field in fields}
+        expected = compiled.render(values)
+        
+        text_stream = io.StringIO()
+        compiled.render_to(text_stream, values)
+        
+        # Small chunks so multi-byte characters are split across writes
+        binary_stream = io.BytesIO()
+        written = compiled.render_to(binary_stream, values, chunk_size=7)
+        
+        socket = Socket()
+        compiled.render_to(socket, values)
+        
+        if (text_stream.getvalue() != expected
+                or binary_stream.getvalue() != expected.encode('utf-8')
+                or written != len(expected.encode('utf-8'))
+                or b''.join(socket.sent) != expected.encode('utf-8')):
+            print(f"❌ {template_name}: streamed output differs from render()")
+            all_passed = False
+    
+    if all_passed:
+        print("\n✓ Streamed output matches render() for text, binary and socket targets")
+    
+    assert all_passed
+    return all_passed
+
+
+def test_mapped_template_matches_compiled():
+    """Test that MappedTemplate writes the same bytes as CompiledTemplate"""
+    templates_dir = os.path.join(os.path.dirname(__file__), 'templates')
+    
+    with tempfile.TemporaryDirectory() as work_dir:
+        paths = [os.path.join(templates_dir, name) for name in sorted(os.listdir(templates_dir))
+                 if name.endswith('.html')]
+        
+        # CRLF line endings and Unicode whitespace inside the class attribute
+        extra = {
+            'crlf.html': '<div>\r\n<p class="a">旧\r\n内容</p>\r\n</div>\r\n',
+            'spaces.html': '<p class="\u3000a\u00a0">x</p><p class="b">y<p class="c">z</p>',
+        }
+        for name, content in extra.items():
+            path = os.path.join(work_dir, name)
+            with open(path, 'w', encoding='utf-8', newline='') as f:
+                f.write(content)
+            paths.append(path)
+        
+        all_passed = True
+        for path in paths:
+            _, fields, compiled = TemplateCache(None).load(path)
+            values = {field['class']: f"{field['class']} 内容 <&>" for field in fields}
+            expected = compiled.render(values).encode('utf-8')
+            
+            with MappedTemplate(path) as mapped:
+                stream = io.BytesIO()
+                written = mapped.render_to(stream, values)
+                matched = (stream.getvalue() == expected and written == len(expected)
+                           and mapped.content_hash == compiled.content_hash)
+            
+            if not matched:
+                print(f"❌ {os.path.basename(path)}: mapped output differs from CompiledTemplate")
+                all_passed = False
+    
+    if all_passed:
+        print("\n✓ Memory-mapped rendering matches CompiledTemplate")
+    
+    assert all_passed
+    return all_passed
+
+
+def test_template_cache():
+    """Test that the parsed template cache hits, invalidates and evicts"""
+    with tempfile.TemporaryDirectory() as work_dir:
+        cache = TemplateCache(os.path.join(work_dir, 'cache'))
+        template_path = os.path.join(work_dir, 'page.html')
+        
+        with open(template_path, 'w', encoding='utf-8') as f:
+            f.write('<p class="title">标题</p><p class="body">内容</p>')
+        
+        content, fields, compiled = cache.load(template_path)
+        _, cached_fields, cached_compiled = cache.load(template_path)
+        values = {'title': 'A & B'}
+        
+        all_passed = (
+            (cache.hits, cache.misses) == (1, 1)
+            and cached_fields == fields
+            and [f['class'] for f in fields] == ['title', 'body']
+            and cached_compiled.render(values) == compiled.render(values)
+        )
+        
+        # A changed template must not reuse the old entry
+        with open(template_path, 'w', encoding='utf-8') as f:
+            f.write('<p class="summary">摘要</p>')
+        _, fields, _ = cache.load(template_path)
+        all_passed = all_passed and cache.misses == 2 and fields[0]['class'] == 'summary'
+        
+        # Shrinking the cap to a single entry evicts the least recently used one
+        entry_sizes = [os.path.getsize(os.path.join(cache.cache_dir, name))
+                       for name in os.listdir(cache.cache_dir)]
+        cache.max_bytes = max(entry_sizes)
+        cache.load(template_path)
+        cache.evict()
+        all_passed = all_passed and len(os.listdir(cache.cache_dir)) == 1 and cache.hits == 2
+    
+    if all_passed:
+        print("\n✓ Template cache hits, invalidates and evicts entries")
+    else:
+        print("\n❌ Template cache returned unexpected results")
+    
+    assert all_passed
+    return all_passed
+
+
+def test_template_index():
+    """Test that the template index only re-reads changed templates"""
+    from template_index import TemplateIndex
+    
+    with tempfile.TemporaryDirectory() as work_dir:
+        templates_dir = os.path.join(work_dir, 'templates')
+        os.makedirs(os.path.join(templates_dir, 'posts'))
+        
+        def write(name, content):
+            with open(os.path.join(templates_dir, name), 'w', encoding='utf-8') as f:
+                f.write(content)
+        
+        write('index.html', '<p class="title">标题</p>')
+        write(os.path.join('posts', 'post.html'), '<p class="title">t</p><p class="body">b</p>')
+        
+        index_path = os.path.join(work_dir, 'index.json')
+        cache = TemplateCache(os.path.join(work_dir, 'cache'))
+        index = TemplateIndex(templates_dir, index_path, cache)
+        
+        all_passed = index.refresh() == (2, 0, 0) and index.names() == ['index.html', 'posts/post.html']
+        all_passed = all_passed and index.get('posts/post.html')['fields'] == ['title', 'body']
+        
+        # A fresh index loads the saved entries and reads nothing
+        index = TemplateIndex(templates_dir, index_path, cache)
+        misses = cache.misses
+        all_passed = all_passed and index.refresh() == (0, 0, 0) and cache.misses == misses
+        
+        write('index.html', '<p class="title">标题</p><p class="summary">摘要</p>')
+        os.remove(os.path.join(templates_dir, 'posts', 'post.html'))
+        all_passed = all_passed and index.refresh() == (0, 1, 1)
+        all_passed = all_passed and index.get('index.html')['field_count'] == 2
+    
+    if all_passed:
+        print("\n✓ Template index tracks added, changed and removed templates")
+    else:
+        print("\n❌ Template index returned unexpected results")
+    
+    assert all_passed
+    return all_passed
+
+
+def test_template_layouts():
+    """Test that layouts, blocks and partials are flattened and tracked"""
+    import hashlib
+    from template_index import TemplateIndex
+    from template_loader import TemplateLoader, parse_layout
+    
+    with tempfile.TemporaryDirectory() as work_dir:
+        templates_dir = os.path.join(work_dir, 'templates')
+        for directory in ('_layouts', '_partials'):
+            os.makedirs(os.path.join(templates_dir, directory))
+        
+        def write(name, content):
+            with open(os.path.join(templates_dir, name), 'w', encoding='utf-8') as f:
+                f.write(content)
+        
+        write('_partials/head.html', '<title><p class="title">标题</p></title>')
+        write('_layouts/base.html',
+              '<html><head><!-- include "_partials/head.html" --></head>\n'
+              '<body><!-- block "content" --><p class="body">默认</p><!-- endblock -->'
+              '<!-- block "footer" -->页脚<!-- endblock "footer" --></body></html>\n')
+        write('post.html',
+              'ignored\n<!-- extends "_layouts/base.html" -->\n'
+              '<!-- block "content" --><p class="body">正文</p><p class="tags">标签</p><!-- endblock -->')
+        write('plain.html', '<!-- 普通注释 --><p class="title">t</p>\r\n')
+        write('cycle.html', '<!-- include "cycle.html" -->')
+        
+        cache = TemplateCache(None)
+        loader = TemplateLoader(templates_dir, cache)
+        template, fields, compiled = loader.load('post.html')
+        all_passed = (
+            template == '<html><head><title><p class="title">标题</p></title></head>\n'
+                        '<body><p class="body">正文</p><p class="tags">标签</p>页脚</body></html>\n'
+            and [field['class'] for field in fields] == ['title', 'body', 'tags']
+            and compiled.render({'title': '新标题', 'tags': 'a&b'}) == replace_contents_safe(
+                template, {'title': '新标题', 'tags': 'a&b'})
+            and loader.dependents('_partials/head.html') == {'post.html'}
+        )
+        
+        # Templates without directives hash like TemplateCache.load
+        with open(os.path.join(templates_dir, 'plain.html'), 'rb') as f:
+            plain_hash = hashlib.sha256(f.read()).hexdigest()
+        plain = loader.resolve('plain.html')
+        all_passed = all_passed and not plain.flattened and plain.content_hash == plain_hash
+        
+        # A changed partial rebuilds its dependents only
+        write('_partials/head.html', '<title><p class="title">新的标题</p></title>')
+        misses = loader.misses
+        loader.resolve('plain.html')
+        post = loader.resolve('post.html')
+        all_passed = all_passed and loader.misses == misses + 1 and '新的标题' in post.text
+        
+        # Ordinary comments that start with a directive keyword are kept as text
+        comments = '<!-- include footer --><!-- block-header --><!-- extends: none -->\n'
+        all_passed = all_passed and parse_layout(comments) == (None, [comments], {})
+        
+        for text in ('<!-- block "a" -->', '<!-- endblock -->', '<!-- include -->'):
+            try:
+                parse_layout(text)
+                all_passed = False
+            except ValueError:
+                pass
+        try:
+            loader.resolve('cycle.html')
+            all_passed = False
+        except ValueError as e:
+            all_passed = all_passed and 'cycle' in str(e)
+        
+        # The index lists templates only, with the fields of their layouts,
+        # and re-reads everything built from a changed partial: the partial
+        # itself, the layout and post.html. A symlink back up the tree is
+        # read once instead of followed forever.
+        try:
+            os.symlink('..', os.path.join(templates_dir, '_partials', 'loop'))
+        except (OSError, NotImplementedError):
+            pass
+        index = TemplateIndex(templates_dir, os.path.join(work_dir, 'index.json'), cache)
+        index.refresh()
+        all_passed = (
+            all_passed
+            and index.names() == ['plain.html', 'post.html']
+            and index.get('post.html')['fields'] == ['title', 'body', 'tags']
+        )
+        write('_partials/head.html', '<title><p class="page-title">标题</p></title>')
+        all_passed = (
+            all_passed
+            and index.refresh() == (0, 3, 0)
+            and index.get('post.html')['fields'] == ['page-title', 'body', 'tags']
+        )
+    
+    if all_passed:
+        print("\n✓ Layouts and partials are flattened, tracked and indexed")
+    else:
+        print("\n❌ Layouts and partials were resolved incorrectly")
+    
+    assert all_passed
+    return all_passed
+
+
+def test_listing_spool():
+    """Test that the listing spool sorts like memory and pages listings"""
+    import random
+    import listings
+    from listings import ListingSpec, ListingSpool, iter_listing_pages, listing_filename, month_of, slugify
+    
+    spec = ListingSpec(page_size=3)
+    rng = random.Random(7)
+    records = [
+        spec.record(f'post-{i}.html', {
+            'title': f'文章 {i}',
+            'date': f'2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}',
+            'tags': rng.choice(['python, 网页', 'python，python', '', 'a/b']),
+        })
+        for i in range(200)
+    ]
+    
+    def collect(run_size):
+        with ListingSpool(run_size) as spool:
+            for record in records:
+                spool.add(record)
+            return list(spool.entries()), spool.runs, dict(spool.counts)
+    
+    in_memory, memory_runs, counts = collect(10_000)
+    spilled, spilled_runs, _ = collect(7)
+    
+    # More runs than merged at once are merged in several passes
+    merge_runs = listings.MAX_MERGE_RUNS
+    listings.MAX_MERGE_RUNS = 4
+    try:
+        multi_pass, _, _ = collect(7)
+    finally:
+        listings.MAX_MERGE_RUNS = merge_runs
+    
+    all_passed = (
+        memory_runs == 0 and spilled_runs > 4
+        and spilled == in_memory == multi_pass
+        and counts['index'] == 200 and counts['tag:python'] > 0
+        and in_memory[0][0] == 'tag:网页'
+    )
+    
+    with ListingSpool(5) as spool:
+        for record in records:
+            spool.add(record)
+        pages = list(iter_listing_pages(spool, 3))
+    index_pages = [values for filename, values in pages if filename.startswith('index')]
+    all_passed = (
+        all_passed
+        and len(pages) == sum(-(-count // 3) for count in counts.values())
+        and len(index_pages) == 67
+        and [filename for filename, _ in pages if filename.startswith('index')][:2] == ['index.html', 'index-2.html']
+        and '下一页' in index_pages[0]['listing-pagination']
+        and '上一页' not in index_pages[0]['listing-pagination']
+        and '第 67 / 67 页' in index_pages[-1]['listing-pagination']
+    )
+    
+    all_passed = (
+        all_passed
+        and month_of('2024-3-05') == '2024-03' and month_of('2024年11月') == '2024-11'
+        and month_of('未知') is None
+        and spec.record('x.html', {'tags': 'a, b，a、c'})[1:3] == ('x.html', ('a', 'b', 'c'))
+        and slugify('python') == 'python'
+        and slugify('a/b') != slugify('a b') and '/' not in slugify('a/b')
+        and listing_filename('month:2024-06', 2) == 'archive-2024-06-2.html'
+        and listing_filename('tag:网页', 1) == 'tag-网页.html'
+    )
+    
+    if all_passed:
+        print("\n✓ Listing entries are sorted and paginated correctly")
+    else:
+        print("\n❌ Listing entries were sorted or paginated incorrectly")
+    
+    assert all_passed
+    return all_passed
+
+
+def test_output_pipeline():
+    """Test HTML minification and the precompressed .gz siblings"""
+    import gzip
+    from postprocess import OutputPipeline, gzip_bytes, minify_html, read_gzip_comment
+    
+    page = (
+        '<!DOCTYPE html>\n<html>\n  <head>\n    <!-- 注释 -->\n'
+        '    <style>\n      p  { margin: 0; }\n    </style>\n'
+        '    <!--[if lt IE 9]><script src="x.js"></script><![endif]-->\n  </head>\n'
+        '  <body>\n    <p class="title">  标题　 文字  </p>\n'
+        '    <PRE>  第一行\n    第二行 </PRE>\n'
+        '    <textarea>  a\n  b</textarea>\n'
+        '    <script>\n      // 注释\n      var a  = 1;\n    </script>\n'
+        '  </body>\n</html>\n'
+    ).encode('utf-8')
+    expected = (
+        '<!DOCTYPE html>\n<html>\n<head>\n'
+        '<style>\n      p  { margin: 0; }\n    </style>\n'
+        '<!--[if lt IE 9]><script src="x.js"></script><![endif]-->\n</head>\n'
+        '<body>\n<p class="title"> 标题　 文字 </p>\n'
+        '<PRE>  第一行\n    第二行 </PRE>\n'
+        '<textarea>  a\n  b</textarea>\n'
+        '<script>\n      // 注释\n      var a  = 1;\n    </script>\n'
+        '</body>\n</html>\n'
+    ).encode('utf-8')
+    minified = minify_html(page)
+    all_passed = minified == expected and minify_html(minified) == minified
+    
+    # Custom elements named like pre or style are minified like any other
+    custom = b'<pre-block>  a   b  </pre-block>\n  <p>  x   y </p>\n<pre>  k   </pre>'
+    all_passed = (all_passed
+                  and minify_html(custom) == b'<pre-block> a b </pre-block>\n<p> x y </p>\n<pre>  k   </pre>')
+    
+    compressed = gzip_bytes(minified, 6, b'note')
+    all_passed = (
+        all_passed
+        and gzip.decompress(compressed) == minified
+        and gzip_bytes(minified, 6, b'note') == compressed
+    )
+    
+    with tempfile.TemporaryDirectory() as work_dir:
+        path = os.path.join(work_dir, 'page.html')
+        pipeline = OutputPipeline(minify=True, gzip_level=9)
+        first = pipeline.write(path, page)
+        with open(path, 'rb') as f:
+            written = f.read()
+        with open(path + '.gz', 'rb') as f:
+            unzipped = gzip.decompress(f.read())
+        comment = read_gzip_comment(path + '.gz')
+        compressed_size = os.path.getsize(path + '.gz')
+        
+        # The same content is not compressed again; other content or another
+        # level is
+        second = pipeline.write(path, page + b'  ')
+        third = OutputPipeline(minify=True, gzip_level=1).write(path, page)
+        fourth = OutputPipeline(minify=True, gzip_level=1).write(path, page.replace(b'title', b'name'))
+        
+        all_passed = (
+            all_passed
+            and written == unzipped == expected
+            and comment is not None and comment.startswith(b'sha256=')
+            and first.recompressed and (first.rendered, first.output) == (len(page), len(expected))
+            and first.compressed == compressed_size
+            and not second.recompressed and second.compressed == first.compressed
+            and third.recompressed and fourth.recompressed
+            and read_gzip_comment(path) is None
+            and OutputPipeline(minify=True).write(path, page).compressed is None
+            and not os.path.exists(path + '.gz')
+        )
+    
+    try:
+        OutputPipeline(gzip_level=10)
+        all_passed = False
+    except ValueError:
+        pass
+    
+    if all_passed:
+        print("\n✓ Pages are minified and precompressed correctly")
+    else:
+        print("\n❌ Minification or compression produced wrong output")
+    
+    assert all_passed
+    return all_passed
+
+
+def test_asset_fingerprinting():
+    """Test that asset references are rewritten to content-hashed names"""
+    import hashlib
+    from assets import AssetPipeline, fingerprinted_url
+    
+    with tempfile.TemporaryDirectory() as work_dir:
+        site_dir = os.path.join(work_dir, 'site')
+        output_dir = os.path.join(work_dir, 'output')
+        cache_path = os.path.join(work_dir, 'hashes.json')
+        os.makedirs(os.path.join(site_dir, 'src', 'css'))
+        os.makedirs(os.path.join(site_dir, 'src', 'bg'))
+        
+        def write(name, data):
+            with open(os.path.join(site_dir, *name.split('/')), 'wb') as f:
+                f.write(data)
+        
+        write('src/css/main_style.css', b'body { margin: 0; }')
+        write('src/bg/inside.png', b'\x89PNG')
+        write('src/about.html', b'<html></html>')
+        css_hash = hashlib.sha256(b'body { margin: 0; }').hexdigest()[:10]
+        png_hash = hashlib.sha256(b'\x89PNG').hexdigest()[:10]
+        
+        template = (
+            '<link href="/src/css/main_style.css" rel="stylesheet">\n'
+            "<link rel='icon' href='/src/css/main_style.css?v=2'>\n"
+            '<style>body { background: url( "/src/bg/inside.png" ); } div { background: url(/src/bg/inside.png); }</style>\n'
+            '<a href="/src/about.html">关于</a> <a href="/src/cn/ind">返回</a>\n'
+            '<script src="//cdn.example.com/src/css/main_style.css"></script>\n'
+            '<img src="static/img/3.jpg"><p class="title">/src/css/main_style.css</p>\n'
+        )
+        expected = (
+            f'<link href="/src/css/main_style.{css_hash}.css" rel="stylesheet">\n'
+            f"<link rel='icon' href='/src/css/main_style.{css_hash}.css?v=2'>\n"
+            f'<style>body {{ background: url( "/src/bg/inside.{png_hash}.png" ); }} '
+            f'div {{ background: url(/src/bg/inside.{png_hash}.png); }}</style>\n'
+            '<a href="/src/about.html">关于</a> <a href="/src/cn/ind">返回</a>\n'
+            '<script src="//cdn.example.com/src/css/main_style.css"></script>\n'
+            '<img src="static/img/3.jpg"><p class="title">/src/css/main_style.css</p>\n'
+        )
+        
+        assets = AssetPipeline(site_dir, output_dir, cache_path)
+        rewritten = assets.rewrite(template)
+        assets.save()
+        with open(os.path.join(output_dir, 'src', 'css', f'main_style.{css_hash}.css'), 'rb') as f:
+            copied_css = f.read()
+        
+        all_passed = (
+            rewritten == expected
+            and copied_css == b'body { margin: 0; }'
+            and os.path.exists(os.path.join(output_dir, 'src', 'bg', f'inside.{png_hash}.png'))
+            and (assets.hashes.misses, assets.copied, assets.references) == (2, 2, 4)
+            and assets.missing == {'/src/cn/ind'}
+            and assets.rewrite('<p>无资源</p>') == '<p>无资源</p>'
+        )
+        
+        # A new pipeline reads the hashes from the cache; a changed file is
+        # hashed again and gets a new name
+        again = AssetPipeline(site_dir, output_dir, cache_path)
+        all_passed = all_passed and again.rewrite(template) == expected and again.hashes.misses == 0
+        all_passed = all_passed and again.copied == 0
+        write('src/css/main_style.css', b'body { margin: 1px; }')
+        changed = AssetPipeline(site_dir, output_dir, cache_path)
+        new_hash = hashlib.sha256(b'body { margin: 1px; }').hexdigest()[:10]
+        all_passed = (
+            all_passed
+            and f'/src/css/main_style.{new_hash}.css' in changed.rewrite(template)
+            and (changed.hashes.misses, changed.hashes.hits) == (1, 1)
+        )
+    
+    all_passed = (
+        all_passed
+        and fingerprinted_url('/src/js/jquery.min.js', 'abc') == '/src/js/jquery.min.abc.js'
+        and fingerprinted_url('/src/LICENSE', 'abc') == '/src/LICENSE.abc'
+    )
+    
+    if all_passed:
+        print("\n✓ Asset references are fingerprinted and hashes are cached")
+    else:
+        print("\n❌ Asset references were rewritten incorrectly")
+    
+    assert all_passed
+    return all_passed
+
+
+def test_search_index():
+    """Test tokenization and incremental updates of the sharded search index"""
+    import json
+    from search_index import (SearchIndex, SearchSpec, decode_postings, encode_postings, shard_key,
+                              tokenize)
+    
+    all_passed = True
+    cases = [
+        ('Bibliothèque NAÏVE Straße', ['bibliotheque', 'naive', 'strasse']),
+        ('页面生成', ['页面', '面生', '生成']),
+        ('东京タワーで', ['东京', '京タ', 'タワ', 'ワー', 'ーで']),
+        ('字 ＡＢＣ１２', ['字', 'abc12']),
+        ('한국어 snake_case', ['한국', '국어', 'snake', 'case']),
+    ]
+    for text, expected in cases:
+        terms = list(tokenize(text))
+        if terms != expected:
+            print(f"❌ tokenize({text!r}) = {terms}, expected {expected}")
+            all_passed = False
+    all_passed = (
+        all_passed
+        and shard_key('bibliotheque') == 'bi' and shard_key('a') == 'a'
+        and shard_key('页面') == shard_key('页') != shard_key('面生')
+        and decode_postings(encode_postings([3, 1, 7, 2])) == [3, 1, 7, 2]
+        and encode_postings([3, 1, 7, 2]) == [3, 1, 4, 2]
+    )
+    
+    with tempfile.TemporaryDirectory() as work_dir:
+        output_dir = os.path.join(work_dir, 'output')
+        search_dir = os.path.join(output_dir, 'search')
+        pages = {
+            'a.html': ('h1', {'title': '<b>页面</b> &amp; cache', 'content': 'static site 静态网站'}),
+            'b.html': ('h1', {'title': 'Other', 'content': 'static pages'}),
+            'c.html': ('h1', {'title': '', 'content': 'zebra'}),
+        }
+        
+        def build(pages):
+            index = SearchIndex(output_dir, SearchSpec())
+            for filename, (digest, values) in pages.items():
+                if index.spec.needs(filename, digest):
+                    index.add(filename, digest, index.spec.document(filename, values))
+            index.finish(pages)
+            return index
+        
+        def shard(key):
+            path = os.path.join(search_dir, f'{key}.json')
+            if not os.path.exists(path):
+                return None
+            with open(path, 'r', encoding='utf-8') as f:
+                return {term: decode_postings(postings) for term, postings in json.load(f).items()}
+        
+        first = build(pages)
+        with open(os.path.join(search_dir, 'docs-0.json'), 'r', encoding='utf-8') as f:
+            docs = json.load(f)
+        all_passed = (
+            all_passed
+            and first.updated == 3
+            and shard('st')['static'] == [0, 1, 1, 1]
+            and shard(shard_key('页面'))['页面'] == [0, 1]
+            and docs == {'0': ['a.html', '页面 & cache'], '1': ['b.html', 'Other'], '2': ['c.html', 'c.html']}
+        )
+        
+        # Nothing changed: nothing is tokenized or written
+        mtime = os.stat(os.path.join(search_dir, 'ca.json')).st_mtime_ns
+        same = build(pages)
+        all_passed = all_passed and (same.updated, same.shards_written) == (0, 0)
+        
+        # Only the shards of the edited and the removed page are rewritten
+        pages['b.html'] = ('h2', {'title': 'Other', 'content': 'zoo'})
+        del pages['c.html']
+        changed = build(pages)
+        all_passed = (
+            all_passed
+            and (changed.updated, changed.removed) == (1, 1)
+            and shard('st')['static'] == [0, 1]
+            and shard('zo')['zoo'] == [1, 1]
+            and shard('ze') is None
+            and os.stat(os.path.join(search_dir, 'ca.json')).st_mtime_ns == mtime
+            and changed.shards_written == len({'st', 'pa', 'zo', 'ze', 'ot'})
+        )
+        
+        # Another field selection rebuilds the index from scratch
+        narrow = SearchIndex(output_dir, SearchSpec(['title']))
+        all_passed = all_passed and narrow.spec.known == {}
+    
+    if all_passed:
+        print("\n✓ Search index tokenizes CJK and Latin text and updates changed pages only")
+    else:
+        print("\n❌ Search index is incorrect")
+    
+    assert all_passed
+    return all_passed
+
+
+def test_atomic_write_permissions():
+    """Test that atomically written files get the mode open() would give them"""
+    from page_writer import write_file
+    
+    with tempfile.TemporaryDirectory() as work_dir:
+        plain_path = os.path.join(work_dir, 'plain.html')
+        with open(plain_path, 'wb') as f:
+            f.write(b'<p>plain</p>')
+        plain_mode = os.stat(plain_path).st_mode & 0o777
+        
+        new_path = os.path.join(work_dir, 'page.html')
+        write_file(new_path, b'<p>new</p>')
+        new_mode = os.stat(new_path).st_mode & 0o777
+        
+        kept_path = os.path.join(work_dir, 'kept.html')
+        write_file(kept_path, b'<p>old</p>')
+        os.chmod(kept_path, 0o640)
+        write_file(kept_path, b'<p>rewritten</p>')
+        kept_mode = os.stat(kept_path).st_mode & 0o777
+    
+    all_passed = new_mode == plain_mode and new_mode != 0o600 and kept_mode == 0o640
+    if all_passed:
+        print("\n✓ Written files get the default mode and keep an existing one")
+    else:
+        print(f"\n❌ Unexpected file modes: {new_mode:o} (open() gives {plain_mode:o}), {kept_mode:o}")
+    
+    assert all_passed
+    return all_passed
+
+
+def test_field_model():
+    """Test the widget-free field model behind the GUI field list"""
+    model = FieldModel([
+        {'class': 'title', 'content': '标题', 'start_pos': (1, 0)},
+        {'class': 'body', 'content': '内容', 'start_pos': (2, 0)},
+        {'class': 'title', 'content': '副标题', 'start_pos': (3, 0)},
+    ])
+    
+    model.set('body', '  新内容\n')
+    all_passed = (
+        model.names == ['title', 'body']
+        and model.render_values() == {'title': '副标题', 'body': '新内容'}
+    )
+    
+    model.reset()
+    all_passed = all_passed and model.get('body') == '内容'
+    
+    if all_passed:
+        print("\n✓ Field model keeps values, defaults and render input")
+    else:
+        print("\n❌ Field model returned unexpected values")
+    
+    assert all_passed
+    return all_passed
+
+
+def test_headless_imports():
+    """Test that the core modules and the CLI start without loading tkinter"""
+    import subprocess
+    
+    code = (
+        "import sys, html_utils, page_writer, template_index, batch, preview_server, watch, page_maker\n"
+        "with batch.instrumentation.profiled(): pass\n"
+        "print(' '.join(m for m in ('tkinter', 'asyncio', 'concurrent.futures', 'cProfile', 'tracemalloc')\n"
+        "               if m in sys.modules))"
+    )
+    process = subprocess.run([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                             capture_output=True, text=True)
+    loaded = process.stdout.split()
+    all_passed = process.returncode == 0 and not loaded
+    
+    if all_passed:
+        print("\n✓ Core modules import without tkinter, asyncio, process pools or profilers")
+    else:
+        print(f"\n❌ Importing the core modules loaded: {loaded or process.stderr}")
+    
+    assert all_passed
+    return all_passed
+
+
+def test_instrumentation():
+    """Test that stages and counters are recorded only while instrumentation is on"""
+    template_path = os.path.join(os.path.dirname(__file__), 'templates', 'lit_init.html')
+    
+    recorder = instrumentation.enable(trace=True)
+    try:
+        template, fields, compiled = TemplateCache(None).load(template_path)
+        compiled.render_to(io.BytesIO(), {field['class']: '内容' for field in fields})
+    finally:
+        instrumentation.disable()
+    
+    # Nothing is recorded once it is off
+    compiled.render({})
+    
+    report = recorder.report()
+    events = recorder.trace_events()
+    all_passed = (
+        set(report['stages']) == {'read', 'parse', 'compile', 'escape', 'render'}
+        and report['stages']['render']['calls'] == 1
+        and report['counters']['bytes_read'] == os.path.getsize(template_path)
+        and report['counters']['fields_found'] == len(fields)
+        and report['counters']['substitutions'] == len(fields)
+        and len(events) == 5 and all(event['ph'] == 'X' for event in events)
+    )
+    
+    if all_passed:
+        print(f"\n✓ Instrumentation recorded {len(report['stages'])} stages and {len(report['counters'])} counters")
+    else:
+        print(f"\n❌ Unexpected instrumentation report: {report}")
+    
+    assert all_passed
+    return all_passed
+
+
 def test_output_directory():
     """Test that output directory exists"""
     output_dir = os.path.join(os.path.dirname(__file__), 'output')
@@ -72,11 +949,30 @@ if __name__ == "__main__":
     print("Page Maker - Testing Core Functionality")
     print("=" * 60)
     
-    test1 = test_template_parsing()
-    test2 = test_output_directory()
+    results = [
+        test_template_parsing(),
+        test_scanner_matches_parser(),
+        test_field_table_compatibility(),
+        test_compiled_template_matches_chained(),
+        test_escaping_policies(),
+        test_streaming_render(),
+        test_mapped_template_matches_compiled(),
+        test_template_cache(),
+        test_template_index(),
+        test_template_layouts(),
+        test_listing_spool(),
+        test_output_pipeline(),
+        test_asset_fingerprinting(),
+        test_search_index(),
+        test_atomic_write_permissions(),
+        test_field_model(),
+        test_headless_imports(),
+        test_instrumentation(),
+        test_output_directory(),
+    ]
     
     print("\n" + "=" * 60)
-    if test1 and test2:
+    if all(results):
         print("✅ All tests passed!")
         sys.exit(0)
     else:
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Watch mode - re-render only the pages affected by a change
+
+Polls the templates directory and a content directory of manifests (JSONL
+or CSV files in the batch format) with os.stat, and keeps a map from every
+template and manifest to the output pages built from it. When files change,
+only those pages are rendered again; a changed layout or partial re-renders
+the pages of the templates built from it. A burst of saves within the
+debounce interval is handled as one rebuild.
+
+    python3 page_maker.py watch --content-dir content
+"""
+
+import argparse
+import os
+import sys
+import time
+
+from batch import (DEFAULT_OUTPUT_DIR, DEFAULT_TEMPLATES_DIR, MalformedRow, TemplateStore,
+                   read_manifest, split_row, write_output)
+from html_utils import TemplateCache
+from postprocess import add_arguments as add_pipeline_arguments, pipeline_from_args, remove_gzip_sibling
+from template_loader import normalize_name
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CONTENT_DIR = os.path.join(BASE_DIR, 'content')
+
+DEFAULT_INTERVAL = 0.5
+DEFAULT_DEBOUNCE = 0.3
+
+MANIFEST_EXTENSIONS = ('.jsonl', '.json', '.csv')
+
+
+class RebuildStats:
+    """What one build or rebuild did"""
+
+    def __init__(self):
+        self.pages = 0
+        self.removed = 0
+        self.errors = 0
+        self.elapsed = 0.0
+
+    def summary(self):
+        summary = f"Rendered {self.pages} page(s), removed {self.removed} in {self.elapsed:.2f}s"
+        if self.errors:
+            summary += f", {self.errors} error(s)"
+        return summary
+
+
+class Watcher:
+    """
+    Keeps an output directory in sync with templates and content manifests.
+
+    Attributes:
+        pages: Output filename -> (manifest path, template name, values)
+            of every page listed
+        template_pages: Normalized template name -> set of output filenames
+        manifest_pages: Manifest path -> set of output filenames
+        pipeline: OutputPipeline every page goes through, or None
+    """
+
+    def __init__(self, templates_dir=DEFAULT_TEMPLATES_DIR, content_dir=DEFAULT_CONTENT_DIR,
+                 output_dir=DEFAULT_OUTPUT_DIR, escape_html=True, cache=None, pipeline=None):
+        self.templates_dir = templates_dir
+        self.content_dir = content_dir
+        self.output_dir = output_dir
+        self.escape_html = escape_html
+        self.pipeline = pipeline
+        self.store = TemplateStore(templates_dir, cache=cache if cache is not None else TemplateCache())
+        self.pages = {}
+        self.template_pages = {}
+        self.manifest_pages = {}
+        self.snapshot = {}
+
+    def scan(self):
+        """
+        Stat every template and manifest.
+
+        Returns:
+            Dict of (kind, name) -> (mtime_ns, size) where kind is 'template'
+            (name relative to templates_dir) or 'manifest' (path)
+        """
+        snapshot = {}
+        for kind, root, extensions in (('template', self.templates_dir, ('.html',)),
+                                       ('manifest', self.content_dir, MANIFEST_EXTENSIONS)):
+            for directory, dirnames, filenames in os.walk(root):
+                dirnames[:] = [name for name in dirnames if not name.startswith('.')]
+                for filename in filenames:
+                    if filename.startswith('.') or not filename.lower().endswith(extensions):
+                        continue
+                    path = os.path.join(directory, filename)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    name = normalize_name(os.path.relpath(path, root)) if kind == 'template' else path
+                    snapshot[(kind, name)] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+
+    def changes(self):
+        """
+        Rescan and return the set of (kind, name) keys that were added,
+        modified or removed since the last scan
+        """
+        snapshot = self.scan()
+        changed = {key for key, signature in snapshot.items() if self.snapshot.get(key) != signature}
+        changed.update(key for key in self.snapshot if key not in snapshot)
+        self.snapshot = snapshot
+        return changed
+
+    def build(self):
+        """Render every page of every manifest"""
+        self.snapshot = self.scan()
+        return self.rebuild(set(self.snapshot))
+
+    def rebuild(self, changed):
+        """
+        Re-render the pages that depend on the changed files.
+
+        Changed manifests are re-read: new or edited rows are rendered and
+        pages of deleted rows are removed. Pages of a changed template, or
+        of a template that extends or includes it, are all rendered again.
+
+        Returns:
+            RebuildStats
+        """
+        started = time.perf_counter()
+        stats = RebuildStats()
+        dirty = set()
+
+        for kind, name in changed:
+            if kind == 'template':
+                for template_name in {name} | self.store.loader.dependents(name):
+                    for filename in self.template_pages.get(template_name, ()):
+                        self.store.discard(self.pages[filename][1])
+                        dirty.add(filename)
+
+        for kind, name in sorted(changed):
+            if kind == 'manifest':
+                dirty.update(self._reload_manifest(name, stats))
+
+        for filename in sorted(dirty):
+            if filename not in self.pages:
+                continue
+            manifest_path, template_name, values = self.pages[filename]
+            try:
+                compiled = self.store.get(template_name)
+                write_output(self.output_dir, filename, compiled, values, self.escape_html,
+                             pipeline=self.pipeline)
+            except (OSError, ValueError) as e:
+                stats.errors += 1
+                print(f"{manifest_path}: {filename}: {e}", file=sys.stderr)
+                continue
+            stats.pages += 1
+
+        stats.elapsed = time.perf_counter() - started
+        return stats
+
+    def _reload_manifest(self, manifest_path, stats):
+        """
+        Re-read one manifest and update the dependency maps.
+
+        Returns:
+            Output filenames that must be rendered
+        """
+        rows = {}
+        if os.path.exists(manifest_path):
+            try:
+                for line_number, row in read_manifest(manifest_path):
+                    if isinstance(row, MalformedRow):
+                        raise ValueError(f"line {line_number}: {row.error}")
+                    try:
+                        template_name, filename, values = split_row(row)
+                    except ValueError as e:
+                        stats.errors += 1
+                        print(f"{manifest_path}:{line_number}: {e}", file=sys.stderr)
+                        continue
+                    rows[filename] = (template_name, values)
+            except (OSError, ValueError) as e:
+                # Half-saved file: keep the pages until the next change
+                stats.errors += 1
+                print(f"{manifest_path}: {e}", file=sys.stderr)
+                return set()
+
+        dirty = set()
+        for filename in self.manifest_pages.pop(manifest_path, set()) - set(rows):
+            self._forget_page(filename)
+            path = os.path.join(self.output_dir, filename)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            remove_gzip_sibling(path)
+            stats.removed += 1
+
+        for filename, (template_name, values) in rows.items():
+            old = self.pages.get(filename)
+            if old is not None and old[0] != manifest_path:
+                print(f"{manifest_path}: {filename} is also listed in {old[0]}; using this one",
+                      file=sys.stderr)
+                self.manifest_pages.get(old[0], set()).discard(filename)
+            if old is not None and old[1:] == (template_name, values):
+                self.pages[filename] = (manifest_path, template_name, values)
+                self.manifest_pages.setdefault(manifest_path, set()).add(filename)
+                continue
+            if old is not None:
+                self._forget_page(filename)
+            self.pages[filename] = (manifest_path, template_name, values)
+            self.template_pages.setdefault(normalize_name(template_name), set()).add(filename)
+            self.manifest_pages.setdefault(manifest_path, set()).add(filename)
+            dirty.add(filename)
+        return dirty
+
+    def _forget_page(self, filename):
+        _, template_name, _ = self.pages.pop(filename)
+        dependents = self.template_pages.get(normalize_name(template_name))
+        if dependents is not None:
+            dependents.discard(filename)
+
+    def wait_for_changes(self, interval=DEFAULT_INTERVAL, debounce=DEFAULT_DEBOUNCE):
+        """
+        Block until something changed and then stayed quiet for `debounce`
+        seconds.
+
+        Returns:
+            The set of changed (kind, name) keys
+        """
+        changed = set()
+        while not changed:
+            time.sleep(interval)
+            changed = self.changes()
+        quiet_since = time.monotonic()
+        while time.monotonic() - quiet_since < debounce:
+            time.sleep(min(interval, debounce))
+            more = self.changes()
+            if more:
+                changed |= more
+                quiet_since = time.monotonic()
+        return changed
+
+    def run(self, interval=DEFAULT_INTERVAL, debounce=DEFAULT_DEBOUNCE):
+        """Build once, then rebuild on every change until interrupted"""
+        print(self.build().summary())
+        while True:
+            changed = self.wait_for_changes(interval, debounce)
+            names = ', '.join(sorted(name for _, name in changed))
+            print(f"Changed: {names}")
+            print(self.rebuild(changed).summary())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='page_maker.py watch',
+        description='Rebuild pages whenever their templates or content manifests change'
+    )
+    parser.add_argument('--content-dir', default=DEFAULT_CONTENT_DIR,
+                        help='directory of .jsonl/.csv manifests to build (default: %(default)s)')
+    parser.add_argument('--templates-dir', default=DEFAULT_TEMPLATES_DIR,
+                        help='directory the template names are relative to')
+    parser.add_argument('--output-dir', default=DEFAULT_OUTPUT_DIR,
+                        help='directory the pages are written to')
+    parser.add_argument('--no-escape', action='store_true', help='insert field values as raw HTML')
+    parser.add_argument('--interval', type=float, default=DEFAULT_INTERVAL,
+                        help='seconds between polls (default: %(default)s)')
+    parser.add_argument('--debounce', type=float, default=DEFAULT_DEBOUNCE,
+                        help='seconds without changes before rebuilding (default: %(default)s)')
+    add_pipeline_arguments(parser)
+    args = parser.parse_args(argv)
+    pipeline = pipeline_from_args(parser, args)
+
+    if not os.path.isdir(args.content_dir):
+        parser.error(f'content directory not found: {args.content_dir}')
+
+    watcher = Watcher(args.templates_dir, args.content_dir, args.output_dir,
+                      escape_html=not args.no_escape, pipeline=pipeline)
+    print(f"Watching {args.templates_dir} and {args.content_dir} (Ctrl+C to stop)")
+    try:
+        watcher.run(args.interval, args.debounce)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())